@@ -1,11 +1,17 @@
 import datetime
 import os
 
-import redis
-
 from magictrade.broker import Broker
 
-storage = redis.StrictRedis(host=os.environ.get("REDIS_HOST", "localhost"), decode_responses=True)
+
+def __getattr__(name: str):
+    # Create the Redis client on first use so that importing the package does not require it.
+    if name == 'storage':
+        global storage
+        import redis
+        storage = redis.StrictRedis(host=os.environ.get("REDIS_HOST", "localhost"), decode_responses=True)
+        return storage
+    raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
 
 
 class Position:
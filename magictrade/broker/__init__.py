@@ -1,8 +1,15 @@
 from abc import ABC, abstractmethod
 from datetime import datetime
+from inspect import isfunction
 from typing import Tuple, Any, List, Dict
 
-from magictrade.broker.registry import brokers
+from magictrade.broker.registry import brokers, get_broker, BROKER_MODULES
+from magictrade.metrics import timed
+
+# Broker methods that are timed when metrics are enabled. Most of these make a request to the broker's API.
+INSTRUMENTED_METHODS = ('get_quote', 'get_options', 'get_options_data', 'filter_options', 'options_positions',
+                        'options_positions_data', 'stock_positions', 'options_transact', 'buy', 'sell',
+                        'cancel_order', 'replace_order', 'get_order')
 
 
 def load_brokers():
@@ -29,6 +36,13 @@ class NonexistentAssetError(Exception):
 
 
 class Broker(ABC):
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        for method in INSTRUMENTED_METHODS:
+            if isfunction(func := cls.__dict__.get(method)):
+                setattr(cls, method, timed('broker_call', broker=getattr(cls, 'name', cls.__name__),
+                                           method=method)(func))
+
     @abstractmethod
     def filter_options(self, options: List, exp_dates: List = [], option_type: str = None) -> List:
         pass
@@ -104,10 +118,8 @@ class Broker(ABC):
         pass
 
     def log_balance(self):
-        from magictrade import storage
-        value = self.get_value()
-        storage.rpush(self.account_id + ':dates', self.date.strftime("%Y-%m-%d %H-%M-%S"))
-        storage.rpush(self.account_id + ':values', value)
+        from magictrade.history import AccountHistory
+        AccountHistory(self.account_id).add(self.date.timestamp(), self.get_value())
 
     @staticmethod
     def parse_leg(leg: Dict) -> (Dict, str):
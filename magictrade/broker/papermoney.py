@@ -1,20 +1,20 @@
 import os
 import secrets
 import uuid
+from bisect import bisect_right
 from datetime import datetime
 from typing import Tuple, Dict, List, Any
 
-import requests
-
 from magictrade import Position
 from magictrade.broker import Broker, InsufficientFundsError, NonexistentAssetError
 from magictrade.broker.registry import register_broker
 from magictrade.broker.robinhood import RobinhoodBroker, RHOption, RHOptionOrder
+from magictrade.datasource import DataSource
+from magictrade.datasource.chains import SyntheticOptionChains
+from magictrade.datasource.quotes import AlphaVantageDataSource, CachedDataSource
 from magictrade.securities import InvalidOptionError
 from magictrade.utils import from_date_format, date_format
 
-API_KEY = "3KODWEPB1ZR37OT7"
-
 
 @register_broker
 class PaperMoneyBroker(Broker):
@@ -23,18 +23,18 @@ class PaperMoneyBroker(Broker):
     def __init__(self, balance: int = 1_000_000, data: Dict = {}, account_id: str = None,
                  date: str = None, data_files: List[Tuple[str, str]] = [],
                  options_data: Dict = [], exp_dates: Dict = {},
-                 buying_power: float = 0.0, broker: Broker = None):
+                 buying_power: float = 0.0, broker: Broker = None,
+                 option_chains: SyntheticOptionChains = None, data_source: DataSource = None):
         self._balance = balance
         self.stocks = {}
         self.options = {}
         self.broker = broker
-        try:
-            self._date = from_date_format(date)
-        except Exception:
-            self._date = date
+        self.date = date
         self.data = data
         self.options_data = options_data
         self.exp_dates = exp_dates
+        self.option_chains = option_chains
+        self._data_source = data_source
         self._buying_power = buying_power
         self._account_id = account_id
         if not data:
@@ -52,6 +52,49 @@ class PaperMoneyBroker(Broker):
             self._account_id = account_id or secrets.token_urlsafe(6)
             self.option = RHOption
 
+    @property
+    def options(self):
+        return self._options
+
+    @options.setter
+    def options(self, options):
+        self._options = options
+        self._leg_symbols = self._index_leg_symbols(options)
+
+    @staticmethod
+    def _index_leg_symbols(options) -> Dict[str, set]:
+        symbols = {}
+        try:
+            for transaction_id, legs in options.items():
+                for leg in legs:
+                    symbols.setdefault(leg['symbol'], set()).add(transaction_id)
+        except (AttributeError, TypeError):
+            pass
+        return symbols
+
+    @property
+    def options_data(self):
+        return self._options_data
+
+    @options_data.setter
+    def options_data(self, options_data):
+        self._options_data = options_data
+        self._options_index = None
+
+    @property
+    def options_index(self) -> Dict[str, Dict]:
+        """
+        Options data keyed by instrument, built on first use after `options_data` is set.
+        """
+        if self._options_index is None:
+            self._options_index = {}
+            try:
+                for od in reversed(self._options_data):
+                    self._options_index[od['instrument']] = od
+            except (KeyError, TypeError):
+                pass
+        return self._options_index
+
     @property
     def buying_power(self) -> float:
         if self._broker:
@@ -69,11 +112,13 @@ class PaperMoneyBroker(Broker):
     def options_positions_data(self, options: List) -> List:
         if self._broker:
             return self._broker.options_positions_data(options)
+        if self.option_chains:
+            for option in options:
+                option.data.update(self.option_chains.quote_contract(option['option'], self.date))
+            return options
         for option in options:
-            for od in self.options_data:
-                if option['option'] == od['instrument']:
-                    option.data.update(od)
-                    break
+            if od := self.options_index.get(option['option']):
+                option.data.update(od)
         return options
 
     def stock_positions(self) -> List:
@@ -83,6 +128,9 @@ class PaperMoneyBroker(Broker):
     def get_options(self, symbol: str, actually_work: bool = False) -> List:
         if self._broker:
             return self._broker.get_options(symbol)
+        if self.option_chains:
+            self.exp_dates = self.option_chains.expiration_dates(self.date)
+            return self.option_chains.get_chain(symbol, self.date)
         if actually_work:
             return self.options_data[symbol]
         elif self.options_data:
@@ -91,6 +139,8 @@ class PaperMoneyBroker(Broker):
     def get_options_data(self, options: List) -> List:
         if self._broker:
             return self._broker.get_options_data(options)
+        if self.option_chains:
+            return options
         if self.options_data:
             return self.options_data
 
@@ -100,7 +150,7 @@ class PaperMoneyBroker(Broker):
         if exp_dates:
             return [option for option in options if option["expiration_date"] == exp_dates[0]]
         elif option_type:
-            return [RHOption(o) for o in options if o["type"] == option_type]
+            return [RHOption.record(o) for o in options if o["type"] == option_type]
 
     def get_value(self) -> float:
         if self._broker:
@@ -120,8 +170,74 @@ class PaperMoneyBroker(Broker):
     def date(self, date: str):
         try:
             self._date = from_date_format(date)
-        except ValueError:
+        except (TypeError, ValueError):
             self._date = date
+        # Formatted once here, so that quote lookups are a plain dict access.
+        try:
+            self._date_key = date_format(self._date)
+        except AttributeError:
+            self._date_key = None
+        self._day = None
+
+    @property
+    def data(self) -> Dict:
+        return self._data
+
+    @data.setter
+    def data(self, data: Dict):
+        self._data = data
+        self._trading_days = None
+        self._day = None
+
+    @property
+    def data_source(self) -> DataSource:
+        """
+        Source of current quotes when there is no local data, AlphaVantage by default. The default is only created
+        when it is first needed, since it requires an API key.
+        """
+        if self._data_source is None:
+            self._data_source = CachedDataSource(AlphaVantageDataSource())
+        return self._data_source
+
+    @data_source.setter
+    def data_source(self, data_source: DataSource):
+        self._data_source = data_source
+
+    @property
+    def trading_days(self) -> List[str]:
+        """
+        Sorted dates that any symbol has a historic price for.
+        """
+        if self._trading_days is None:
+            self._trading_days = sorted({day for quote in self._data.values() for day in quote.get('history', ())})
+            self._trading_dates = [None] * len(self._trading_days)
+        return self._trading_days
+
+    @property
+    def day(self) -> int:
+        """
+        Index of the current date in `trading_days`. A date that is not a trading day maps to the one before it, or
+        to -1 if it is before all of them.
+        """
+        if self._day is None:
+            self._day = bisect_right(self.trading_days, self._date_key or '') - 1
+        return self._day
+
+    def advance(self, days: int = 1) -> datetime:
+        """
+        Move the clock forward by a number of trading days.
+        :param days: Number of trading days to move.
+        :return: The new date.
+        """
+        day = self.day + days
+        if not 0 <= day < len(self.trading_days):
+            raise IndexError("No price history {} trading days from {}.".format(days, self._date_key))
+        if not (date := self._trading_dates[day]):
+            date = self._trading_dates[day] = from_date_format(self._trading_days[day])
+        self._date = date
+        self._date_key = self._trading_days[day]
+        self._day = day
+        return date
 
     @property
     def account_id(self) -> str:
@@ -133,28 +249,17 @@ class PaperMoneyBroker(Broker):
         if self._broker:
             return self._broker.get_quote(symbol)
         if self.data:
-            if self._date:
-                try:
-                    date = from_date_format(self._date)
-                except Exception:
-                    date = self._date
-                # This is terrible but solves some growing pains :/
+            if self._date_key:
                 try:
-                    return self.data[symbol]['history'][date_format(date)]
-                except (AttributeError, KeyError):
+                    return self.data[symbol]['history'][self._date_key]
+                except KeyError:
                     pass
             try:
                 return self.data[symbol]['price']
             except KeyError:
                 return 0
         else:
-            # TODO: use datasource
-            data = requests.get('https://www.alphavantage.co/query', params={'function': 'GLOBAL_QUOTE',
-                                                                             'symbol': symbol,
-                                                                             'apikey': API_KEY
-                                                                             }
-                                )
-            return float(data.json()['Global Quote']['02. open'])
+            return self.data_source.get_quote(symbol)
 
     @property
     def balance(self) -> float:
@@ -194,6 +299,8 @@ class PaperMoneyBroker(Broker):
         transaction_id = str(uuid.uuid4())
         if isinstance(self.options, dict):
             self.options[transaction_id] = new_legs
+            for leg in new_legs:
+                self._leg_symbols.setdefault(leg['symbol'], set()).add(transaction_id)
         else:
             self.options.append(new_legs) # pylint: disable=no-member
         return RHOptionOrder({'id': transaction_id, 'legs': new_legs})
@@ -233,14 +340,11 @@ class PaperMoneyBroker(Broker):
         raise NotImplementedError
 
     def leg_in_options(self, leg: Dict, options: Dict) -> bool:
-        if self.options:
-            try:
-                for option in self.options.values():
-                    for option_leg in option:
-                        if option_leg['symbol'] == leg['symbol']:
-                            return True
-            except (AttributeError, TypeError):
-                pass
+        symbol = leg.get('symbol')
+        # The index is not updated when `options` is changed in place, so check each hit against it.
+        for transaction_id in self._leg_symbols.get(symbol, ()):
+            if any(held['symbol'] == symbol for held in self.options.get(transaction_id, ())):
+                return True
         if self._broker:
             return self._broker.leg_in_options(leg, options)
         return RobinhoodBroker.leg_in_options(leg, options)
@@ -1,6 +1,26 @@
+from importlib import import_module
+
 brokers = {}
 
+# Module that registers each broker, so that a broker and its API client are only imported once it is selected.
+BROKER_MODULES = {
+    'papermoney': 'magictrade.broker.papermoney',
+    'robinhood': 'magictrade.broker.robinhood',
+    'tdameritrade': 'magictrade.broker.td_ameritrade',
+}
+
 
 def register_broker(broker):
     brokers[broker.name] = broker
     return broker
+
+
+def get_broker(name: str):
+    """
+    Return the broker class registered under the given name, importing its module on first use.
+    :param name: Broker name, as listed in BROKER_MODULES.
+    :return: The broker class.
+    """
+    if name not in brokers:
+        import_module(BROKER_MODULES[name])
+    return brokers[name]
@@ -0,0 +1,63 @@
+import threading
+from functools import wraps
+from time import monotonic
+from typing import Any, Callable, Dict, Tuple
+
+from magictrade.broker import Broker
+
+# Market data that is the same for every account at a broker, and which strategies do not modify.
+SHARED_METHODS = ('get_quote', 'get_options')
+
+
+class MarketDataCache:
+    """
+    Short-lived cache of market data shared by every account that one process trades. The cache is keyed by the
+    broker, so accounts at the same broker reuse each other's quotes and option chains, while brokers that return data
+    in different formats do not mix.
+    """
+
+    def __init__(self, ttl: float = 30):
+        """
+        :param ttl: Seconds to keep a result for.
+        """
+        self.ttl = ttl
+        self._data: Dict[Tuple, Tuple[float, Any]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: Tuple, fetch: Callable[[], Any]) -> Any:
+        now = monotonic()
+        with self._lock:
+            if (entry := self._data.get(key)) and entry[0] > now:
+                return entry[1]
+        value = fetch()
+        with self._lock:
+            self._data[key] = now + self.ttl, value
+        return value
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def share(self, broker: Broker) -> Broker:
+        """
+        Route a broker's market data lookups through the cache. Paper brokers are followed to the live broker that they
+        wrap; paper brokers with their own price data are left alone.
+        :param broker: Broker instance.
+        :return: The same broker.
+        """
+        target = broker
+        while getattr(target, '_broker', None):
+            target = target._broker
+        if target.name == 'papermoney':
+            return broker
+        for method in SHARED_METHODS:
+            setattr(target, method, self._wrap(target.name, method, getattr(target, method)))
+        return broker
+
+    def _wrap(self, broker_name: str, method: str, func: Callable) -> Callable:
+        @wraps(func)
+        def wrapper(symbol: str, *args, **kwargs):
+            return self.get((broker_name, method, symbol, args, tuple(sorted(kwargs.items()))),
+                            lambda: func(symbol, *args, **kwargs))
+
+        return wrapper
@@ -1,4 +1,5 @@
 import uuid
+from datetime import datetime, timezone
 from typing import Tuple, Any, List, Dict, Callable
 
 from tdameritrade import TDClient
@@ -35,6 +36,11 @@ class TDOption(Option):
     def mark_price(self) -> float:
         return self.data['mark']
 
+    @property
+    def expiration_date(self) -> str:
+        # TD sends the expiration time in epoch milliseconds.
+        return datetime.fromtimestamp(self.data['expirationDate'] / 1000, timezone.utc).strftime('%Y-%m-%d')
+
 
 class TDOptionOrder(OptionOrder):
     @property
@@ -143,7 +149,7 @@ class TDAmeritradeBroker(Broker):
                 'call': calls,
             }
         elif option_type:
-            return [TDOption(option[0]) for option in options[option_type.lower()].values()]
+            return [TDOption.record(option[0]) for option in options[option_type.lower()].values()]
 
     def options_transact(self, legs: List[Dict], direction: str, price: float,
                          quantity: int, effect: str = 'open', time_in_force: str = 'DAY',
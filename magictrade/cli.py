@@ -1,6 +1,7 @@
 import argparse
+import json
 
-from magictrade.trade_queue import RedisTradeQueue
+from magictrade.trade_queue import RedisTradeQueue, PRIORITIES
 
 
 def handle_trade(args: argparse.Namespace, trade_queue: RedisTradeQueue):
@@ -18,13 +19,30 @@ def handle_trade(args: argparse.Namespace, trade_queue: RedisTradeQueue):
 
 
 def handle_check(args: argparse.Namespace, trade_queue: RedisTradeQueue):
-    status = trade_queue.get_status(args.identifier)
+    if args.wait:
+        status = trade_queue.wait_for_status(args.identifier, args.timeout)
+        if status is None:
+            print("Timed out waiting for a status.")
+            raise SystemExit(1)
+    else:
+        status = trade_queue.get_status(args.identifier)
     print("Returned status: '{}'".format(status))
 
 
 def handle_list(args: argparse.Namespace, trade_queue: RedisTradeQueue):
-    for identifier in trade_queue:
-        print(identifier, ":", trade_queue.get_data(identifier))
+    for identifier, data, status in trade_queue.iter_with_data(args.batch_size, symbol=args.symbol,
+                                                               strategy=args.strategy, status=args.status,
+                                                               scheduled=not args.queued_only):
+        if args.json:
+            print(json.dumps({'identifier': identifier, 'status': status, **data}), flush=True)
+        else:
+            print(identifier, ":", data, *(["({})".format(status)] if status else []), flush=True)
+
+
+def handle_replay(args: argparse.Namespace, trade_queue: RedisTradeQueue):
+    from magictrade import journal
+    applied = journal.replay(args.journal, since=args.since)
+    print("Replayed {} writes from {}".format(applied, args.journal))
 
 
 def cli():
@@ -35,10 +53,24 @@ def cli():
     trade_parser = subparsers.add_parser('trade', aliases=['t'], help='Place a trade',
                                          formatter_class=argparse.ArgumentDefaultsHelpFormatter)
     check_parser = subparsers.add_parser('check', aliases=['c'], help='Check status of a trade')
+    replay_parser = subparsers.add_parser('replay', help='Rebuild Redis state from a daemon journal')
     check_parser.set_defaults(func=handle_check)
+    replay_parser.set_defaults(func=handle_replay)
     trade_parser.set_defaults(func=handle_trade)
     list_parser.set_defaults(func=handle_list)
+    list_parser.add_argument('-j', '--json', action='store_true', help='Print one JSON object per trade')
+    list_parser.add_argument('-s', '--symbol', help='Only list trades in this symbol')
+    list_parser.add_argument('--strategy', help='Only list trades for this strategy')
+    list_parser.add_argument('--status', help='Only list trades with this status')
+    list_parser.add_argument('--queued-only', action='store_true', help="Don't list trades scheduled for later")
+    list_parser.add_argument('-b', '--batch-size', type=int, default=500, help='Trades to fetch per round trip')
     check_parser.add_argument('identifier', help='Trade identifier returned by this tool when placing a trade')
+    check_parser.add_argument('-w', '--wait', action='store_true',
+                              help='Wait until the trade has been placed, rejected or has failed')
+    check_parser.add_argument('-t', '--timeout', type=float, help='With --wait, most seconds to wait')
+    replay_parser.add_argument('journal', help='Journal file written by magictrade-daemon --journal')
+    replay_parser.add_argument('--since', type=float, default=0,
+                               help='Only replay writes made after this timestamp')
     trade_parser.add_argument('symbol', help="Symbol to trade. e.g. \"SPY\"")
     trade_parser.add_argument('-d', '--direction', default='neutral',
                               choices=('bullish', 'bearish', 'neutral'), help='Type of trade to make')
@@ -66,6 +98,9 @@ def cli():
                                    'cannot be used with timeline')
     trade_parser.add_argument('-w', '--spread-width', type=float, default=3,
                               help='Width of spreads')
+    trade_parser.add_argument('-p', '--priority', default='normal', choices=PRIORITIES,
+                              help='Trades with a higher priority are made before any queued trades of a lower '
+                                   'priority')
     # Use const/default blank string to avoid ambiguity when retrieving from redis
     trade_parser.add_argument('-m', '--monthly', default='', action='store_const', const='true',
                               help='Whether to only trade monthly contracts')
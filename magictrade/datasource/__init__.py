@@ -1,8 +1,26 @@
 from abc import abstractmethod, ABC
-from typing import List
+from typing import Dict, Iterable, List
 
 
 class DataSource(ABC):
+    @abstractmethod
+    def get_quote(self, symbol: str) -> float:
+        """
+        Retrieve the current price for the provided ticker.
+        :param symbol: Ticker symbol to look up.
+        :return: The price.
+        """
+        pass
+
+    def get_quotes(self, symbols: Iterable[str]) -> Dict[str, float]:
+        """
+        Retrieve current prices for several tickers. Sources that can look up many symbols in one request override
+        this.
+        :param symbols: Ticker symbols to look up.
+        :return: Prices keyed by symbol.
+        """
+        return {symbol: self.get_quote(symbol) for symbol in symbols}
+
     @abstractmethod
     def get_historic_close(self, symbol: str, days: int) -> List[float]:
         """
@@ -18,5 +36,8 @@ class DummyDataSource(DataSource, dict):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
 
+    def get_quote(self, symbol: str) -> float:
+        return self['quotes'][symbol]
+
     def get_historic_close(self, symbol: str, days: int):
         return self['history'][symbol][days * -1:]
@@ -0,0 +1,180 @@
+"""
+Synthetic option chains for backtesting, generated from an underlying's daily closes.
+"""
+from bisect import bisect_right
+from collections import OrderedDict
+from datetime import datetime
+from typing import Callable, Dict, List, Union
+
+import numpy as np
+
+from magictrade import pricing
+from magictrade.utils import date_format
+
+# datetime64[D] counts days from 1970-01-01, which was a Thursday.
+FRIDAY = 1
+
+
+def strike_increment(spot: float) -> float:
+    if spot < 25:
+        return 0.5
+    if spot < 200:
+        return 1.0
+    return 5.0
+
+
+def expiration_dates(date: str, max_days: int) -> np.ndarray:
+    """
+    Weekly (Friday) expirations after a date.
+    :param date: Trading date, as formatted by `date_format`.
+    :param max_days: Furthest expiration to list, in calendar days.
+    :return: Expiration dates as datetime64[D].
+    """
+    start = np.datetime64(date, 'D')
+    days = np.arange(start + 1, start + max_days + 1)
+    return days[days.astype('int64') % 7 == FRIDAY]
+
+
+class SyntheticOptionChains:
+    """
+    Builds Robinhood-style option chains for any historical date from the underlying close series and a volatility
+    input, priced with Black-Scholes. Whole chains are priced in one vectorized pass and the most recently used chains
+    are cached per (symbol, date).
+
+    Contracts are identified as `SYMBOL:YYYY-MM-DD:STRIKEc|p`, which is also used as their instrument and leg symbol,
+    so held legs can be repriced on later dates with `quote_contract`.
+    """
+
+    def __init__(self, history: Dict[str, Dict[str, float]],
+                 volatility: Union[float, Callable[[str, str], float]] = 0.3,
+                 max_days: int = 70, strike_range: float = 0.25, rate: float = 0.0, cache_size: int = 64):
+        """
+        :param history: Close prices for each symbol, keyed by formatted date.
+        :param volatility: Annualized volatility as a decimal, or a function of (symbol, date) returning one.
+        :param max_days: Furthest expiration to generate, in calendar days.
+        :param strike_range: Generate strikes within this fraction of the underlying price.
+        :param rate: Annualized risk-free rate.
+        :param cache_size: Number of chains to keep in memory.
+        """
+        self.history = history
+        self.volatility = volatility
+        self.max_days = max_days
+        self.strike_range = strike_range
+        self.rate = rate
+        self.cache_size = cache_size
+        self._dates = {symbol: sorted(closes) for symbol, closes in history.items()}
+        self._chains = OrderedDict()
+
+    @classmethod
+    def from_quotes(cls, data: Dict, **kwargs) -> 'SyntheticOptionChains':
+        """
+        Build from quote data in the format used by `PaperMoneyBroker`.
+        """
+        return cls({symbol: quote['history'] for symbol, quote in data.items() if quote.get('history')}, **kwargs)
+
+    @staticmethod
+    def _date_key(date: Union[str, datetime]) -> str:
+        if isinstance(date, str):
+            return date
+        return date_format(date)
+
+    def get_spot(self, symbol: str, date: Union[str, datetime]) -> float:
+        """
+        Close on the date, or on the last trading day before it.
+        """
+        date = self._date_key(date)
+        dates = self._dates[symbol]
+        index = bisect_right(dates, date)
+        if not index:
+            raise KeyError("No history for {} on or before {}".format(symbol, date))
+        return self.history[symbol][dates[index - 1]]
+
+    def get_volatility(self, symbol: str, date: str) -> float:
+        if callable(self.volatility):
+            return self.volatility(symbol, date)
+        return self.volatility
+
+    def expiration_dates(self, date: Union[str, datetime]) -> List[str]:
+        return [str(d) for d in expiration_dates(self._date_key(date), self.max_days)]
+
+    def get_chain(self, symbol: str, date: Union[str, datetime]) -> List[Dict]:
+        """
+        Option chain for a symbol as of a date.
+        :param symbol: Underlying symbol.
+        :param date: Trading date.
+        :return: Contracts for every expiration and strike. The list is shared by later calls and must not be mutated.
+        """
+        key = (symbol, self._date_key(date))
+        try:
+            self._chains.move_to_end(key)
+            return self._chains[key]
+        except KeyError:
+            pass
+        chain = self._generate(*key)
+        self._chains[key] = chain
+        if len(self._chains) > self.cache_size:
+            self._chains.popitem(last=False)
+        return chain
+
+    def _generate(self, symbol: str, date: str) -> List[Dict]:
+        spot = self.get_spot(symbol, date)
+        volatility = self.get_volatility(symbol, date)
+        step = strike_increment(spot)
+        strikes = np.arange(np.ceil(spot * (1 - self.strike_range) / step) * step,
+                            spot * (1 + self.strike_range) + step / 2, step)
+        expirations = expiration_dates(date, self.max_days)
+        days = (expirations - np.datetime64(date, 'D')).astype(float)
+
+        # One row per (expiration, strike, type).
+        exp_grid, strike_grid, call_grid = (a.ravel() for a in np.meshgrid(np.arange(len(expirations)), strikes,
+                                                                           (True, False), indexing='ij'))
+        days_grid = days[exp_grid]
+        args = (spot, strike_grid, days_grid, volatility, call_grid, self.rate)
+        marks = np.maximum(np.round(pricing.price(*args), 2), 0.01)
+        deltas = np.round(pricing.delta(*args), 4)
+        otm = np.round(pricing.probability_otm(*args), 4)
+
+        exp_strings = [str(e) for e in expirations]
+        chain = []
+        for e, strike, call, mark, d, p in zip(exp_grid.tolist(), strike_grid.tolist(), call_grid.tolist(),
+                                               marks.tolist(), deltas.tolist(), otm.tolist()):
+            option_type = 'call' if call else 'put'
+            instrument = self.format_contract(symbol, exp_strings[e], strike, option_type)
+            chain.append({
+                'id': instrument,
+                'url': instrument,
+                'instrument': instrument,
+                'symbol': instrument,
+                'chain_symbol': symbol,
+                'type': option_type,
+                'strike_price': strike,
+                'expiration_date': exp_strings[e],
+                'mark_price': mark,
+                'delta': d,
+                'chance_of_profit_short': p,
+                'implied_volatility': volatility,
+            })
+        return chain
+
+    @staticmethod
+    def format_contract(symbol: str, expiration: str, strike: float, option_type: str) -> str:
+        return '{}:{}:{:g}{}'.format(symbol, expiration, strike, 'c' if option_type == 'call' else 'p')
+
+    def quote_contract(self, instrument: str, date: Union[str, datetime]) -> Dict:
+        """
+        Reprice a single contract, e.g. a held leg, as of a date. Expired contracts are valued at intrinsic value.
+        :param instrument: Contract identifier from a generated chain.
+        :param date: Trading date.
+        :return: Updated mark, delta and probability fields.
+        """
+        date = self._date_key(date)
+        symbol, expiration, strike = instrument.split(':')
+        call = strike[-1] == 'c'
+        spot = self.get_spot(symbol, date)
+        days = max((np.datetime64(expiration, 'D') - np.datetime64(date, 'D')).astype(float), 0)
+        args = (spot, float(strike[:-1]), days, self.get_volatility(symbol, date), call, self.rate)
+        return {
+            'mark_price': round(float(pricing.price(*args)), 2),
+            'delta': round(float(pricing.delta(*args)), 4),
+            'chance_of_profit_short': round(float(pricing.probability_otm(*args)), 4),
+        }
@@ -0,0 +1,156 @@
+"""
+Quote providers for paper trading: live Alpha Vantage quotes, an in-memory cache in front of any source, and quotes
+recorded to a file for runs that must be deterministic and offline.
+"""
+import json
+import os
+import threading
+from time import monotonic
+from typing import Dict, Iterable, List
+
+import requests
+
+from magictrade.datasource import DataSource
+
+ALPHAVANTAGE_URL = 'https://www.alphavantage.co/query'
+ALPHAVANTAGE_API_KEY = os.environ.get('ALPHAVANTAGE_API_KEY')
+# Most symbols that a bulk quote request accepts.
+ALPHAVANTAGE_BATCH_SIZE = 100
+
+
+class AlphaVantageDataSource(DataSource):
+    def __init__(self, api_key: str = ALPHAVANTAGE_API_KEY, timeout: float = 10):
+        if not api_key:
+            raise ValueError("No AlphaVantage API key; set ALPHAVANTAGE_API_KEY or pass api_key.")
+        self.api_key = api_key
+        self.timeout = timeout
+        self.session = requests.Session()
+
+    def _query(self, function: str, **params) -> Dict:
+        r = self.session.get(ALPHAVANTAGE_URL, params={'function': function, 'apikey': self.api_key, **params},
+                             timeout=self.timeout)
+        r.raise_for_status()
+        return r.json()
+
+    def get_quote(self, symbol: str) -> float:
+        return float(self._query('GLOBAL_QUOTE', symbol=symbol)['Global Quote']['02. open'])
+
+    def get_quotes(self, symbols: Iterable[str]) -> Dict[str, float]:
+        symbols = list(symbols)
+        quotes = {}
+        for i in range(0, len(symbols), ALPHAVANTAGE_BATCH_SIZE):
+            batch = symbols[i:i + ALPHAVANTAGE_BATCH_SIZE]
+            data = self._query('REALTIME_BULK_QUOTES', symbol=','.join(batch))
+            for quote in data.get('data', []):
+                quotes[quote['symbol']] = float(quote['open'])
+        # The bulk endpoint is not available on every plan; look up anything it did not return individually.
+        for symbol in symbols:
+            if symbol not in quotes:
+                quotes[symbol] = self.get_quote(symbol)
+        return quotes
+
+    def get_historic_close(self, symbol: str, days: int) -> List[float]:
+        series = self._query('TIME_SERIES_DAILY', symbol=symbol,
+                             outputsize='compact' if days <= 100 else 'full')['Time Series (Daily)']
+        return [float(series[date]['4. close']) for date in sorted(series)[-days:]]
+
+
+class CachedDataSource(DataSource):
+    """
+    Keeps quotes from another source in memory for a while, and fetches all symbols missing from the cache in one
+    batch.
+    """
+
+    def __init__(self, source: DataSource, ttl: float = 60):
+        """
+        :param source: Source to fetch from on a cache miss.
+        :param ttl: Seconds to keep a quote for.
+        """
+        self.source = source
+        self.ttl = ttl
+        self._quotes = {}
+        self._lock = threading.Lock()
+
+    def get_quote(self, symbol: str) -> float:
+        return self.get_quotes((symbol,))[symbol]
+
+    def get_quotes(self, symbols: Iterable[str]) -> Dict[str, float]:
+        now = monotonic()
+        quotes = {}
+        missing = []
+        with self._lock:
+            for symbol in symbols:
+                try:
+                    price, expires = self._quotes[symbol]
+                except KeyError:
+                    expires = 0
+                if expires > now:
+                    quotes[symbol] = price
+                else:
+                    missing.append(symbol)
+        if missing:
+            fetched = self.source.get_quotes(missing)
+            with self._lock:
+                for symbol, price in fetched.items():
+                    self._quotes[symbol] = price, now + self.ttl
+            quotes.update(fetched)
+        return quotes
+
+    def get_historic_close(self, symbol: str, days: int) -> List[float]:
+        return self.source.get_historic_close(symbol, days)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._quotes.clear()
+
+
+class RecordedDataSource(DataSource):
+    """
+    Quotes and close history read from a JSON file, in the form
+    `{"quotes": {"SPY": 252.39}, "history": {"SPY": [250.1, 251.3]}}`.
+
+    With a `source`, anything not in the file is fetched from it and written back, so that a run can be recorded once
+    and then replayed without network access.
+    """
+
+    def __init__(self, path: str, source: DataSource = None):
+        self.path = path
+        self.source = source
+        self._lock = threading.Lock()
+        try:
+            with open(path) as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            data = {}
+        self.quotes = data.get('quotes', {})
+        self.history = data.get('history', {})
+
+    def save(self) -> None:
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'quotes': self.quotes, 'history': self.history}, f, indent=2, sort_keys=True)
+        os.replace(tmp_path, self.path)
+
+    def get_quote(self, symbol: str) -> float:
+        return self.get_quotes((symbol,))[symbol]
+
+    def get_quotes(self, symbols: Iterable[str]) -> Dict[str, float]:
+        symbols = list(symbols)
+        missing = [symbol for symbol in symbols if symbol not in self.quotes]
+        if missing:
+            if not self.source:
+                raise KeyError("No recorded quote for {}.".format(', '.join(missing)))
+            fetched = self.source.get_quotes(missing)
+            with self._lock:
+                self.quotes.update(fetched)
+                self.save()
+        return {symbol: self.quotes[symbol] for symbol in symbols}
+
+    def get_historic_close(self, symbol: str, days: int) -> List[float]:
+        closes = self.history.get(symbol, [])
+        if len(closes) < days and self.source:
+            closes = self.source.get_historic_close(symbol, days)
+            with self._lock:
+                self.history[symbol] = closes
+                self.save()
+        return closes[days * -1:]
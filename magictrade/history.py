@@ -0,0 +1,207 @@
+"""
+Account value history, stored as raw points for recent data and hourly and daily OHLC rollups for older data, so that
+charts read a number of points proportional to what they display rather than the whole history.
+"""
+from math import ceil
+from typing import Dict, List, Optional, Tuple
+
+from redis import StrictRedis
+
+from magictrade import storage
+
+# Bucket size in seconds for each resolution, finest first. Raw points are not bucketed.
+RESOLUTIONS = {'raw': 0, '1h': 3600, '1d': 86400}
+# Seconds of each resolution to keep; 0 keeps it forever.
+DEFAULT_RETENTION = {'raw': 7 * 86400, '1h': 90 * 86400, '1d': 0}
+
+# Keys: raw points, hourly rollups, daily rollups (all zsets scored by time), sequence counter.
+# Args: timestamp, value, then the raw, hourly and daily retention.
+# Adds a raw point and folds it into the hourly and daily buckets it falls in, then trims each series. Raw members are
+# prefixed with a sequence number so that points with the same time keep their order, and rollup members are
+# "bucket:open:high:low:close".
+RECORD_SCRIPT = """
+local ts = tonumber(ARGV[1])
+local value = ARGV[2]
+local seq = redis.call('INCR', KEYS[4])
+redis.call('ZADD', KEYS[1], ts, string.format('%015d', seq) .. ':' .. value)
+local function rollup(key, size)
+    local bucket = math.floor(ts / size) * size
+    local open, high, low = value, value, value
+    local current = redis.call('ZRANGEBYSCORE', key, bucket, bucket)[1]
+    if current then
+        open, high, low = string.match(current, '^[^:]+:([^:]+):([^:]+):([^:]+):')
+        if tonumber(value) > tonumber(high) then high = value end
+        if tonumber(value) < tonumber(low) then low = value end
+        redis.call('ZREM', key, current)
+    end
+    redis.call('ZADD', key, bucket, table.concat({string.format('%d', bucket), open, high, low, value}, ':'))
+end
+rollup(KEYS[2], 3600)
+rollup(KEYS[3], 86400)
+for i = 1, 3 do
+    local retention = tonumber(ARGV[i + 2])
+    if retention > 0 then
+        redis.call('ZREMRANGEBYSCORE', KEYS[i], '-inf', '(' .. (ts - retention))
+    end
+end
+"""
+
+record_script = storage.register_script(RECORD_SCRIPT)
+
+Point = Tuple[float, float, float, float, float]
+
+
+class AccountHistory:
+    """
+    Time series of an account's value. Points are expected to be added in time order; buckets are aligned to UTC.
+    """
+
+    def __init__(self, account_id: str, retention: Dict[str, int] = None, history_storage: StrictRedis = None):
+        """
+        :param account_id: Account to store values for.
+        :param retention: Seconds to keep for any of `RESOLUTIONS`, overriding `DEFAULT_RETENTION`.
+        :param history_storage: If the redis host is not localhost, pass an externally-created Redis instance here.
+        """
+        self.account_id = account_id
+        self.retention = {**DEFAULT_RETENTION, **(retention or {})}
+        self.storage = history_storage or storage
+
+    def _key(self, resolution: str) -> str:
+        return "{}:history:{}".format(self.account_id, resolution)
+
+    def add(self, timestamp: float, value: float) -> None:
+        record_script(keys=[*(self._key(r) for r in RESOLUTIONS), self._key('seq')],
+                      args=[timestamp, value, *(self.retention[r] for r in RESOLUTIONS)], client=self.storage)
+
+    def backfill(self, points: List[Tuple[float, float]]) -> int:
+        """
+        Add values from before the earliest one recorded so far, e.g. ones logged before the time series existed.
+        Rollup buckets that already have later values keep their closing value and are extended with the older ones.
+        :param points: (timestamp, value) tuples.
+        :return: Number of points added.
+        """
+        if not points:
+            return 0
+        points = sorted(points)
+        rollups = {}
+        for resolution, size in RESOLUTIONS.items():
+            if not size:
+                continue
+            buckets = rollups[resolution] = {}
+            for timestamp, value in points:
+                bucket = timestamp // size * size
+                if bucket in buckets:
+                    open_, high, low, _ = buckets[bucket]
+                    buckets[bucket] = (open_, max(high, value), min(low, value), value)
+                else:
+                    buckets[bucket] = (value, value, value, value)
+        pipe = self.storage.pipeline(transaction=False)
+        pipe.incrby(self._key('seq'), len(points))
+        pipe.zrange(self._key('raw'), -1, -1, withscores=True)
+        for resolution, buckets in rollups.items():
+            for bucket in buckets:
+                pipe.zrangebyscore(self._key(resolution), bucket, bucket)
+        seq, newest, *current = pipe.execute()
+        current = iter(current)
+
+        pipe = self.storage.pipeline()
+        first = seq - len(points) + 1
+        pipe.zadd(self._key('raw'), {'{:015d}:{!r}'.format(first + i, float(value)): timestamp
+                                     for i, (timestamp, value) in enumerate(points)})
+        for resolution, buckets in rollups.items():
+            key = self._key(resolution)
+            for bucket, (open_, high, low, close) in buckets.items():
+                close = repr(float(close))
+                if existing := next(current):
+                    _, _, existing_high, existing_low, close = existing[0].split(':')
+                    high, low = max(high, float(existing_high)), min(low, float(existing_low))
+                    pipe.zrem(key, existing[0])
+                pipe.zadd(key, {':'.join(('{:d}'.format(int(bucket)), *(repr(float(v)) for v in (open_, high, low)),
+                                          close)): bucket})
+        latest = max(points[-1][0], newest[0][1] if newest else points[-1][0])
+        for resolution in RESOLUTIONS:
+            if retention := self.retention[resolution]:
+                pipe.zremrangebyscore(self._key(resolution), '-inf', '(' + repr(latest - retention))
+        pipe.execute()
+        return len(points)
+
+    def delete(self) -> None:
+        self.storage.delete(*(self._key(r) for r in RESOLUTIONS), self._key('seq'))
+
+    def _oldest(self) -> Dict[str, Optional[float]]:
+        pipe = self.storage.pipeline(transaction=False)
+        for resolution in RESOLUTIONS:
+            pipe.zrange(self._key(resolution), 0, 0, withscores=True)
+        return {resolution: first[0][1] if first else None for resolution, first in zip(RESOLUTIONS, pipe.execute())}
+
+    @staticmethod
+    def _plan(oldest: Dict[str, Optional[float]], resolutions: List[str], start: Optional[float],
+              end: Optional[float]) -> List[Tuple[str, str, str]]:
+        """
+        Work out which resolution to read each part of a range from: the finest one that still has data for it.
+        :return: (resolution, min, max) score ranges, most recent first.
+        """
+        plan = []
+        high = '+inf' if end is None else repr(end)
+        for i, resolution in enumerate(resolutions):
+            last = i == len(resolutions) - 1
+            if not last:
+                if oldest[resolution] is None:
+                    continue
+                size = RESOLUTIONS[resolutions[i + 1]]
+                coarser = oldest[resolutions[i + 1]]
+                # If the next resolution has nothing older than this one, this one covers all of the history.
+                last = coarser is None or coarser >= oldest[resolution] // size * size
+                # Otherwise start at a bucket boundary of the next resolution, which covers everything before it, so
+                # that partially trimmed buckets are neither duplicated nor left out.
+                low = ceil(oldest[resolution] / size) * size
+                if not last and end is not None and low > end:
+                    continue
+            if last or (start is not None and low <= start):
+                plan.append((resolution, '-inf' if start is None else repr(start), high))
+                break
+            plan.append((resolution, repr(low), high))
+            high = '(' + repr(low)
+        return plan
+
+    def range(self, start: float = None, end: float = None, resolution: str = None,
+              max_points: int = None) -> List[Point]:
+        """
+        Read the account's value over a time range. By default each part of the range comes from the finest resolution
+        still kept for it, e.g. daily rollups for last year followed by raw points for today.
+        :param start: Earliest timestamp to include.
+        :param end: Latest timestamp to include.
+        :param resolution: Read only this one of `RESOLUTIONS`.
+        :param max_points: Use the finest resolutions that return no more than this many points, if possible.
+        :return: (timestamp, open, high, low, close) tuples in time order. Raw points have the same four values.
+        """
+        if resolution:
+            if resolution not in RESOLUTIONS:
+                raise ValueError("Invalid resolution '{}', must be one of {}.".format(resolution,
+                                                                                     ', '.join(RESOLUTIONS)))
+            plan = [(resolution, '-inf' if start is None else repr(start), '+inf' if end is None else repr(end))]
+        else:
+            oldest = self._oldest()
+            names = list(RESOLUTIONS)
+            for i in range(len(names)):
+                plan = self._plan(oldest, names[i:], start, end)
+                if not max_points:
+                    break
+                pipe = self.storage.pipeline(transaction=False)
+                for name, low, high in plan:
+                    pipe.zcount(self._key(name), low, high)
+                if sum(pipe.execute()) <= max_points:
+                    break
+        pipe = self.storage.pipeline(transaction=False)
+        for name, low, high in reversed(plan):
+            pipe.zrangebyscore(self._key(name), low, high, withscores=True)
+        points = []
+        for (name, _, _), members in zip(reversed(plan), pipe.execute()):
+            for member, score in members:
+                fields = member.split(':')
+                if name == 'raw':
+                    value = float(fields[1])
+                    points.append((score, value, value, value, value))
+                else:
+                    points.append((score, *(float(f) for f in fields[1:])))
+        return points
@@ -0,0 +1,210 @@
+"""
+Append-only journal of the writes that the daemon makes to Redis, so that its state can be rebuilt without relying on
+Redis persistence.
+
+Writes are queued in memory and a background thread appends them to a JSONL file in batches, with one flush and fsync
+per batch (group commit). `replay` applies a journal to a Redis client in order.
+"""
+import json
+import logging
+import os
+import threading
+from json import JSONDecodeError
+from time import time
+from typing import Any, Dict, Iterator, List
+
+from redis.client import Pipeline
+
+from magictrade import storage
+
+# Redis commands that are recorded when called through a journaled client. Reads pass straight through.
+WRITE_COMMANDS = frozenset(('set', 'delete', 'hset', 'hdel', 'lpush', 'rpush', 'lrem', 'ltrim', 'zadd', 'zrem',
+                            'zremrangebyscore', 'expire', 'incr', 'incrby', 'hincrby', 'xadd'))
+DEFAULT_FLUSH_INTERVAL = 0.05
+
+
+class Journal:
+    def __init__(self, path: str, flush_interval: float = DEFAULT_FLUSH_INTERVAL, sync: bool = True):
+        """
+        :param path: JSONL file to append to.
+        :param flush_interval: Longest time in seconds that a write waits for others to share its flush.
+        :param sync: fsync after every batch, so that written records survive a power loss.
+        """
+        self.path = path
+        self.flush_interval = flush_interval
+        self.sync = sync
+        _trim_torn_record(path)
+        self._file = open(path, 'a')
+        self._pending = []
+        self._appended = 0
+        self._written = 0
+        self._closed = False
+        self._lock = threading.Condition()
+        self._writer = threading.Thread(target=self._write_loop, name='journal', daemon=True)
+        self._writer.start()
+
+    def append(self, op: str, *args, **kwargs) -> None:
+        """
+        Queue a record for the next batch. This never waits for disk I/O.
+        :param op: Redis command name, or 'eval' for a Lua script.
+        """
+        record = json.dumps({'ts': time(), 'op': op, 'args': args, 'kwargs': kwargs}, default=str)
+        with self._lock:
+            if self._closed:
+                raise ValueError("Journal is closed.")
+            self._pending.append(record)
+            self._appended += 1
+            self._lock.notify_all()
+
+    def _write_loop(self) -> None:
+        while True:
+            with self._lock:
+                while not self._pending and not self._closed:
+                    self._lock.wait()
+                if not self._pending and self._closed:
+                    return
+                # Give other writers a moment to join this batch.
+                self._lock.wait(self.flush_interval)
+                batch, self._pending = self._pending, []
+            try:
+                self._file.write('\n'.join(batch) + '\n')
+                self._file.flush()
+                if self.sync:
+                    os.fsync(self._file.fileno())
+            except OSError as e:
+                logging.error("Error writing journal {}: {}".format(self.path, e))
+            with self._lock:
+                self._written += len(batch)
+                self._lock.notify_all()
+
+    def flush(self, timeout: float = None) -> bool:
+        """
+        Wait until everything appended so far has been written.
+        :return: Whether it was written before the timeout.
+        """
+        with self._lock:
+            target = self._appended
+            self._lock.notify_all()
+            return self._lock.wait_for(lambda: self._written >= target, timeout)
+
+    def close(self) -> None:
+        with self._lock:
+            self._closed = True
+            self._lock.notify_all()
+        self._writer.join()
+        self._file.close()
+
+    def wrap(self, client) -> 'JournaledClient':
+        """
+        :param client: Redis client or pipeline.
+        :return: A proxy that records write commands before sending them.
+        """
+        return JournaledClient(client, self)
+
+    def run_script(self, script, keys: List = [], args: List = [], client=None) -> Any:
+        """
+        Record and run a registered Lua script. The script source is recorded, so replaying does not depend on the
+        scripts cached on the server.
+        """
+        self.append('eval', script.script, len(keys), *keys, *args)
+        return script(keys=keys, args=args, client=client)
+
+
+def _trim_torn_record(path: str, chunk_size: int = 4096) -> None:
+    """
+    Cut off a partial last record, left by a crash during a write, so that the next batch starts on its own line
+    instead of being appended to it.
+    """
+    try:
+        f = open(path, 'rb+')
+    except FileNotFoundError:
+        return
+    with f:
+        end = size = f.seek(0, os.SEEK_END)
+        while end > 0:
+            start = max(0, end - chunk_size)
+            f.seek(start)
+            newline = f.read(end - start).rfind(b'\n')
+            if newline != -1:
+                end = start + newline + 1
+                break
+            end = start
+        if end < size:
+            logging.warning("Removing torn record at the end of journal {}.".format(path))
+            f.truncate(end)
+
+
+class JournaledClient:
+    """
+    Proxy for a Redis client that journals write commands. For a pipeline, the commands are journaled together when
+    it is executed.
+    """
+
+    def __init__(self, client, journal: Journal):
+        self._client = client
+        self._journal = journal
+        self._buffer = [] if isinstance(client, Pipeline) else None
+
+    def __getattr__(self, name: str):
+        attr = getattr(self._client, name)
+        if name not in WRITE_COMMANDS:
+            return attr
+
+        def command(*args, **kwargs):
+            if self._buffer is None:
+                self._journal.append(name, *args, **kwargs)
+            else:
+                self._buffer.append((name, args, kwargs))
+            return attr(*args, **kwargs)
+
+        return command
+
+    def pipeline(self, *args, **kwargs) -> 'JournaledClient':
+        return JournaledClient(self._client.pipeline(*args, **kwargs), self._journal)
+
+    def execute(self, *args, **kwargs):
+        for name, command_args, command_kwargs in self._buffer:
+            self._journal.append(name, *command_args, **command_kwargs)
+        self._buffer = []
+        return self._client.execute(*args, **kwargs)
+
+
+def read(path: str) -> Iterator[Dict]:
+    """
+    Read the records in a journal. A torn final line, from a crash during a write, is skipped.
+    """
+    with open(path) as f:
+        for line in f:
+            try:
+                yield json.loads(line)
+            except JSONDecodeError:
+                logging.warning("Skipping unreadable journal record: {!r}".format(line[:80]))
+
+
+def replay(path: str, client=None, since: float = 0, batch_size: int = 500) -> int:
+    """
+    Apply the writes in a journal to Redis, in order, using pipelined batches.
+    :param path: Journal file.
+    :param client: Redis client; the shared connection by default.
+    :param since: Skip records written before this timestamp.
+    :param batch_size: Number of commands per round trip.
+    :return: Number of commands applied.
+    """
+    client = client or storage
+    pipe = client.pipeline(transaction=False)
+    applied = 0
+    for record in read(path):
+        if record['ts'] < since:
+            continue
+        op = record['op']
+        if op == 'eval':
+            pipe.eval(*record['args'])
+        elif op in WRITE_COMMANDS:
+            getattr(pipe, op)(*record['args'], **record['kwargs'])
+        else:
+            continue
+        applied += 1
+        if not applied % batch_size:
+            pipe.execute()
+    pipe.execute()
+    return applied
@@ -0,0 +1,198 @@
+import os
+import threading
+from collections import deque
+from functools import wraps
+from time import perf_counter
+from typing import Callable, Dict, Tuple
+
+PREFIX = 'magictrade_'
+QUANTILES = (0.5, 0.95, 0.99)
+# Number of most recent observations per timer that quantiles are computed from.
+SAMPLE_SIZE = 2048
+
+enabled = False
+_lock = threading.Lock()
+_timers = {}
+_counters = {}
+
+
+class Summary:
+    """
+    Count, sum and a window of recent samples for one timed series.
+    """
+    __slots__ = ('count', 'total', 'samples')
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.samples = deque(maxlen=SAMPLE_SIZE)
+
+    def observe(self, value: float) -> None:
+        self.count += 1
+        self.total += value
+        self.samples.append(value)
+
+    def quantiles(self) -> Dict[float, float]:
+        samples = sorted(self.samples)
+        if not samples:
+            return {}
+        return {q: samples[min(len(samples) - 1, int(q * len(samples)))] for q in QUANTILES}
+
+
+def enable() -> None:
+    """
+    Start recording metrics. Until this is called, all timers and counters are no-ops.
+    """
+    global enabled
+    enabled = True
+
+
+def disable() -> None:
+    global enabled
+    enabled = False
+
+
+def reset() -> None:
+    with _lock:
+        _timers.clear()
+        _counters.clear()
+
+
+def _key(name: str, labels: Dict) -> Tuple:
+    return name, tuple(sorted(labels.items()))
+
+
+def observe(name: str, seconds: float, **labels) -> None:
+    key = _key(name, labels)
+    with _lock:
+        try:
+            summary = _timers[key]
+        except KeyError:
+            summary = _timers[key] = Summary()
+        summary.observe(seconds)
+
+
+def increment(name: str, amount: float = 1, **labels) -> None:
+    if not enabled:
+        return
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + amount
+
+
+class timer:
+    """
+    Context manager that records the duration of its block under the given metric name.
+    """
+
+    def __init__(self, name: str, **labels):
+        self.name = name
+        self.labels = labels
+        self.start = None
+
+    def __enter__(self):
+        if enabled:
+            self.start = perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        if self.start is not None:
+            observe(self.name, perf_counter() - self.start, **self.labels)
+            self.start = None
+
+
+def timed(name: str, **labels) -> Callable:
+    """
+    Decorator that records the duration of every call under the given metric name.
+    :param name: Metric name, without prefix or unit.
+    :param labels: Constant labels to attach to the series.
+    """
+
+    def decorator(func: Callable) -> Callable:
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if not enabled:
+                return func(*args, **kwargs)
+            start = perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                observe(name, perf_counter() - start, **labels)
+
+        return wrapper
+
+    return decorator
+
+
+def _format_labels(labels: Tuple, **extra) -> str:
+    labels = labels + tuple(extra.items())
+    if not labels:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(key, str(value).replace('"', '\\"')) for key, value in labels) + '}'
+
+
+def render() -> str:
+    """
+    Render all metrics in the Prometheus text exposition format.
+    :return: Metrics text.
+    """
+    lines = []
+    seen = set()
+    with _lock:
+        timers = sorted(_timers.items())
+        counters = sorted(_counters.items())
+        quantiles = [summary.quantiles() for _, summary in timers]
+    for ((name, labels), summary), values in zip(timers, quantiles):
+        metric = PREFIX + name + '_seconds'
+        if metric not in seen:
+            seen.add(metric)
+            lines.append('# TYPE {} summary'.format(metric))
+        for q, value in values.items():
+            lines.append('{}{} {:.6f}'.format(metric, _format_labels(labels, quantile=q), value))
+        lines.append('{}_sum{} {:.6f}'.format(metric, _format_labels(labels), summary.total))
+        lines.append('{}_count{} {}'.format(metric, _format_labels(labels), summary.count))
+    for (name, labels), value in counters:
+        metric = PREFIX + name + '_total'
+        if metric not in seen:
+            seen.add(metric)
+            lines.append('# TYPE {} counter'.format(metric))
+        lines.append('{}{} {}'.format(metric, _format_labels(labels), value))
+    return '\n'.join(lines) + '\n'
+
+
+def write(path: str) -> None:
+    """
+    Write metrics to a file, e.g. for the node_exporter textfile collector. The file is replaced atomically.
+    :param path: Destination file path.
+    """
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        f.write(render())
+    os.replace(tmp_path, path)
+
+
+def serve(port: int, host: str = '127.0.0.1'):
+    """
+    Serve metrics over HTTP from a background thread.
+    :param port: Port to listen on.
+    :param host: Address to bind to; local only by default.
+    :return: The running `http.server.HTTPServer`.
+    """
+    # Imported here so that importing this module stays cheap when metrics are not served.
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = render().encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = HTTPServer((host, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, name='metrics', daemon=True).start()
+    return server
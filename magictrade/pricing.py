@@ -0,0 +1,114 @@
+"""
+Vectorized Black-Scholes pricing for whole option chains.
+
+Arguments may be scalars or NumPy arrays and are broadcast against each other. Volatility and rate are annualized
+decimals (0.25 for 25%), time to expiration is in calendar days, and option types are either a boolean `is_call`
+array or 'call'/'put' strings.
+"""
+from datetime import datetime
+from typing import List, Tuple
+
+import numpy as np
+from scipy.special import ndtr  # pylint: disable=no-name-in-module
+
+from magictrade.securities import Option, OptionRecord
+
+DAYS_PER_YEAR = 365
+
+
+def is_call(option_type) -> np.ndarray:
+    option_type = np.asarray(option_type)
+    if option_type.dtype == bool:
+        return option_type
+    return option_type == 'call'
+
+
+def _d1_d2(spot, strike, days_to_exp, volatility, rate) -> Tuple[np.ndarray, np.ndarray]:
+    spot = np.asarray(spot, dtype=float)
+    strike = np.asarray(strike, dtype=float)
+    years = np.asarray(days_to_exp, dtype=float) / DAYS_PER_YEAR
+    vol_sqrt_t = np.asarray(volatility, dtype=float) * np.sqrt(years)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        d1 = (np.log(spot / strike) + (rate + 0.5 * np.square(volatility)) * years) / vol_sqrt_t
+    # At expiry (or with no volatility) d1 is +/-inf, or NaN exactly at the money; treat the latter as 0.
+    d1 = np.nan_to_num(d1, nan=0.0, posinf=np.inf, neginf=-np.inf)
+    return d1, d1 - vol_sqrt_t
+
+
+def price(spot, strike, days_to_exp, volatility, option_type, rate: float = 0.0) -> np.ndarray:
+    """
+    Theoretical option prices.
+    :return: Price per share for each contract.
+    """
+    d1, d2 = _d1_d2(spot, strike, days_to_exp, volatility, rate)
+    discounted_strike = np.asarray(strike, dtype=float) * np.exp(-rate * np.asarray(days_to_exp) / DAYS_PER_YEAR)
+    call = spot * ndtr(d1) - discounted_strike * ndtr(d2)
+    put = discounted_strike * ndtr(-d2) - spot * ndtr(-d1)
+    return np.where(is_call(option_type), call, put)
+
+
+def delta(spot, strike, days_to_exp, volatility, option_type, rate: float = 0.0) -> np.ndarray:
+    """
+    Option deltas; positive for calls and negative for puts.
+    :return: Delta for each contract.
+    """
+    d1, _ = _d1_d2(spot, strike, days_to_exp, volatility, rate)
+    call_delta = ndtr(d1)
+    return np.where(is_call(option_type), call_delta, call_delta - 1)
+
+
+def probability_itm(spot, strike, days_to_exp, volatility, option_type, rate: float = 0.0) -> np.ndarray:
+    """
+    Risk-neutral probability that each option expires in the money.
+    :return: Probability ITM as a fraction.
+    """
+    _, d2 = _d1_d2(spot, strike, days_to_exp, volatility, rate)
+    return np.where(is_call(option_type), ndtr(d2), ndtr(-d2))
+
+
+def probability_otm(spot, strike, days_to_exp, volatility, option_type, rate: float = 0.0) -> np.ndarray:
+    """
+    Risk-neutral probability that each option expires out of the money.
+    :return: Probability OTM as a fraction.
+    """
+    return 1 - probability_itm(spot, strike, days_to_exp, volatility, option_type, rate)
+
+
+def chain_arrays(options: List[Option], as_of: datetime) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Extract the inputs needed for pricing from a list of options.
+    :param options: Options or option records with strike, type and expiration date.
+    :param as_of: Date to measure time to expiration from.
+    :return: Strikes, call flags and days to expiration.
+    :raises ValueError: If an option has no expiration date.
+    """
+    strikes = np.fromiter((o.strike_price for o in options), dtype=float, count=len(options))
+    calls = np.fromiter((o.option_type == 'call' for o in options), dtype=bool, count=len(options))
+    expirations = np.array([o.expiration_date for o in options], dtype='datetime64[D]')
+    if np.isnat(expirations).any():
+        raise ValueError("Missing expiration date for {}.".format(options[int(np.isnat(expirations).argmax())].id))
+    days = (expirations - np.datetime64(as_of.date(), 'D')).astype(float)
+    return strikes, calls, np.maximum(days, 0)
+
+
+def fill_probability_otm(options: List[OptionRecord], spot: float, volatility, as_of: datetime,
+                         rate: float = 0.0, overwrite: bool = False) -> np.ndarray:
+    """
+    Compute the probability OTM for a chain in one pass, and store it on records where the broker did not provide
+    one (or on all records, with `overwrite`).
+    :param options: Option records, e.g. from `Broker.filter_options`.
+    :param spot: Price of the underlying.
+    :param volatility: Annualized volatility, for the whole chain or per contract.
+    :param as_of: Date to measure time to expiration from.
+    :param rate: Annualized risk-free rate.
+    :param overwrite: Replace probabilities supplied by the broker.
+    :return: Probability OTM for each option.
+    """
+    if not options:
+        return np.empty(0)
+    strikes, calls, days = chain_arrays(options, as_of)
+    probabilities = probability_otm(spot, strikes, days, volatility, calls, rate)
+    for option, probability in zip(options, probabilities.tolist()):
+        if overwrite or not option.probability_otm:
+            option.probability_otm = probability
+    return probabilities
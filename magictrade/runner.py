@@ -1,26 +1,27 @@
 import datetime
+import json
 import logging
 import os
 import random
+import threading
 from argparse import ArgumentParser, Namespace, ArgumentDefaultsHelpFormatter
-from typing import Dict, Tuple
+from typing import Dict, List, Tuple
 
 from requests import HTTPError
 from time import sleep
 
-from magictrade.broker import brokers, load_brokers, Broker
-from magictrade.broker.papermoney import PaperMoneyBroker
-from magictrade.broker.robinhood import RobinhoodBroker
-from magictrade.broker.td_ameritrade import TDAmeritradeBroker
-from magictrade.strategy import strategies, load_strategies, TradingStrategy, NoTradeException
-from magictrade.trade_queue import RedisTradeQueue
+from magictrade import metrics
+from magictrade.broker import Broker, BROKER_MODULES, get_broker
+from magictrade.broker.shared import MarketDataCache
+from magictrade.journal import Journal
+from magictrade.strategy import TradingStrategy, NoTradeException, STRATEGY_MODULES, get_strategy
+from magictrade.metrics import timed
+from magictrade.trade_queue import RedisTradeQueue, DEFAULT_VISIBILITY_TIMEOUT
 from magictrade.utils import market_is_open, get_version, normalize_trade, handle_error
 
 DEFAULT_MAINTENANCE_SLEEP = 900, 1800
 DEFAULT_TIMEOUT = 1800
-
-load_brokers()
-load_strategies()
+DEFAULT_CACHE_TTL = 30
 
 
 class Runner:
@@ -31,17 +32,20 @@ class Runner:
         self.broker = broker
         self.strategies = enabled_strategies
         self.maintenance_sleep = maintenance_sleep
+        self.stopped = threading.Event()
 
     def handle_results(self, result: Dict, identifier: str, trade: Dict):
+        metrics.increment('runner_trades', status=result.get('status', 'unknown'))
         self.trade_queue.set_status(identifier, result.get('status', 'unknown'))
         # check if status is deferred, add a target time back to the original trade that the main loop will check and
         if result.get('status') == 'deferred':
             timeout = int(result.get('timeout', DEFAULT_TIMEOUT))
             trade['start'] = result.get('start', self.broker.date.timestamp() + timeout)
-            self.trade_queue.add(identifier, trade)
+            self.trade_queue.schedule(identifier, trade['start'], trade)
         elif result.get('status') == 'rejected':
             self.trade_queue.add_failed(identifier, result.get('msg'))
 
+    @timed('runner_run_maintenance')
     def run_maintenance(self) -> None:
         logging.info("Running maintenance...")
         for strategy in self.strategies:
@@ -49,12 +53,13 @@ class Runner:
                 results = strategy.maintenance()
             except Exception as e:
                 logging.error("Error while performing maintenance: {}".format(e))
-                strategy.log("Fatal error while performing maintenance: {}.".format(e))
+                strategy.log("Fatal error while performing maintenance: {}.".format(e), event='error')
                 handle_error(e, self.args.debug)
             else:
                 logging.info("Completed {} tasks.".format(len(results)))
         self.trade_queue.last_maintenance = self.broker.date
 
+    @timed('runner_check_balance')
     def check_balance(self) -> int:
         next_balance_check = random.randint(*self.maintenance_sleep)
         try:
@@ -72,6 +77,7 @@ class Runner:
                 buying_power, balance, next_balance_check))
             return next_balance_check
 
+    @timed('runner_make_trade')
     def make_trade(self, trade: Dict, identifier: str) -> Dict:
         if strategy := trade.pop('strategy', None):
             try:
@@ -91,30 +97,69 @@ class Runner:
                 return
             else:
                 result = str(e)
-            strategy.log(f"Fatal error making trade in '{trade['symbol']}': {str(e)}.")
+            strategy.log(f"Fatal error making trade in '{trade['symbol']}': {str(e)}.", symbol=trade['symbol'],
+                         event='error')
             logging.error("Error while making trade '{}': {}".format(trade, e))
             self.trade_queue.add_failed(identifier, result)
             handle_error(e, self.args.debug)
 
+    def process_trade(self, identifier: str, trade: Dict) -> None:
+        if not self.trade_queue.reliable:
+            self.place_trade(identifier, trade)
+            return
+        if not self.trade_queue.start_placing(identifier):
+            # Redelivered after another worker started placing it, which may have sent the order before stopping.
+            # Placing it here could duplicate the order, so record it as failed for someone to check instead.
+            logging.warning("Skipping trade {} since another worker started placing it.".format(identifier))
+            if self.trade_queue.get_status(identifier) in (None, 'deferred'):
+                self.trade_queue.add_failed(identifier, "Interrupted while placing; check the broker for an order "
+                                                        "before sending it again.")
+            return
+        try:
+            self.trade_queue.extend(identifier)
+            self.place_trade(identifier, trade)
+        finally:
+            self.trade_queue.finish_placing(identifier)
+
+    def place_trade(self, identifier: str, trade: Dict) -> None:
+        result = self.make_trade(trade, identifier)
+        if result:
+            logging.info("Processed trade: " + str(trade))
+            self.handle_results(result, identifier, trade)
+
     def check_trade_expired(self, trade: Dict) -> bool:
         return 'end' in trade and datetime.datetime.fromtimestamp(
             float(trade['end'])) <= self.broker.date
 
+    @timed('runner_get_next_trade')
     def get_next_trade(self, clean_only: bool = False) -> (str, Dict):
         while len(self.trade_queue):
             identifier, trade = self.trade_queue.pop()
+            if not identifier:
+                # Another worker took the last trade.
+                break
+            if not trade:
+                # Expired and swept while it was waiting on the queue.
+                self.trade_queue.ack(identifier)
+                continue
             if self.check_trade_expired(trade):
                 # Trade not re-added to queue since it is expired
+                self.trade_queue.ack(identifier)
+                continue
+            elif self.trade_queue.reliable and self.trade_queue.get_status(identifier) == 'placed':
+                # Redelivered after a worker placed it but stopped before acknowledging it.
+                self.trade_queue.ack(identifier)
                 continue
             elif 'start' in trade and datetime.datetime.fromtimestamp(
                     float(trade['start'])) > self.broker.date:
-                self.trade_queue.stage_trade(identifier)
+                self.trade_queue.schedule(identifier, trade['start'])
+                self.trade_queue.ack(identifier)
             else:
                 if clean_only:
                     self.trade_queue.stage_trade(identifier)
                     continue
                 # Clean up these keys since they aren't used later on
-                for key in ('start', 'end'):
+                for key in ('start', 'end', 'priority'):
                     trade.pop(key, None)
                 logging.info("Ingested trade: " + str(trade))
                 normalize_trade(trade)
@@ -130,11 +175,17 @@ class Runner:
         first_trade = False
         cleanup_ran = False
 
-        while True:
+        while not self.stopped.is_set():
             try:
                 if not next_heartbeat:
                     self.trade_queue.heartbeat()
+                    self.trade_queue.sweep_expired(self.broker.date.timestamp())
                     next_heartbeat = 15
+                    if self.args.metrics_file:
+                        metrics.write(self.args.metrics_file)
+                self.trade_queue.promote_due(self.broker.date.timestamp())
+                if self.trade_queue.reliable:
+                    self.trade_queue.redeliver_expired()
                 if market_is_open() or self.args.debug:
                     if not self.args.debug and first_trade:
                         logging.info("Sleeping to make sure market is open...")
@@ -154,10 +205,8 @@ class Runner:
 
                             identifier, trade = self.get_next_trade()
                             if trade:
-                                result = self.make_trade(trade, identifier)
-                                if result:
-                                    logging.info("Processed trade: " + str(trade))
-                                    self.handle_results(result, identifier, trade)
+                                self.process_trade(identifier, trade)
+                                self.trade_queue.ack(identifier)
                         self.trade_queue.staged_to_queue()
                         if next_maintenance:
                             next_maintenance -= 1
@@ -172,14 +221,14 @@ class Runner:
                         self.get_next_trade(clean_only=True)
                         self.trade_queue.staged_to_queue()
                     first_trade = True
-                sleep(1)
+                self.stopped.wait(1)
                 next_heartbeat -= 1
             except Exception as e:
                 # Catch-all exception handler
                 handle_error(e, self.args.debug)
 
 
-def parse_args() -> Namespace:
+def build_parser() -> ArgumentParser:
     parser = ArgumentParser(description="Daemon to make automated trades.",
                             formatter_class=ArgumentDefaultsHelpFormatter)
     parser.add_argument('-k', '--oauth-keyfile', dest='keyfile', help='Path to keyfile containing access and refresh '
@@ -208,52 +257,59 @@ def parse_args() -> Namespace:
                         default=DEFAULT_MAINTENANCE_SLEEP,
                         help='A range for the amount of time to wait between maintenance checks, '
                              'in seconds. The actual timeout will be randomly chosen from this range.')
-    parser.add_argument('broker', choices=brokers.keys(), help='Broker to use.')
-    parser.add_argument('strategies', metavar='strategy', choices=strategies.keys(), nargs="+",
+    parser.add_argument('--reliable', action='store_true',
+                        help='Claim and acknowledge trades, so that several daemons can share a queue and trades are '
+                             'delivered again if a daemon stops while processing them.')
+    parser.add_argument('--visibility-timeout', type=int, default=DEFAULT_VISIBILITY_TIMEOUT,
+                        help='With --reliable, seconds before an unacknowledged trade is delivered again.')
+    parser.add_argument('--journal', metavar='PATH',
+                        help='Also record every write to Redis in this file, so that the trade queue and positions can '
+                             'be rebuilt with "magictrade-cli replay".')
+    parser.add_argument('--metrics-file', help='Periodically write timing metrics to this file in the Prometheus '
+                                               'text format.')
+    parser.add_argument('--metrics-port', type=int, help='Serve timing metrics in the Prometheus text format on '
+                                                         'this local port.')
+    parser.add_argument('broker', choices=BROKER_MODULES.keys(), help='Broker to use.')
+    parser.add_argument('strategies', metavar='strategy', choices=STRATEGY_MODULES.keys(), nargs="+",
                         help='Strategies to use. The first one will '
                              'be the default for any untagged '
                              'trades.')
-    return parser.parse_args()
+    return parser
 
 
-def main():
-    args = parse_args()
+def parse_args() -> Namespace:
+    return build_parser().parse_args()
 
-    logging.basicConfig(format='%(asctime)s %(message)s', level=logging.INFO)
-    if 'username' in os.environ:
-        logging.info("Attempting credentials from envars...")
-    elif args.username:
-        logging.info("Attempting credentials from args...")
-    else:
-        logging.info("Using stored credentials...")
-        if not os.path.exists(args.keyfile):
-            logging.error("Can't find keyfile. Aborting.")
-            raise SystemExit
-    username = os.environ.pop('username', None) or args.username
-    password = os.environ.pop('password', None) or args.password
-    mfa_code = os.environ.pop('mfa_code', None) or args.mfa
 
+def build_broker(args: Namespace, username: str = None, password: str = None, mfa_code: str = None) -> Broker:
     if args.broker == 'robinhood':
-        broker = RobinhoodBroker(username=username, password=password,
-                                 mfa_code=mfa_code, token_file=args.keyfile)
+        broker = get_broker('robinhood')(username=username, password=password,
+                                         mfa_code=mfa_code, token_file=args.keyfile)
     elif args.broker == 'tdameritrade':
-        broker = TDAmeritradeBroker(account_id=args.username)
+        broker = get_broker('tdameritrade')(account_id=args.username)
     else:
         logging.warning("No valid broker provided. Exiting...")
         raise SystemExit
-    if args.authonly:
-        logging.info("Authentication success. Exiting.")
-        raise SystemExit
+    return broker
+
+
+def build_runner(args: Namespace, broker: Broker) -> Runner:
     if args.paper:
-        broker = PaperMoneyBroker(broker=broker)
+        broker = get_broker('papermoney')(broker=broker)
     queue_name = args.queue_name
     if not queue_name:
         raise SystemExit("Must provide queue name.")
-    trade_queue = RedisTradeQueue(queue_name)
+    journal = Journal(args.journal) if args.journal else None
+    trade_queue = RedisTradeQueue(queue_name, reliable=args.reliable, visibility_timeout=args.visibility_timeout,
+                                  journal=journal)
     enabled_strategies = []
     for strategy in args.strategies:
-        enabled_strategies.append(strategies[strategy](broker, paper=args.paper))
-    logging.info("Magictrade daemon {} starting with queue name '{}'.".format(get_version(), queue_name))
+        enabled_strategies.append(get_strategy(strategy)(broker, paper=args.paper))
+        enabled_strategies[-1].journal = journal
+    return Runner(args, trade_queue, broker, enabled_strategies)
+
+
+def init_sentry():
     try:
         import sentry_sdk
 
@@ -265,12 +321,153 @@ def main():
             )
     except ImportError:
         pass
-    logging.info("Authenticated with account " + broker.account_id)
-    runner = Runner(args, trade_queue, broker, enabled_strategies)
+
+
+def init_metrics(args: Namespace):
+    if args.metrics_file or args.metrics_port:
+        metrics.enable()
+        if args.metrics_port:
+            metrics.serve(args.metrics_port)
+            logging.info("Serving metrics on port {}".format(args.metrics_port))
+
+
+def main():
+    args = parse_args()
+
+    logging.basicConfig(format='%(asctime)s %(message)s', level=logging.INFO)
+    if 'username' in os.environ:
+        logging.info("Attempting credentials from envars...")
+    elif args.username:
+        logging.info("Attempting credentials from args...")
+    else:
+        logging.info("Using stored credentials...")
+        if not os.path.exists(args.keyfile):
+            logging.error("Can't find keyfile. Aborting.")
+            raise SystemExit
+    username = os.environ.pop('username', None) or args.username
+    password = os.environ.pop('password', None) or args.password
+    mfa_code = os.environ.pop('mfa_code', None) or args.mfa
+
+    broker = build_broker(args, username, password, mfa_code)
+    if args.authonly:
+        logging.info("Authentication success. Exiting.")
+        raise SystemExit
+    runner = build_runner(args, broker)
+    logging.info("Magictrade daemon {} starting with queue name '{}'.".format(get_version(), args.queue_name))
+    init_sentry()
+    init_metrics(args)
+    logging.info("Authenticated with account " + runner.broker.account_id)
     try:
         runner.run()
     except KeyboardInterrupt:
         logging.info("Got SIGINT, Exiting...")
+    finally:
+        if runner.trade_queue.journal:
+            runner.trade_queue.journal.close()
+
+
+class MultiRunner:
+    """
+    Runs several accounts, each with its own broker, trade queue and strategies, in one process. Every account gets a
+    worker thread with its own Runner loop, while the Redis connection pool and a short-lived cache of quotes and
+    option chains are shared between them.
+    """
+
+    def __init__(self, runners: List[Runner], metrics_file: str = None):
+        self.runners = runners
+        self.metrics_file = metrics_file
+        self.threads = []
+
+    def start(self):
+        for runner in self.runners:
+            thread = threading.Thread(target=runner.run, name=runner.trade_queue.queue_name, daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def stop(self, timeout: float = None):
+        for runner in self.runners:
+            runner.stopped.set()
+        for thread in self.threads:
+            thread.join(timeout)
+
+    def run(self):
+        self.start()
+        try:
+            while any(thread.is_alive() for thread in self.threads):
+                if self.metrics_file:
+                    metrics.write(self.metrics_file)
+                sleep(15)
+        finally:
+            self.stop()
+
+
+def parse_account_args(account: Dict, debug: bool = False) -> Tuple[Namespace, Dict]:
+    """
+    Turn one account from a multi-account config into the arguments that a single daemon would have been started with.
+    Credentials may be given directly or, with an `_env` suffix, as the name of an environment variable.
+    :param account: Account config, with the same keys as the daemon's long options plus `broker` and `strategies`.
+    :param debug: Run the account in debug mode.
+    :return: Parsed arguments, and the credentials.
+    """
+    account = dict(account)
+    credentials = {}
+    for key in ('username', 'password', 'mfa_code'):
+        if env := account.pop(key + '_env', None):
+            credentials[key] = os.environ.get(env)
+        else:
+            credentials[key] = account.pop(key, None)
+    args = build_parser().parse_args([account.pop('broker'), *account.pop('strategies')])
+    for key, value in account.items():
+        key = key.replace('-', '_')
+        if key not in vars(args):
+            raise SystemExit("Unknown option '{}' for account '{}'.".format(key, args.queue_name))
+        setattr(args, key, value)
+    args.debug = args.debug or debug
+    args.metrics_file = None
+    args.username = args.username or credentials['username']
+    return args, credentials
+
+
+def multi_main():
+    parser = ArgumentParser(description="Daemon to make automated trades for several accounts in one process.",
+                            formatter_class=ArgumentDefaultsHelpFormatter)
+    parser.add_argument('config', help='JSON file with an "accounts" list. Each account takes the same options as '
+                                       'magictrade-daemon, e.g. {"broker": "robinhood", "strategies": '
+                                       '["optionseller"], "queue_name": "rh", "password_env": "RH_PASSWORD"}.')
+    parser.add_argument('-d', '--debug', action='store_true', help='Run every account in debug mode.')
+    parser.add_argument('-c', '--cache-ttl', type=float, default=DEFAULT_CACHE_TTL,
+                        help='Seconds to share quotes and option chains between accounts for.')
+    parser.add_argument('--metrics-file', help='Periodically write timing metrics to this file in the Prometheus '
+                                               'text format.')
+    parser.add_argument('--metrics-port', type=int, help='Serve timing metrics in the Prometheus text format on '
+                                                         'this local port.')
+    args = parser.parse_args()
+
+    logging.basicConfig(format='%(asctime)s %(threadName)s %(message)s', level=logging.INFO)
+    with open(args.config) as f:
+        accounts = json.load(f)['accounts']
+    cache = MarketDataCache(args.cache_ttl)
+    runners = []
+    for account in accounts:
+        account_args, credentials = parse_account_args(account, args.debug)
+        broker = cache.share(build_broker(account_args, **credentials))
+        runners.append(build_runner(account_args, broker))
+        logging.info("Authenticated with account {} for queue '{}'.".format(runners[-1].broker.account_id,
+                                                                          account_args.queue_name))
+    queue_names = [runner.trade_queue.queue_name for runner in runners]
+    if len(set(queue_names)) != len(queue_names):
+        raise SystemExit("Every account must use a different queue name.")
+    logging.info("Magictrade daemon {} starting with queues {}.".format(get_version(), ', '.join(queue_names)))
+    init_sentry()
+    init_metrics(args)
+    try:
+        MultiRunner(runners, args.metrics_file).run()
+    except KeyboardInterrupt:
+        logging.info("Got SIGINT, Exiting...")
+    finally:
+        for runner in runners:
+            if runner.trade_queue.journal:
+                runner.trade_queue.journal.close()
 
 
 if __name__ == '__main__':
@@ -1,11 +1,15 @@
 import datetime
 import random
 from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
-from typing import List
+from concurrent.futures import ThreadPoolExecutor
+from copy import copy, deepcopy
+from typing import Dict, List, NamedTuple, Tuple
 
 import sys
 from time import sleep
 
+from redis.client import Pipeline
+
 from magictrade.trade_queue import RedisTradeQueue
 
 
@@ -73,21 +77,83 @@ def method_from_name(class_, method_name: str):
         raise NotImplementedError()
 
 
-class MultiTradeQueue(RedisTradeQueue):
+# Queue methods that only issue Redis commands whose replies need no processing, so that their calls to many queues can
+# be batched into one pipeline per Redis host.
+PIPELINED_METHODS = ('send_trade', 'add', 'set_data', 'add_criteria', 'set_status', 'get_status', 'add_failed',
+                     'schedule', 'get_data', 'set_current_usage', 'delete_current_usage', 'run_maintenance')
+
+
+class _Reply(NamedTuple):
+    index: int
+
+
+class _BatchedStorage:
+    """
+    Stands in for a queue's Redis client, adding its commands to a shared pipeline instead of sending them. Pipelines
+    that the queue opens itself become part of the shared one.
+    """
+
+    def __init__(self, pipe: Pipeline):
+        self._pipe = pipe
+
+    def __getattr__(self, item):
+        return getattr(self._pipe, item)
+
+    def pipeline(self, *args, **kwargs) -> '_BatchedStorage':
+        return self
+
+    def execute(self, *args, **kwargs) -> List:
+        return []
+
+
+class MultiTradeQueue:
+    """
+    Sends every method call to several trade queues, e.g. to broadcast a signal to many accounts. Queues on the same
+    Redis connection get one pipelined round trip per call, and each Redis host is reached concurrently.
+    """
+
     def __init__(self, queues: List[RedisTradeQueue], single_return: bool = False):
         self.queues = queues
         self.single_return = single_return
+        groups = {}
+        for queue in queues:
+            groups.setdefault(id(queue.storage), []).append(queue)
+        self._groups = list(groups.values())
 
     def __getattr__(self, item):
-        if item == 'queues':
-            return self.queues
-        elif item == "queue_name":
+        if item.startswith('_'):
+            raise AttributeError(item)
+        if item == "queue_name":
             return self.queues[0].queue_name
+        run = self._pipelined if item in PIPELINED_METHODS else self._sequential
 
         def _method(*args, **kwargs):
-            results = []
-            for queue in self.queues:
-                results.append(method_from_name(queue, item)(*args, **kwargs))
+            if len(self._groups) > 1:
+                with ThreadPoolExecutor(max_workers=len(self._groups)) as executor:
+                    grouped = list(executor.map(lambda group: run(group, item, args, kwargs), self._groups))
+            else:
+                grouped = [run(group, item, args, kwargs) for group in self._groups]
+            by_queue = {id(queue): result for group, results in zip(self._groups, grouped)
+                        for queue, result in zip(group, results)}
+            results = [by_queue[id(queue)] for queue in self.queues]
             return results[0] if self.single_return else results
 
         return _method
+
+    @staticmethod
+    def _sequential(queues: List[RedisTradeQueue], item: str, args: Tuple, kwargs: Dict) -> List:
+        # Methods may modify their arguments, e.g. send_trade, so give each queue its own copy.
+        return [method_from_name(queue, item)(*deepcopy(args), **deepcopy(kwargs)) for queue in queues]
+
+    @staticmethod
+    def _pipelined(queues: List[RedisTradeQueue], item: str, args: Tuple, kwargs: Dict) -> List:
+        pipe = queues[0].storage.pipeline()
+        results = []
+        for queue in queues:
+            batched = copy(queue)
+            batched.storage = _BatchedStorage(pipe)
+            result = method_from_name(batched, item)(*deepcopy(args), **deepcopy(kwargs))
+            # A call that reads returns the pipeline; its value is the reply to the last command queued.
+            results.append(_Reply(len(pipe) - 1) if result is pipe else result)
+        replies = pipe.execute()
+        return [replies[result.index] if isinstance(result, _Reply) else result for result in results]
@@ -61,6 +61,7 @@ def earnings_process_day(day, allocation):
                 'allocation': allocation,
                 'days_out': EARNINGS_DAYS_EXP,
                 'direction': 'neutral',
+                'priority': 'high',
             })
         except KeyError:
             print(f"Earnings time '{stock.h4.text}' not valid, skipping...")
@@ -1,4 +1,5 @@
 from abc import ABC, abstractmethod
+from collections.abc import Mapping
 from typing import Dict, List
 
 
@@ -22,6 +23,17 @@ class Option(dict, ABC):
         if item == 'get':
             return self.data.get
 
+    @classmethod
+    def record(cls, option_data: Dict) -> 'OptionRecord':
+        """
+        Build a compact record from raw broker data, without copying the data into an option instance first.
+        :param option_data: Raw option data from the broker.
+        :return: Option record
+        """
+        option = cls.__new__(cls)
+        option.data = option_data
+        return OptionRecord(option)
+
     @property
     @abstractmethod
     def id(self):
@@ -75,6 +87,71 @@ class Option(dict, ABC):
         """
         pass
 
+    @property
+    def delta(self) -> float:
+        """
+        Return the option's delta, if the broker provides it.
+        :return: Delta
+        """
+        return self.data.get('delta')
+
+    @property
+    def expiration_date(self) -> str:
+        """
+        Return the option's expiration date, if the broker provides it in YYYY-MM-DD format.
+        :return: Expiration date
+        """
+        return self.data.get('expiration_date')
+
+
+class OptionRecord(Mapping):
+    """
+    Compact, read-only view of an options contract with only the fields that strategies select legs by, stored in
+    slots. The broker's full payload is kept by reference and is available through item access and `raw`.
+    """
+    __slots__ = ('id', 'option_type', 'strike_price', 'mark_price', 'delta', 'probability_otm', 'expiration_date',
+                 '_raw')
+    fields = __slots__[:-1]
+    # Fields that not every broker provides. These are None when missing; the others must be present.
+    optional = ('delta', 'probability_otm', 'expiration_date')
+
+    def __init__(self, option: Option):
+        for field in self.fields:
+            if field in self.optional:
+                try:
+                    setattr(self, field, getattr(option, field))
+                except (KeyError, TypeError, ValueError):
+                    setattr(self, field, None)
+            else:
+                setattr(self, field, getattr(option, field))
+        self._raw = option.data
+
+    @property
+    def raw(self) -> Dict:
+        return self._raw
+
+    @property
+    def probability_itm(self) -> float:
+        return 1 - self.probability_otm
+
+    def __getitem__(self, key):
+        return self._raw[key]
+
+    def __iter__(self):
+        return iter(self._raw)
+
+    def __len__(self):
+        return len(self._raw)
+
+    def __getattr__(self, item):
+        # Less common fields, e.g. those used as a sort key for custom trades, are read from the payload.
+        if item.startswith('_'):
+            raise AttributeError(item)
+        return self._raw.get(item)
+
+    def __repr__(self):
+        return "{}({!r})".format(type(self).__name__, self._raw)
+
 
 class OptionOrder(ABC):
     """
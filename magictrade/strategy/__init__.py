@@ -9,9 +9,28 @@ from magictrade import storage
 from magictrade.broker import Broker
 from magictrade.datasource import DataSource
 from magictrade.datasource.stock import FinnhubDataSource
+from magictrade.metrics import timed
 from magictrade.securities import OptionOrder, Option
-from magictrade.strategy.registry import strategies
-from magictrade.utils import get_monthly_option, date_format, get_allocation, get_risk, get_percentage_change
+from magictrade.strategy.registry import strategies, get_strategy, STRATEGY_MODULES
+from magictrade.utils import get_monthly_option, get_allocation, get_risk, get_percentage_change, \
+    encode_legs, ExpirationIndex, get_events
+
+# Removes a position's legs, leg list, hash and entry in the open positions list atomically and in one round trip.
+DELETE_POSITION_SCRIPT = """
+for _, leg in ipairs(redis.call('LRANGE', KEYS[2], 0, -1)) do
+    redis.call('DEL', ARGV[2] .. leg)
+end
+redis.call('LREM', KEYS[1], 0, ARGV[1])
+return redis.call('DEL', KEYS[2], KEYS[3])
+"""
+
+delete_position_script = storage.register_script(DELETE_POSITION_SCRIPT)
+
+# Approximate number of events kept in an account's event log, and in the event log of each position.
+LOG_MAXLEN = 10000
+POSITION_LOG_MAXLEN = 500
+# Seconds that a position's event log is kept after its last event.
+POSITION_LOG_TTL = 90 * 86400
 
 
 def load_strategies():
@@ -21,11 +40,14 @@ def load_strategies():
 
 class TradingStrategy(ABC):
     name = 'tradingstrategy'
+    # Optional magictrade.journal.Journal to record position writes in.
+    journal = None
 
     def __init__(self, broker: Broker, data_source: DataSource = FinnhubDataSource, paper: bool = False):
         self.broker = broker
         self.data_source = data_source
         self.paper = paper
+        self._expiration_cache = None, None
 
     def init_strategy(self, symbol: str, open_criteria: List = []) -> Tuple:
         symbol = symbol.upper()
@@ -55,24 +77,26 @@ class TradingStrategy(ABC):
         if monthly:
             return get_monthly_option(self.broker.date + timedelta(days=timeline))
 
-        target_date = None
-        offset = 0
         if isinstance(options, list):
             dates = self.broker.exp_dates
         else:
             dates = options['expiration_dates']
         if not dates:
             raise TradeException("No expiration dates.")
-        while not target_date:
-            td1 = date_format(self.broker.date + timedelta(days=timeline + offset))
-            td2 = date_format(self.broker.date + timedelta(days=timeline - offset))
-            if td1 in dates and td1 not in blacklist_dates:
-                target_date = td1
-            elif td2 in dates and td2 not in blacklist_dates:
-                target_date = td2
-            offset += 1
+        target_date = self._expiration_index(dates).nearest(
+            (self.broker.date + timedelta(days=timeline)).toordinal(), blacklist_dates)
+        if not target_date:
+            raise TradeException("No expiration dates left to try.")
         return target_date
 
+    def _expiration_index(self, dates: List[str]) -> ExpirationIndex:
+        # The index is kept for as long as the broker returns the same expiration dates object, i.e. per chain.
+        cached_dates, index = self._expiration_cache
+        if cached_dates is not dates:
+            index = ExpirationIndex(dates)
+            self._expiration_cache = dates, index
+        return index
+
     @staticmethod
     def _get_price(legs: List) -> float:
         price = 0
@@ -89,6 +113,7 @@ class TradingStrategy(ABC):
                 price -= leg_price
         return price
 
+    @timed('strategy_find_legs')
     def find_legs(self, method: Callable, config: Dict, options: List[Dict], timeline: int = 0, days_out: int = 0,
                   monthly: bool = False, exp_date: str = None, *args, **kwargs):
         for target_date, options_on_date in self.find_exp_date(config, options, timeline, days_out, monthly, exp_date):
@@ -168,6 +193,7 @@ class TradingStrategy(ABC):
     def close_position(self, position: str, data: Dict, legs: List):
         pass
 
+    @timed('strategy_maintenance')
     def maintenance(self) -> List:
         orders = []
 
@@ -179,7 +205,7 @@ class TradingStrategy(ABC):
             data['last_change'] = change * -1
             tmp_data = data.copy()
             tmp_data.pop('close_criteria', None)
-            storage.hset("{}:{}".format(self.get_name(), position), mapping=tmp_data)
+            self._storage.hset("{}:{}".format(self.get_name(), position), mapping=tmp_data)
 
             if data.get('close_now'):
                 orders.append(self.close_position(position, data, legs))
@@ -209,30 +235,81 @@ class TradingStrategy(ABC):
     def make_trade(self, symbol: str, *args, **kwargs):
         pass
 
-    def log(self, msg: str) -> None:
-        storage.lpush(self.get_name() + ":log", "{} {}".format(datetime.now().timestamp(), msg))
+    @property
+    def _storage(self):
+        return self.journal.wrap(storage) if self.journal else storage
+
+    def log(self, msg: str, position: str = None, symbol: str = None, event: str = 'info') -> None:
+        """
+        Add an event to the account's event log, a Redis stream capped at about `LOG_MAXLEN` entries. Events about a
+        position are also added to that position's own log, so that its history can be read without scanning.
+        :param msg: Description of the event.
+        :param position: Position the event is about.
+        :param symbol: Symbol the event is about.
+        :param event: Event type, e.g. 'open', 'close' or 'error'.
+        """
+        fields = {'msg': msg, 'strategy': self.name, 'event': event,
+                  'position': position or '', 'symbol': symbol or ''}
+        key = self.get_name() + ":events"
+        pipe = self._storage.pipeline(transaction=False)
+        pipe.xadd(key, fields, maxlen=LOG_MAXLEN, approximate=True)
+        if position:
+            pipe.xadd("{}:{}".format(key, position), fields, maxlen=POSITION_LOG_MAXLEN, approximate=True)
+            pipe.expire("{}:{}".format(key, position), POSITION_LOG_TTL)
+        pipe.execute()
+
+    def get_events(self, **kwargs) -> List[Dict]:
+        """
+        Read this account's event log. Takes the same filters as `magictrade.utils.get_events`.
+        """
+        return get_events(self.get_name(), **kwargs)
 
     def delete_position(self, trade_id: str) -> None:
-        storage.lrem("{}:positions".format(self.get_name()), 0, trade_id)
-        for leg in storage.lrange("{}:{}:legs".format(self.get_name(), trade_id), 0, -1):
-            storage.delete("{}:leg:{}".format(self.get_name(), leg))
-        storage.delete("{}:{}:legs".format(self.get_name(), trade_id))
-        # consider not deleting this one for archival purposes
-        storage.delete("{}:{}".format(self.get_name(), trade_id))
+        # consider not deleting the position hash for archival purposes
+        keys = ["{}:positions".format(self.get_name()),
+                "{}:{}:legs".format(self.get_name(), trade_id),
+                "{}:{}".format(self.get_name(), trade_id)]
+        args = [trade_id, "{}:leg:".format(self.get_name())]
+        if self.journal:
+            self.journal.run_script(delete_position_script, keys, args)
+        else:
+            delete_position_script(keys=keys, args=args)
 
     def check_positions(self, legs: List, options: Dict) -> Dict:
         for leg in legs:
             if not self.broker.leg_in_options(leg, options):
                 return leg
 
+    @timed('strategy_load_positions')
+    def load_positions(self, positions: List[str]) -> List[Tuple[str, Dict, List[Dict]]]:
+        """
+        Fetch the stored data and legs of many positions at once, using one pipelined round trip for the position
+        hashes and leg lists, and another for all of the legs.
+        :param positions: Position identifiers.
+        :return: A list of (position, data, legs) tuples, with legs as stored hashes.
+        """
+        pipe = storage.pipeline(transaction=False)
+        for position in positions:
+            pipe.hgetall("{}:{}".format(self.get_name(), position))
+            pipe.lrange("{}:{}:legs".format(self.get_name(), position), 0, -1)
+        results = pipe.execute()
+        position_data, leg_ids = results[::2], results[1::2]
+
+        pipe = storage.pipeline(transaction=False)
+        for ids in leg_ids:
+            for leg in ids:
+                pipe.hgetall("{}:leg:{}".format(self.get_name(), leg))
+        leg_data = iter(pipe.execute())
+        return [(position, data, [next(leg_data) for _ in ids])
+                for position, data, ids in zip(positions, position_data, leg_ids)]
+
     def get_current_positions(self):
         positions = storage.lrange(self.get_name() + ":positions", 0, -1)
         if not positions:
             return
         owned_options = self.broker.options_positions()
 
-        for position in positions:
-            data = storage.hgetall("{}:{}".format(self.get_name(), position))
+        for position, data, leg_data in self.load_positions(positions):
             try:
                 data['close_criteria'] = json.loads(data['close_criteria'])
             except KeyError:
@@ -246,15 +323,13 @@ class TradingStrategy(ABC):
                     time_placed = datetime.fromtimestamp(0)
                 if time_placed.date() == datetime.today().date():
                     continue
-            leg_ids = storage.lrange("{}:{}:legs".format(self.get_name(), position), 0, -1)
-            legs = []
-            for leg in leg_ids:
-                legs.append(self.broker.option(storage.hgetall("{}:leg:{}".format(self.get_name(), leg))))
+            legs = [self.broker.option(leg) for leg in leg_data]
             # Make sure we still own all legs, else abandon management of this position.
             if self.check_positions(legs, owned_options):
                 self.delete_position(position)
                 self.log("[{}]: Orphaned position {}-{} due to missing leg.".format(position, data['symbol'],
-                                                                                    data.get('strategy', 'unknown')))
+                                                                                    data.get('strategy', 'unknown')),
+                         position=position, symbol=data['symbol'], event='orphan')
                 continue
             yield position, data, legs
 
@@ -262,22 +337,26 @@ class TradingStrategy(ABC):
                    close_criteria: Dict = {}, **kwargs):
         if close_criteria:
             kwargs['close_criteria'] = json.dumps(close_criteria)
-        storage.lpush(self.get_name() + ":positions", option_order.id)
-        storage.lpush(self.get_name() + ":all_positions", option_order.id)
-        storage.hset("{}:{}".format(self.get_name(), option_order.id),
-                     mapping={
-                         'time': self.broker.date.timestamp(),
-                         **kwargs,
-                         **order_data,
-                     })
+        # Write the whole position in a single MULTI/EXEC so that it is never left half-saved.
+        pipe = self._storage.pipeline()
+        pipe.lpush(self.get_name() + ":positions", option_order.id)
+        pipe.lpush(self.get_name() + ":all_positions", option_order.id)
+        pipe.hset("{}:{}".format(self.get_name(), option_order.id),
+                  mapping={
+                      'time': self.broker.date.timestamp(),
+                      **kwargs,
+                      **order_data,
+                  })
         for leg in option_order.legs:
-            storage.lpush("{}:{}:legs".format(self.get_name(), option_order.id),
-                          leg["id"])
+            pipe.lpush("{}:{}:legs".format(self.get_name(), option_order.id),
+                       leg["id"])
             leg.pop('executions', None)
-            storage.hset("{}:leg:{}".format(self.get_name(), leg["id"]), mapping=leg)
-        storage.set("{}:raw:{}".format(self.get_name(), option_order.id), str(legs))
+            pipe.hset("{}:leg:{}".format(self.get_name(), leg["id"]), mapping=leg)
+        pipe.set("{}:raw:{}".format(self.get_name(), option_order.id), encode_legs(legs))
+        pipe.execute()
 
     @staticmethod
+    @timed('strategy_evaluate_criteria')
     def evaluate_criteria(criteria, **kwargs) -> bool:
         parser = Parser()
         eval_result = None
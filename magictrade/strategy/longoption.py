@@ -113,7 +113,7 @@ class LongOptionTradingStrategy(TradingStrategy):
             option_type,
             symbol,
             quantity,
-            round(price * 100, 2)))
+            round(price * 100, 2)), position=option_order.id, symbol=symbol, event='open')
         return {'status': 'placed', 'quantity': quantity, 'price': round(price * 100, 2)}
 
     def close_position(self, position: str, data: Dict, legs: List, reason: str):
@@ -157,7 +157,8 @@ class OptionSellerTradingStrategy(TradingStrategy):
             config = strategies[strategy]
         if value <= 0:
             self.log(f"Calculated negative credit ({value:.2f}) during maintenance "
-                     f"on {data['symbol']}-{strategy}, skipping...")
+                     f"on {data['symbol']}-{strategy}, skipping...",
+                     position=position, symbol=data['symbol'], event='warning')
             return
         if value and -1 * change >= config['target']:
             # legs that were originally bought now need to be sold
@@ -167,13 +168,15 @@ class OptionSellerTradingStrategy(TradingStrategy):
                                                        strategy,
                                                        abs(change),
                                                        float(data['price']),
-                                                       value))
+                                                       value),
+                     position=position, symbol=data['symbol'], event='closing')
             option_order = self.close_position(position, data, legs, value)
             self.log("[{}]: Closed {}-{} with quantity {} and price {:.2f}.".format(position,
                                                                                     data['symbol'],
                                                                                     strategy,
                                                                                     data['quantity'],
-                                                                                    value))
+                                                                                    value),
+                     position=position, symbol=data['symbol'], event='close')
             return option_order
 
     def make_trade(self, symbol: str, direction: str = "", iv_rank: int = 50, allocation: int = 3, timeline: int = 50,
@@ -228,7 +231,8 @@ class OptionSellerTradingStrategy(TradingStrategy):
         elif not credit >= (min_credit := self._get_fair_credit(legs, spread_width)):
             # TODO: decide what to do
             self.log(
-                f"Trade isn't fair; received credit {credit:.2f} < {min_credit:.2f}. Placing anyway.")
+                f"Trade isn't fair; received credit {credit:.2f} < {min_credit:.2f}. Placing anyway.",
+                symbol=symbol, event='warning')
 
         option_order = self.broker.options_transact(legs, 'credit', credit,
                                                     quantity, 'open', strategy=strategy)
@@ -241,11 +245,12 @@ class OptionSellerTradingStrategy(TradingStrategy):
             symbol,
             direction,
             quantity,
-            round(credit * 100, 2)))
+            round(credit * 100, 2)), position=option_order.id, symbol=symbol, event='open')
         if immediate_closing_order:
             # TODO: Actually, this doesn't make sense since we haven't guaranteed to fill yet. Find a way to defer this.
             close_price = get_price_from_change(credit, config['target'])
             self.close_position(None, {'quantity': quantity}, legs, close_price, delete=False)
-            self.log(f"[{option_order.id}] Placing closing order with debit {round(close_price, 2)}.")
+            self.log(f"[{option_order.id}] Placing closing order with debit {round(close_price, 2)}.",
+                     position=option_order.id, symbol=symbol, event='closing')
         return {'status': 'placed', 'strategy': strategy, 'legs': legs, 'quantity': quantity,
                 'price': quantity * credit, 'order': option_order}
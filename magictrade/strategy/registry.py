@@ -1,6 +1,27 @@
+from importlib import import_module
+
 strategies = {}
 
+# Module that registers each strategy, so that a strategy is only imported once it is selected.
+STRATEGY_MODULES = {
+    'buyandhold': 'magictrade.strategy.buyandhold',
+    'longoption': 'magictrade.strategy.longoption',
+    'optionseller': 'magictrade.strategy.optionseller',
+    'wheel': 'magictrade.strategy.wheel',
+}
+
 
 def register_strategy(strategy):
     strategies[strategy.name] = strategy
     return strategy
+
+
+def get_strategy(name: str):
+    """
+    Return the strategy class registered under the given name, importing its module on first use.
+    :param name: Strategy name, as listed in STRATEGY_MODULES.
+    :return: The strategy class.
+    """
+    if name not in strategies:
+        import_module(STRATEGY_MODULES[name])
+    return strategies[name]
@@ -55,7 +55,7 @@ class WheelTradingStrategy(TradingStrategy):
             raise TradeException("Could not find a valid expiration date with a suitable strike, "
                                  "or supplied expiration date has no options.")
         credit = option.mark_price
-        option['side'] = 'sell'
+        legs = [(option, 'sell')]
         quantity = 1
         if credit <= 0:
             raise TradeException(f"Calculated negative credit ({credit:.2f}), bailing.")
@@ -65,17 +65,17 @@ class WheelTradingStrategy(TradingStrategy):
         elif not allocation >= option.strike_price * 100:
             raise NoTradeException("Trade quantity equals 0. Ensure allocation is high enough, or enough capital is "
                                    "available.")
-        option_order = self.broker.options_transact([option], 'credit', credit,
+        option_order = self.broker.options_transact(legs, 'credit', credit,
                                                     quantity, 'open')
-        self.save_order(option_order, [option], {}, strategy='wheel', price=credit,
+        self.save_order(option_order, legs, {}, strategy='wheel', price=credit,
                         quantity=quantity, expires=target_date, symbol=symbol,
                         close_criteria=close_criteria)
         self.log("[{}]: Opened {} in {} for wheel. Received credit {}.".format(
             option_order.id,
             option.option_type,
             symbol,
-            round(credit * 100, 2)))
-        return {'status': 'placed', 'strategy': 'wheel', 'legs': [option], 'quantity': quantity,
+            round(credit * 100, 2)), position=option_order.id, symbol=symbol, event='open')
+        return {'status': 'placed', 'strategy': 'wheel', 'legs': legs, 'quantity': quantity,
                 'price': quantity * credit, 'order': option_order}
 
     def _maintenance(self):
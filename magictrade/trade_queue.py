@@ -1,10 +1,146 @@
 import datetime
 import json
+import uuid
 from abc import ABC, abstractmethod
 from json import JSONDecodeError
-from typing import Dict, List
-
-from magictrade import storage
+from time import monotonic
+from typing import Container, Dict, Iterator, List, Optional, Tuple
+
+from redis import StrictRedis
+
+from magictrade import storage as default_storage
+from magictrade.journal import Journal
+from magictrade.metrics import timed
+
+DEFAULT_VISIBILITY_TIMEOUT = 300
+# Most scheduled trades moved to the queue per script call, which keeps each call short.
+PROMOTE_BATCH_SIZE = 1000
+# Seconds that an expired trade's data and status are kept, so clients can still look them up.
+DEFAULT_EXPIRED_RETENTION = 86400
+# Seconds that a trade stays marked as being placed if its worker stops before finishing.
+PLACING_TTL = 7 * 86400
+
+# Trades with no priority go in the normal lane, which is the queue list itself.
+PRIORITIES = ('high', 'normal', 'low')
+
+# Lane list that a queued trade belongs on, from the priority stored with it.
+LANE_FUNCTION = """
+local function lane(queue, identifier)
+    local priority = redis.call('HGET', queue .. ':' .. identifier, 'priority')
+    if priority and priority ~= '' and priority ~= 'normal' then
+        return queue .. ':lane:' .. priority
+    end
+    return queue
+end
+"""
+
+# Keys: lanes, highest priority first.
+# Pops the next trade from the highest priority lane that has one.
+POP_SCRIPT = """
+for _, key in ipairs(KEYS) do
+    local identifier = redis.call('RPOP', key)
+    if identifier then
+        return identifier
+    end
+end
+return false
+"""
+
+# Keys: processing list, claim deadlines (zset), claim owners (hash), then lanes, highest priority first.
+# Args: current time, visibility timeout, consumer, queue name.
+# Returns claims whose deadline has passed to the consumer end of their lane, then claims the next trade by moving it
+# to the processing list.
+CLAIM_SCRIPT = LANE_FUNCTION + """
+for _, identifier in ipairs(redis.call('ZRANGEBYSCORE', KEYS[2], '-inf', ARGV[1])) do
+    redis.call('LREM', KEYS[1], 0, identifier)
+    redis.call('RPUSH', lane(ARGV[4], identifier), identifier)
+    redis.call('ZREM', KEYS[2], identifier)
+    redis.call('HDEL', KEYS[3], identifier)
+end
+for i = 4, #KEYS do
+    local identifier = redis.call('RPOPLPUSH', KEYS[i], KEYS[1])
+    if identifier then
+        redis.call('ZADD', KEYS[2], tonumber(ARGV[1]) + tonumber(ARGV[2]), identifier)
+        redis.call('HSET', KEYS[3], identifier, ARGV[3])
+        return identifier
+    end
+end
+return false
+"""
+
+# Keys: processing list, claim deadlines, claim owners. Args: current time, queue name.
+# Returns claims whose deadline has passed to the consumer end of their lane, without claiming anything.
+REDELIVER_SCRIPT = LANE_FUNCTION + """
+local expired = redis.call('ZRANGEBYSCORE', KEYS[2], '-inf', ARGV[1])
+for _, identifier in ipairs(expired) do
+    redis.call('LREM', KEYS[1], 0, identifier)
+    redis.call('RPUSH', lane(ARGV[2], identifier), identifier)
+    redis.call('ZREM', KEYS[2], identifier)
+    redis.call('HDEL', KEYS[3], identifier)
+end
+return #expired
+"""
+
+# Keys: processing list, claim deadlines, claim owners. Args: identifier, consumer, requeue (1 or 0), queue name.
+# Drops a claim if it is still held by the consumer, optionally putting the trade back in its lane.
+RELEASE_SCRIPT = LANE_FUNCTION + """
+if redis.call('HGET', KEYS[3], ARGV[1]) ~= ARGV[2] then
+    return 0
+end
+redis.call('LREM', KEYS[1], 0, ARGV[1])
+redis.call('ZREM', KEYS[2], ARGV[1])
+redis.call('HDEL', KEYS[3], ARGV[1])
+if ARGV[3] == '1' then
+    redis.call('LPUSH', lane(ARGV[4], ARGV[1]), ARGV[1])
+end
+return 1
+"""
+
+# Keys: claim deadlines, claim owners. Args: identifier, consumer, new deadline.
+EXTEND_SCRIPT = """
+if redis.call('HGET', KEYS[2], ARGV[1]) ~= ARGV[2] then
+    return 0
+end
+redis.call('ZADD', KEYS[1], 'XX', ARGV[3], ARGV[1])
+return 1
+"""
+
+# Keys: queue, scheduled trades (zset). Args: current time, batch size.
+# Moves up to a batch of trades whose start time has passed into their lanes, oldest first.
+PROMOTE_SCRIPT = LANE_FUNCTION + """
+local due = redis.call('ZRANGEBYSCORE', KEYS[2], '-inf', ARGV[1], 'LIMIT', 0, ARGV[2])
+for _, identifier in ipairs(due) do
+    redis.call('LPUSH', lane(KEYS[1], identifier), identifier)
+end
+if #due > 0 then
+    redis.call('ZREM', KEYS[2], unpack(due))
+end
+return #due
+"""
+
+# Keys: end time index (zset), scheduled trades (zset). Args: cutoff time, batch size, queue name.
+# Deletes up to a batch of trades that ended before the cutoff, along with their criteria and status.
+SWEEP_SCRIPT = """
+local expired = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, ARGV[2])
+for _, identifier in ipairs(expired) do
+    local data = ARGV[3] .. ':' .. identifier
+    redis.call('DEL', data, data .. ':open_criteria', data .. ':close_criteria',
+               ARGV[3] .. ':status:' .. identifier, ARGV[3] .. ':placing:' .. identifier)
+end
+if #expired > 0 then
+    redis.call('ZREM', KEYS[1], unpack(expired))
+    redis.call('ZREM', KEYS[2], unpack(expired))
+end
+return #expired
+"""
+
+pop_script = default_storage.register_script(POP_SCRIPT)
+claim_script = default_storage.register_script(CLAIM_SCRIPT)
+release_script = default_storage.register_script(RELEASE_SCRIPT)
+redeliver_script = default_storage.register_script(REDELIVER_SCRIPT)
+extend_script = default_storage.register_script(EXTEND_SCRIPT)
+promote_script = default_storage.register_script(PROMOTE_SCRIPT)
+sweep_script = default_storage.register_script(SWEEP_SCRIPT)
 
 
 class TradeQueueException(Exception):
@@ -56,6 +192,12 @@ class TradeQueue(ABC):
     def get_data(self, identifier: str):
         pass
 
+    def ack(self, identifier: str) -> bool:
+        """
+        Mark a popped trade as processed. Only needed for queues that track claims.
+        """
+        return True
+
     @abstractmethod
     def get_allocation(self, new: bool = False) -> int:
         pass
@@ -102,10 +244,53 @@ class TradeQueue(ABC):
 
 
 class RedisTradeQueue(TradeQueue):
-    def __init__(self, queue_name: str):
+    def __init__(self, queue_name: str, reliable: bool = False,
+                 visibility_timeout: int = DEFAULT_VISIBILITY_TIMEOUT, consumer: str = None,
+                 journal: Journal = None, storage: StrictRedis = None):
+        """
+        :param queue_name: Queue name to store data in.
+        :param reliable: Claim popped trades instead of removing them, so that several workers can share a queue and a
+                         trade whose worker dies is delivered again once its visibility timeout passes. Each popped
+                         trade must then be acknowledged with `ack`.
+        :param visibility_timeout: Seconds a claimed trade stays hidden from other workers.
+        :param consumer: Name of this worker; unique by default.
+        :param journal: Journal to record writes to trade data, statuses and the queue in.
+        :param storage: Redis connection holding the queue; the shared connection by default.
+        """
         self.queue_name = queue_name
         self.index = 0
         self._stage = []
+        self.reliable = reliable
+        self.visibility_timeout = visibility_timeout
+        self.consumer = consumer or uuid.uuid4().hex
+        self.lanes = [self.lane(priority) for priority in PRIORITIES]
+        self.journal = journal
+        self.storage = storage or default_storage
+
+    @property
+    def _storage(self):
+        return self.journal.wrap(self.storage) if self.journal else self.storage
+
+    def _run_script(self, script, keys: List, args: List):
+        if self.journal:
+            return self.journal.run_script(script, keys, args, client=self.storage)
+        return script(keys=keys, args=args, client=self.storage)
+
+    @property
+    def _claim_keys(self) -> List[str]:
+        return [self.queue_name + ":processing", self.queue_name + ":claims", self.queue_name + ":claim_owners"]
+
+    def lane(self, priority: str = None) -> str:
+        """
+        :param priority: One of `PRIORITIES`; normal if not given.
+        :return: Name of the list that holds queued trades of this priority.
+        """
+        if not priority or priority == 'normal':
+            return self.queue_name
+        if priority not in PRIORITIES:
+            raise TradeQueueException("Invalid priority '{}', must be one of {}.".format(priority,
+                                                                                       ', '.join(PRIORITIES)))
+        return "{}:lane:{}".format(self.queue_name, priority)
 
     def _data_name(self, identifer: str) -> str:
         return "{}:{}".format(self.queue_name, identifer)
@@ -114,85 +299,314 @@ class RedisTradeQueue(TradeQueue):
         return iter(self.all())
 
     def __next__(self):
-        if self.index >= self.__len__():
-            raise StopIteration
-        result = storage.lindex(self.queue_name, self.index)
-        self.index += 1
-        return result
+        # Walk the lanes in priority order, the same order as `all`.
+        offset = self.index
+        for lane in self.lanes:
+            length = self.storage.llen(lane)
+            if offset < length:
+                self.index += 1
+                return self.storage.lindex(lane, offset)
+            offset -= length
+        raise StopIteration
 
     def __len__(self):
-        return storage.llen(self.queue_name)
+        pipe = self.storage.pipeline(transaction=False)
+        for lane in self.lanes:
+            pipe.llen(lane)
+        return sum(pipe.execute())
 
     def all(self):
-        return storage.lrange(self.queue_name, 0, -1)
-
+        pipe = self.storage.pipeline(transaction=False)
+        for lane in self.lanes:
+            pipe.lrange(lane, 0, -1)
+        return [identifier for identifiers in pipe.execute() for identifier in identifiers]
+
+    def _page(self, key: str, start: int, batch_size: int, scheduled: bool = False) -> List[str]:
+        if scheduled:
+            return self.storage.zrange(key, start, start + batch_size - 1)
+        return self.storage.lrange(key, start, start + batch_size - 1)
+
+    def iter_with_data(self, batch_size: int = 500, symbol: str = None, strategy: str = None, status: str = None,
+                       scheduled: bool = True) -> Iterator[Tuple[str, Dict, Optional[str]]]:
+        """
+        Page through queued trades, highest priority first, then scheduled trades, soonest first. Each page of
+        identifiers is read with one command and their data and statuses with one pipelined round trip, and results
+        are yielded as each page arrives. Trades added or popped meanwhile may be skipped or seen twice.
+        :param batch_size: Trades per page.
+        :param symbol: Only include trades in this symbol.
+        :param strategy: Only include trades for this strategy.
+        :param status: Only include trades with this status.
+        :param scheduled: Also include trades scheduled for later.
+        :return: (identifier, data, status) tuples.
+        """
+        sources = [(lane, False) for lane in self.lanes]
+        if scheduled:
+            sources.append((self.queue_name + ":scheduled", True))
+        for key, is_scheduled in sources:
+            start = 0
+            while identifiers := self._page(key, start, batch_size, is_scheduled):
+                start += len(identifiers)
+                pipe = self.storage.pipeline(transaction=False)
+                for identifier in identifiers:
+                    pipe.hgetall(self._data_name(identifier))
+                    pipe.get("{}:status:{}".format(self.queue_name, identifier))
+                results = pipe.execute()
+                for identifier, data, trade_status in zip(identifiers, results[::2], results[1::2]):
+                    if symbol and data.get('symbol', '').upper() != symbol.upper():
+                        continue
+                    if strategy and data.get('strategy') != strategy:
+                        continue
+                    if status and trade_status != status:
+                        continue
+                    yield identifier, data, trade_status
+                if len(identifiers) < batch_size:
+                    break
+
+    @timed('trade_queue', op='set_data')
     def set_data(self, identifier: str, trade: Dict):
         for key in ('open', 'close'):
             trade.pop(f"{key}_criteria", None)
-        storage.hset(self._data_name(identifier), mapping=trade)
+        pipe = self._storage.pipeline()
+        pipe.hset(self._data_name(identifier), mapping=trade)
+        if trade.get('end'):
+            pipe.zadd(self.queue_name + ":expiring", {identifier: float(trade['end'])})
+        pipe.execute()
 
+    @timed('trade_queue', op='add_criteria')
     def add_criteria(self, identifier: str, open_close: str, criteria: List[Dict]):
         key = f"{self._data_name(identifier)}:{open_close}_criteria"
         for criterium in criteria:
-            storage.rpush(key, json.dumps(criterium))
+            self._storage.rpush(key, json.dumps(criterium))
 
+    @timed('trade_queue', op='get_criteria')
     def get_criteria(self, identifier: str) -> (List[str], List[str]):
         try:
-            return [json.loads(c) for c in storage.lrange(f"{self._data_name(identifier)}:open_criteria", 0, -1)], \
-                   [json.loads(c) for c in storage.lrange(f"{self._data_name(identifier)}:close_criteria", 0, -1)], \
+            key = self._data_name(identifier)
+            return [json.loads(c) for c in self.storage.lrange(f"{key}:open_criteria", 0, -1)], \
+                   [json.loads(c) for c in self.storage.lrange(f"{key}:close_criteria", 0, -1)], \
                    json.loads(self.get_data(identifier).get('trade_criteria', '{}'))
         except JSONDecodeError:
             raise TradeQueueException(f"Unable to decode JSON in criteria for trade '{identifier}'")
 
+    @timed('trade_queue', op='add')
     def add(self, identifier: str, trade: Dict):
-        storage.lpush(self.queue_name, identifier)
+        self._storage.lpush(self.lane(trade.get('priority')), identifier)
         self.set_data(identifier, trade)
 
+    @timed('trade_queue', op='set_status')
     def set_status(self, identifier: str, status: str):
-        storage.set("{}:status:{}".format(self.queue_name, identifier), status)
-
+        """
+        Store a trade's status and publish it on a channel of the same name as the key, `{queue}:status:{id}`, so
+        that clients can wait for it with `wait_for_status` or watch a whole queue with `PSUBSCRIBE {queue}:status:*`.
+        """
+        key = "{}:status:{}".format(self.queue_name, identifier)
+        pipe = self._storage.pipeline()
+        pipe.set(key, status)
+        pipe.publish(key, status)
+        pipe.execute()
+
+    @timed('trade_queue', op='get_status')
     def get_status(self, identifier: str) -> str:
-        return storage.get("{}:status:{}".format(self.queue_name, identifier))
-
+        return self.storage.get("{}:status:{}".format(self.queue_name, identifier))
+
+    def wait_for_status(self, identifier: str, timeout: float = None,
+                        ignore: Container[Optional[str]] = (None, 'deferred')) -> Optional[str]:
+        """
+        Block until a trade has a status other than those in `ignore`, without polling. Returns straight away if it
+        already has one.
+        :param identifier: Trade identifier.
+        :param timeout: Most seconds to wait; forever by default.
+        :param ignore: Statuses to keep waiting through. None is a trade that has not been handled yet.
+        :return: The status, or None if the timeout passed first.
+        """
+        key = "{}:status:{}".format(self.queue_name, identifier)
+        deadline = None if timeout is None else monotonic() + timeout
+        pubsub = self.storage.pubsub(ignore_subscribe_messages=True)
+        try:
+            # Subscribe before reading the status, so that a change in between is not missed.
+            pubsub.subscribe(key)
+            status = self.get_status(identifier)
+            while status in ignore:
+                remaining = None if deadline is None else deadline - monotonic()
+                if remaining is not None and remaining <= 0:
+                    return None
+                if message := pubsub.get_message(timeout=1 if remaining is None else min(remaining, 1)):
+                    status = message['data']
+            return status
+        finally:
+            pubsub.close()
+
+    @timed('trade_queue', op='add_failed')
     def add_failed(self, identifier: str, error: str):
-        storage.lpush(self.queue_name + "-failed", identifier)
+        self._storage.lpush(self.queue_name + "-failed", identifier)
         self.set_status(identifier, error)
 
     def stage_trade(self, identifier: str):
         self._stage.append(identifier)
 
+    @timed('trade_queue', op='schedule')
+    def schedule(self, identifier: str, start: float, trade: Dict = None):
+        """
+        Hold a trade back until its start time instead of putting it on the queue.
+        :param identifier: Trade identifier.
+        :param start: Timestamp from which the trade may be made.
+        :param trade: Trade data to store, if it is not stored already.
+        """
+        if trade:
+            self.set_data(identifier, trade)
+        self._storage.zadd(self.queue_name + ":scheduled", {identifier: float(start)})
+
+    @timed('trade_queue', op='promote_due')
+    def promote_due(self, now: float = None) -> int:
+        """
+        Move scheduled trades whose start time has passed onto the queue. Only due trades are read, so this costs the
+        same however many trades are scheduled further out.
+        :param now: Current timestamp; the system time by default.
+        :return: Number of trades moved.
+        """
+        if now is None:
+            now = datetime.datetime.now().timestamp()
+        total = 0
+        while (moved := self._run_script(promote_script, [self.queue_name, self.queue_name + ":scheduled"],
+                                         [now, PROMOTE_BATCH_SIZE])) == PROMOTE_BATCH_SIZE:
+            total += moved
+        return total + moved
+
+    @timed('trade_queue', op='sweep_expired')
+    def sweep_expired(self, now: float = None, retention: float = DEFAULT_EXPIRED_RETENTION) -> int:
+        """
+        Delete the data, criteria and status of trades whose end time passed more than `retention` seconds ago, and
+        drop them from the schedule. Trades are found through an index of end times, so only expired trades are read.
+        Identifiers still on the queue are skipped when popped.
+        :param now: Current timestamp; the system time by default.
+        :param retention: Seconds to keep expired trades for.
+        :return: Number of trades deleted.
+        """
+        if now is None:
+            now = datetime.datetime.now().timestamp()
+        total = 0
+        keys = [self.queue_name + ":expiring", self.queue_name + ":scheduled"]
+        while (deleted := self._run_script(sweep_script, keys, [now - retention, PROMOTE_BATCH_SIZE,
+                                                                self.queue_name])) == PROMOTE_BATCH_SIZE:
+            total += deleted
+        return total + deleted
+
+    @timed('trade_queue', op='pop')
     def pop(self):
-        identifier = storage.rpop(self.queue_name)
+        if self.reliable:
+            identifier = self._run_script(claim_script, self._claim_keys + self.lanes,
+                                          [datetime.datetime.now().timestamp(), self.visibility_timeout,
+                                           self.consumer, self.queue_name])
+        else:
+            identifier = self._run_script(pop_script, self.lanes, [])
         trade = self.get_data(identifier)
         return identifier, trade
 
+    @timed('trade_queue', op='ack')
+    def ack(self, identifier: str) -> bool:
+        """
+        Mark a claimed trade as processed, removing it from the processing list.
+        :param identifier: Trade identifier returned by `pop`.
+        :return: Whether this worker still held the claim. If not, the trade has already been delivered again.
+        """
+        if not self.reliable:
+            return True
+        return bool(self._run_script(release_script, self._claim_keys, [identifier, self.consumer, 0, self.queue_name]))
+
+    @timed('trade_queue', op='redeliver_expired')
+    def redeliver_expired(self, now: float = None) -> int:
+        """
+        Put claimed trades whose visibility timeout has passed back on the queue, so that they are counted by `len`
+        and delivered by the next `pop`.
+        :param now: Current timestamp; the system time by default.
+        :return: Number of trades put back.
+        """
+        if now is None:
+            now = datetime.datetime.now().timestamp()
+        return self._run_script(redeliver_script, self._claim_keys, [now, self.queue_name])
+
+    def start_placing(self, identifier: str) -> bool:
+        """
+        Mark a claimed trade as being placed. A trade redelivered while it is marked, because its worker took longer
+        than the visibility timeout or stopped part way through, must not be placed again.
+        :param identifier: Trade identifier returned by `pop`.
+        :return: Whether this worker may place the trade, i.e. it was not already marked.
+        """
+        return bool(self._storage.set("{}:placing:{}".format(self.queue_name, identifier), self.consumer, nx=True,
+                                      ex=PLACING_TTL))
+
+    def finish_placing(self, identifier: str):
+        """
+        Clear the mark set by `start_placing`, once the trade's outcome has been stored.
+        """
+        self._storage.delete("{}:placing:{}".format(self.queue_name, identifier))
+
+    def release(self, identifier: str) -> bool:
+        """
+        Give up a claimed trade without processing it, putting it back at the end of the queue.
+        :param identifier: Trade identifier returned by `pop`.
+        :return: Whether this worker still held the claim.
+        """
+        return bool(self._run_script(release_script, self._claim_keys, [identifier, self.consumer, 1, self.queue_name]))
+
+    def extend(self, identifier: str, timeout: int = None) -> bool:
+        """
+        Keep a claimed trade hidden from other workers for longer, e.g. while a slow order is being placed.
+        :param identifier: Trade identifier returned by `pop`.
+        :param timeout: Seconds from now; the queue's visibility timeout by default.
+        :return: Whether this worker still held the claim.
+        """
+        deadline = datetime.datetime.now().timestamp() + (timeout or self.visibility_timeout)
+        return bool(self._run_script(extend_script, self._claim_keys[1:], [identifier, self.consumer, deadline]))
+
+    def processing(self) -> List[Tuple[str, str, float]]:
+        """
+        :return: Claimed trades, as (identifier, consumer, deadline) tuples.
+        """
+        pipe = self.storage.pipeline()
+        pipe.zrange(self.queue_name + ":claims", 0, -1, withscores=True)
+        pipe.hgetall(self.queue_name + ":claim_owners")
+        claims, owners = pipe.execute()
+        return [(identifier, owners.get(identifier), deadline) for identifier, deadline in claims]
+
+    @timed('trade_queue', op='get_data')
     def get_data(self, identifier: str):
-        return storage.hgetall(self._data_name(identifier))
+        return self.storage.hgetall(self._data_name(identifier))
 
     def get_allocation(self, new: bool = False) -> int:
         try:
-            return int(storage.get("{}:{}allocation".format(self.queue_name, "new_" if new else ""))) or 0
+            return int(self.storage.get("{}:{}allocation".format(self.queue_name, "new_" if new else ""))) or 0
         except TypeError:
             return 0
 
     def pop_new_allocation(self) -> int:
         new_allocation = self.get_allocation(new=True)
-        storage.delete(self.queue_name + ":new_allocation")
+        self.storage.delete(self.queue_name + ":new_allocation")
         return new_allocation
 
     def set_current_usage(self, buying_power: float, balance: float):
-        storage.set(self.queue_name + ":current_usage", f"{buying_power}/{balance}")
+        self.storage.set(self.queue_name + ":current_usage", f"{buying_power}/{balance}")
 
     def delete_current_usage(self):
-        storage.delete(self.queue_name + ":current_usage")
+        self.storage.delete(self.queue_name + ":current_usage")
 
     def heartbeat(self):
-        storage.set(self.queue_name + ":heartbeat", datetime.datetime.now().timestamp())
+        self.storage.set(self.queue_name + ":heartbeat", datetime.datetime.now().timestamp())
 
+    @timed('trade_queue', op='staged_to_queue')
     def staged_to_queue(self):
+        if self.reliable:
+            while self._stage:
+                self.release(self._stage.pop())
+            return
+        pipe = self.storage.pipeline(transaction=False)
+        for identifier in self._stage:
+            pipe.hget(self._data_name(identifier), 'priority')
+        priorities = pipe.execute()
         while self._stage:
-            storage.lpush(self.queue_name, self._stage.pop())
+            self._storage.lpush(self.lane(priorities.pop()), self._stage.pop())
 
+    @timed('trade_queue', op='send_trade')
     def send_trade(self, args: Dict) -> str:
         from magictrade.utils import generate_identifier
         identifier = generate_identifier(args['symbol'])
@@ -207,22 +621,27 @@ class RedisTradeQueue(TradeQueue):
             args.pop('close_criteria')
         if 'trade_criteria' in args:
             args['trade_criteria'] = json.dumps(args['trade_criteria'])
-        self.add(identifier, args)
+        # Reject an invalid priority before anything is stored.
+        self.lane(args.get('priority'))
+        if args.get('start') and float(args['start']) > datetime.datetime.now().timestamp():
+            self.schedule(identifier, args['start'], args)
+        else:
+            self.add(identifier, args)
         return identifier
 
     def run_maintenance(self):
-        storage.set(self.queue_name + ":maintenance", 1)
+        self.storage.set(self.queue_name + ":maintenance", 1)
 
     def should_run_maintenance(self) -> bool:
-        should = storage.get(self.queue_name + ":maintenance")
+        should = self.storage.get(self.queue_name + ":maintenance")
         if should:
-            storage.delete(self.queue_name + ":maintenance")
+            self.storage.delete(self.queue_name + ":maintenance")
         return should
 
     @property
     def last_maintenance(self) -> datetime.datetime:
-        return datetime.datetime.fromtimestamp(storage.get(self.queue_name + ":last_maintenance"))
+        return datetime.datetime.fromtimestamp(self.storage.get(self.queue_name + ":last_maintenance"))
 
     @last_maintenance.setter
     def last_maintenance(self, when: datetime.datetime):
-        storage.set(self.queue_name + ":last_maintenance", when.timestamp())
+        self.storage.set(self.queue_name + ":last_maintenance", when.timestamp())
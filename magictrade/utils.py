@@ -1,11 +1,14 @@
 import calendar
+import json
 import logging
 import subprocess
 from ast import literal_eval
+from bisect import bisect_left
 from datetime import datetime, time, timedelta
 from glob import glob
+from json import JSONDecodeError
 from os.path import join, dirname, basename
-from typing import List, Tuple, Dict, Callable
+from typing import List, Tuple, Dict, Callable, Container, Iterable, Optional
 
 import pkg_resources
 from math import erf, sqrt, log
@@ -14,8 +17,58 @@ from redis import StrictRedis
 from requests import HTTPError
 
 from magictrade import storage, Broker
+from magictrade.history import AccountHistory
 from magictrade.securities import Option
 
+LEGS_FORMAT_VERSION = 1
+
+# Keys: source keys. Args: source queue name, destination queue name.
+# Renames each key to the destination queue. Where the destination key already exists with the same type, a list is
+# appended to it, a sorted set is merged keeping the lower score of a member in both, and a hash or set is merged with
+# the source's fields winning. Any other key is dropped.
+MIGRATE_QUEUE_SCRIPT = """
+local renamed, merged, dropped = 0, 0, 0
+for _, key in ipairs(KEYS) do
+    local dest = ARGV[2] .. string.sub(key, #ARGV[1] + 1)
+    if redis.call('EXISTS', key) == 0 then
+        -- Removed since it was scanned.
+    elseif redis.call('RENAMENX', key, dest) == 1 then
+        renamed = renamed + 1
+    else
+        local key_type, dest_type = redis.call('TYPE', key).ok, redis.call('TYPE', dest).ok
+        if key_type ~= dest_type then
+            dropped = dropped + 1
+        elseif key_type == 'list' then
+            local items = redis.call('LRANGE', key, 0, -1)
+            for i = 1, #items, 1000 do
+                redis.call('RPUSH', dest, unpack(items, i, math.min(i + 999, #items)))
+            end
+            merged = merged + 1
+        elseif key_type == 'zset' then
+            redis.call('ZUNIONSTORE', dest, 2, dest, key, 'AGGREGATE', 'MIN')
+            merged = merged + 1
+        elseif key_type == 'hash' then
+            local fields = redis.call('HGETALL', key)
+            for i = 1, #fields, 1000 do
+                redis.call('HSET', dest, unpack(fields, i, math.min(i + 999, #fields)))
+            end
+            merged = merged + 1
+        elseif key_type == 'set' then
+            redis.call('SUNIONSTORE', dest, dest, key)
+            merged = merged + 1
+        else
+            dropped = dropped + 1
+        end
+        redis.call('DEL', key)
+    end
+end
+return {renamed, merged, dropped}
+"""
+
+migrate_queue_script = storage.register_script(MIGRATE_QUEUE_SCRIPT)
+# Key types that the script merges into an existing destination key.
+MERGED_TYPES = ('list', 'zset', 'hash', 'set')
+
 
 def safe_abs(x, /):
     try:
@@ -38,9 +91,53 @@ def calculate_percent_otm(current_price: float, strike_price: float, iv: float,
     return round(result, 2)
 
 
-def get_account_history(account_id: str) -> Tuple[List[str], List[float]]:
-    return storage.lrange(account_id + ":dates", 0, -1), \
-           [float(v) for v in storage.lrange(account_id + ":values", 0, -1)]
+def get_account_history(account_id: str, start: float = None, end: float = None,
+                        max_points: int = None) -> Tuple[List[str], List[float]]:
+    """
+    Account values over a time range, read from `AccountHistory`. Older parts of the range come from hourly or daily
+    rollups, using the bucket's closing value.
+    :param account_id: Account to read.
+    :param start: Earliest timestamp to include.
+    :param end: Latest timestamp to include.
+    :param max_points: Read coarser rollups if needed to return no more than this many points, e.g. one per pixel.
+    :return: Dates and values. Values logged before the time series existed are only included once
+             `migrate_account_history` has been run.
+    """
+    points = AccountHistory(account_id).range(start, end, max_points=max_points)
+    return [datetime.fromtimestamp(point[0]).strftime("%Y-%m-%d %H-%M-%S") for point in points], \
+           [point[4] for point in points]
+
+
+def get_events(account_name: str, start: float = None, end: float = None, position: str = None,
+               strategy: str = None, count: int = None, newest_first: bool = False) -> List[Dict]:
+    """
+    Read the structured event log written by `TradingStrategy.log`. Only the requested time range is read.
+    :param account_name: Account's storage name, as returned by `TradingStrategy.get_name`.
+    :param start: Earliest timestamp to include.
+    :param end: Latest timestamp to include.
+    :param position: Only include events about this position. These are kept in a separate log per position.
+    :param strategy: Only include events logged by this strategy.
+    :param count: Most events to return.
+    :param newest_first: Return the most recent events first, e.g. to show the last few.
+    :return: Events, with their timestamp under 'time' and stream entry ID under 'id'.
+    """
+    key = account_name + ":events"
+    if position:
+        key += ":" + position
+    low = int(start * 1000) if start is not None else '-'
+    high = int(end * 1000) if end is not None else '+'
+    if newest_first:
+        entries = storage.xrevrange(key, high, low, count=None if strategy else count)
+    else:
+        entries = storage.xrange(key, low, high, count=None if strategy else count)
+    events = []
+    for entry_id, fields in entries:
+        if strategy and fields.get('strategy') != strategy:
+            continue
+        events.append({'id': entry_id, 'time': int(entry_id.split('-')[0]) / 1000, **fields})
+        if count and len(events) == count:
+            break
+    return events
 
 
 def get_percentage_change(start: float, end: float) -> float:
@@ -99,6 +196,40 @@ def get_monthly_option(start_date: datetime = None) -> str:
     return date_format(first_friday + timedelta(days=14))
 
 
+class ExpirationIndex:
+    """
+    Sorted expiration dates of an option chain with their day ordinals, for finding the nearest expiration to a
+    target day without formatting or parsing dates.
+    """
+    __slots__ = ('dates', 'ordinals')
+
+    def __init__(self, dates: Iterable[str]):
+        self.dates = sorted(set(dates))
+        self.ordinals = [from_date_format(d).toordinal() for d in self.dates]
+
+    def __len__(self):
+        return len(self.dates)
+
+    def nearest(self, ordinal: int, exclude: Container[str] = ()) -> Optional[str]:
+        """
+        Find the expiration closest to a day, preferring the later one on a tie.
+        :param ordinal: Target day, as from `date.toordinal()`.
+        :param exclude: Expiration dates to skip.
+        :return: The expiration date, or None if every date is excluded.
+        """
+        later = bisect_left(self.ordinals, ordinal)
+        earlier = later - 1
+        while later < len(self.dates) and self.dates[later] in exclude:
+            later += 1
+        while earlier >= 0 and self.dates[earlier] in exclude:
+            earlier -= 1
+        if later < len(self.dates) and (earlier < 0
+                                        or self.ordinals[later] - ordinal <= ordinal - self.ordinals[earlier]):
+            return self.dates[later]
+        if earlier >= 0:
+            return self.dates[earlier]
+
+
 def get_risk(spread_width: float, price: float) -> float:
     return (spread_width - price) * 100
 
@@ -119,13 +250,23 @@ def normalize_trade(trade: Dict) -> Dict:
             del trade[key]
 
 
+def _http_debug_log() -> logging.Logger:
+    logger = logging.getLogger('magictrade.http_debug')
+    if not logger.handlers:
+        # Keep the file open rather than reopening it for every error.
+        handler = logging.FileHandler("http_debug.log", delay=True)
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        logger.addHandler(handler)
+        logger.propagate = False
+    return logger
+
+
 def handle_error(e: Exception, debug: bool = False):
     try:
         if isinstance(e, HTTPError):
-            with open("http_debug.log", "a") as f:
-                text = str(e.response.text)
-                logging.error(text)
-                f.write(text + "\n")
+            text = str(e.response.text)
+            logging.error(text)
+            _http_debug_log().error(text)
         if debug:
             raise e
         import sentry_sdk
@@ -138,6 +279,133 @@ def get_offset_date(broker: Broker, days: int) -> str:
     return (broker.date + timedelta(days=days)).strftime("%Y-%m-%d")
 
 
+def encode_legs(legs: List) -> str:
+    """
+    Serialize the legs of an order for storage under `{account}:raw:{id}`.
+    :param legs: Legs as given to the broker, either (option, side) pairs or bare options.
+    :return: Compact, versioned JSON.
+    """
+    return json.dumps({'v': LEGS_FORMAT_VERSION,
+                       'legs': [[dict(leg[0]), leg[1]] if isinstance(leg, (tuple, list)) else dict(leg)
+                                for leg in legs]},
+                      separators=(',', ':'), default=str)
+
+
+def decode_legs(raw: str) -> List:
+    """
+    Deserialize legs stored by `encode_legs`. Values written by older versions (a Python repr of the legs) are
+    still understood.
+    :param raw: Stored value.
+    :return: A list of (option, side) tuples or option dicts; empty if the value could not be decoded.
+    """
+    if not raw:
+        return []
+    if raw.startswith('{'):
+        try:
+            return [tuple(leg) if isinstance(leg, list) else leg for leg in json.loads(raw)['legs']]
+        except (JSONDecodeError, KeyError, TypeError):
+            return []
+    try:
+        return literal_eval(raw)
+    except (ValueError, SyntaxError):
+        return []
+
+
+def migrate_raw_legs(account_name: str, position_storage: StrictRedis = None, batch_size: int = 500,
+                     dry_run: bool = False) -> Tuple[int, List[str]]:
+    """
+    Rewrite legs stored in the legacy repr format using `encode_legs`.
+    :param account_name: Name of the account to migrate.
+    :param position_storage: If the redis host is not localhost, pass an externally-created Redis instance here.
+    :param batch_size: Number of keys to read and write per round trip.
+    :param dry_run: Only count the keys that would be migrated.
+    :return: The number of migrated keys, and the keys that could not be decoded.
+    """
+    position_storage = position_storage or storage
+    migrated = 0
+    failed = []
+    keys = position_storage.scan_iter("{}:raw:*".format(account_name), count=batch_size)
+    while batch := [key for _, key in zip(range(batch_size), keys)]:
+        pipe = position_storage.pipeline()
+        for key, raw in zip(batch, position_storage.mget(batch)):
+            if not raw or raw.startswith('{'):
+                continue
+            try:
+                legs = literal_eval(raw)
+            except (ValueError, SyntaxError):
+                failed.append(key)
+                continue
+            pipe.set(key, encode_legs(legs))
+            migrated += 1
+        if not dry_run:
+            pipe.execute()
+    return migrated, failed
+
+
+def migrate_account_history(account_id: str, history_storage: StrictRedis = None, dry_run: bool = False) -> int:
+    """
+    Move account values from the legacy `dates` and `values` lists into `AccountHistory`.
+    :param account_id: Account to migrate.
+    :param history_storage: If the redis host is not localhost, pass an externally-created Redis instance here.
+    :param dry_run: Only count the values that would be migrated.
+    :return: The number of migrated values.
+    """
+    history_storage = history_storage or storage
+    keys = (account_id + ":dates", account_id + ":values")
+    pipe = history_storage.pipeline(transaction=False)
+    for key in keys:
+        pipe.lrange(key, 0, -1)
+    dates, values = pipe.execute()
+    points = [(datetime.strptime(date, "%Y-%m-%d %H-%M-%S").timestamp(), float(value))
+              for date, value in zip(dates, values)]
+    if not dry_run:
+        AccountHistory(account_id, history_storage=history_storage).backfill(points)
+        history_storage.delete(*keys)
+    return len(points)
+
+
+def migrate_queue(old: str, new: str, queue_storage: StrictRedis = None, batch_size: int = 500,
+                  dry_run: bool = False, progress: Callable[[Dict[str, int]], None] = None) -> Dict[str, int]:
+    """
+    Move every key of a trade queue to a new queue name. Keys are found with SCAN and moved by a script a batch at a
+    time, so each batch is one round trip and is moved atomically.
+    :param old: Queue name to move from.
+    :param new: Queue name to move to.
+    :param queue_storage: If the redis host is not localhost, pass an externally-created Redis instance here.
+    :param batch_size: Number of keys to move per round trip.
+    :param dry_run: Only count what would be moved.
+    :param progress: Called with the running totals after each batch.
+    :return: Number of keys renamed, keys merged into an existing destination key of the same type (lists, sorted
+             sets, hashes and sets), and keys dropped because the destination already existed.
+    """
+    queue_storage = queue_storage or storage
+    totals = {'renamed': 0, 'merged': 0, 'dropped': 0}
+    # SCAN matches on a pattern, which would include other queues whose names start with this one.
+    keys = (key for key in queue_storage.scan_iter("{}*".format(old), count=batch_size)
+            if key in (old, old + '-failed') or key.startswith(old + ':'))
+    while batch := [key for _, key in zip(range(batch_size), keys)]:
+        if dry_run:
+            pipe = queue_storage.pipeline(transaction=False)
+            for key in batch:
+                pipe.type(key)
+                pipe.type(new + key[len(old):])
+            types = pipe.execute()
+            for key_type, dest_type in zip(types[::2], types[1::2]):
+                if dest_type == 'none':
+                    totals['renamed'] += 1
+                elif key_type == dest_type and key_type in MERGED_TYPES:
+                    totals['merged'] += 1
+                else:
+                    totals['dropped'] += 1
+        else:
+            counts = migrate_queue_script(keys=batch, args=[old, new], client=queue_storage)
+            for name, count in zip(('renamed', 'merged', 'dropped'), counts):
+                totals[name] += count
+        if progress:
+            progress(totals)
+    return totals
+
+
 def get_all_trades(account_name: str, position_storage: StrictRedis = None):
     """
     Given an account name, return all positions that are currently open. Function name seems to be a misnomer.
@@ -149,13 +417,14 @@ def get_all_trades(account_name: str, position_storage: StrictRedis = None):
     positions = position_storage.lrange(account_name + ":positions", 0, -1)
     trades = []
     if positions:
+        pipe = position_storage.pipeline(transaction=False)
         for p in positions:
-            try:
-                raw = literal_eval(position_storage.get("{}:raw:{}".format(account_name, p)))
-            except ValueError:
-                raw = []
-            trades.append({'instrument': raw,
-                           'data': position_storage.hgetall('{}:{}'.format(account_name, p))})
+            pipe.get("{}:raw:{}".format(account_name, p))
+            pipe.hgetall('{}:{}'.format(account_name, p))
+        results = pipe.execute()
+        for raw, data in zip(results[::2], results[1::2]):
+            trades.append({'instrument': decode_legs(raw),
+                           'data': data})
     return trades
 
 
@@ -0,0 +1,23 @@
+#!/usr/bin/env python3
+import os
+from argparse import ArgumentParser
+
+import redis
+
+from magictrade.utils import migrate_account_history
+
+storage = redis.StrictRedis(host=os.environ.get("REDIS_HOST", "localhost"), decode_responses=True)
+
+
+def main(account_ids, dry_run: bool):
+    for account_id in account_ids:
+        migrated = migrate_account_history(account_id, storage, dry_run)
+        print("{} {} account values for {}".format("would migrate" if dry_run else "migrated", migrated, account_id))
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description='Move account values from the legacy lists into the account history.')
+    parser.add_argument('account_ids', nargs='+', help='Account IDs to migrate.')
+    parser.add_argument('-n', '--dry-run', action='store_true', help='Only report what would be migrated.')
+    args = parser.parse_args()
+    main(args.account_ids, args.dry_run)
@@ -1,29 +1,28 @@
 #!/usr/bin/env python3
-import redis
+import os
 from argparse import ArgumentParser
 
-storage = redis.StrictRedis(decode_responses=True)
+import redis
+
+from magictrade.utils import migrate_queue
+
+storage = redis.StrictRedis(host=os.environ.get("REDIS_HOST", "localhost"), decode_responses=True)
 
 
-def main(old: str, new: str):
-    for key in storage.scan_iter(f"{old}*"):
-        new_name = key.replace(old, new)
-        storage.renamenx(key, new_name)
-        print("replace", key, "with", new_name)
+def main(old: str, new: str, batch_size: int, dry_run: bool):
+    def progress(totals):
+        print("\r{} renamed, {} lists merged, {} dropped".format(totals['renamed'], totals['merged'],
+                                                                 totals['dropped']), end='', flush=True)
 
-    for key in storage.scan_iter(f"{old}*"):
-        if storage.type(key) == 'list':
-            new_name = key.replace(old, new)
-            print("replace", key, "with", new_name)
-            for item in storage.lrange(key, 0, -1):
-                storage.rpush(new_name, item)
-        storage.delete(key)
-        print("delete", key)
+    totals = migrate_queue(old, new, storage, batch_size, dry_run, progress)
+    print("\n{} {} keys from {} to {}".format("would move" if dry_run else "moved", sum(totals.values()), old, new))
 
 
 if __name__ == '__main__':
-    parser = ArgumentParser()
+    parser = ArgumentParser(description='Move a trade queue and all of its data to a new queue name.')
     parser.add_argument('source_queue', help='Queue name to move from.')
     parser.add_argument('dest_queue', help='Queue name to move to.')
+    parser.add_argument('-b', '--batch-size', type=int, default=500, help='Keys to move per round trip.')
+    parser.add_argument('-n', '--dry-run', action='store_true', help='Only report what would be moved.')
     args = parser.parse_args()
-    main(args.source_queue, args.dest_queue)
+    main(args.source_queue, args.dest_queue, args.batch_size, args.dry_run)
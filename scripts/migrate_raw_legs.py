@@ -0,0 +1,26 @@
+#!/usr/bin/env python3
+import os
+from argparse import ArgumentParser
+
+import redis
+
+from magictrade.utils import migrate_raw_legs
+
+storage = redis.StrictRedis(host=os.environ.get("REDIS_HOST", "localhost"), decode_responses=True)
+
+
+def main(account_names, batch_size: int, dry_run: bool):
+    for account_name in account_names:
+        migrated, failed = migrate_raw_legs(account_name, storage, batch_size, dry_run)
+        print("{} {} raw leg keys for {}".format("would migrate" if dry_run else "migrated", migrated, account_name))
+        for key in failed:
+            print("could not decode", key)
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description='Convert stored order legs to the compact JSON format.')
+    parser.add_argument('account_names', nargs='+', help='Account names to migrate, e.g. "robinhood-123456".')
+    parser.add_argument('-b', '--batch-size', type=int, default=500, help='Keys to convert per round trip.')
+    parser.add_argument('-n', '--dry-run', action='store_true', help='Only report what would be migrated.')
+    args = parser.parse_args()
+    main(args.account_names, args.batch_size, args.dry_run)
@@ -19,11 +19,13 @@ setup(
         'fast_arrow @ git+https://github.com/k3an3/fast_arrow@dev#egg=fast_arrow',
         'tdameritrade @ git+https://github.com/k3an3/tdameritrade@add-option-trades#egg=tdameritrade',
         'pytz',
+        'numpy',
         'scipy'
     ],
     entry_points={
         'console_scripts': [
             'magictrade-daemon=magictrade.runner:main',
+            'magictrade-multi-daemon=magictrade.runner:multi_main',
             'magictrade-cli=magictrade.cli:cli',
             'robinhood-authenticator=magictrade.scripts.robinhood_authenticator:main',
             'optionalpha-toolbox=magictrade.scripts.optionalpha_toolbox:cli',
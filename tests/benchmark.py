@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+"""
+Benchmarks for the trading hot paths, using the fixture chains from data.py. Storage is an in-memory Redis stand-in
+(fakeredis), so no server is needed.
+
+    python tests/benchmark.py                          # print timings
+    python tests/benchmark.py --save tests/benchmark_baseline.json
+    python tests/benchmark.py --compare tests/benchmark_baseline.json
+
+tests/benchmark_baseline.json is the committed baseline. Timings depend on the machine, so when comparing on another
+one, save a baseline from the base branch first and compare the change against that. --compare exits with status 1
+if any median is more than --threshold percent slower.
+"""
+import json
+import platform
+import statistics
+import sys
+import uuid
+from argparse import ArgumentParser
+from datetime import datetime
+from timeit import Timer
+from typing import Callable, Dict
+
+try:
+    import fakeredis
+except ImportError:
+    raise SystemExit("Benchmarks need an in-memory Redis stand-in: pip install fakeredis")
+
+import magictrade
+
+# Must happen before any module that does `from magictrade import storage` is imported.
+magictrade.storage = fakeredis.FakeStrictRedis(decode_responses=True)
+
+from data import quotes, rh_options_1, exp_dates  # noqa: E402
+
+from magictrade.broker.papermoney import PaperMoneyBroker  # noqa: E402
+from magictrade.strategy import TradingStrategy  # noqa: E402
+from magictrade.strategy.optionseller import OptionSellerTradingStrategy, high_iv  # noqa: E402
+from magictrade.trade_queue import RedisTradeQueue  # noqa: E402
+from magictrade.utils import find_option_with_probability, from_date_format  # noqa: E402
+
+DATE = from_date_format('2019-03-31')
+TRADES = {
+    'iron_condor': ('neutral', 52),
+    'iron_butterfly': ('neutral', high_iv),
+    'credit_spread': ('bearish', high_iv),
+}
+CRITERIA = [
+    {'expr': 'price < 45.00'},
+    {'expr': 'price % 2 < 1'},
+    {'expr': 'date >= 1553990400', 'operation': 'or'},
+]
+
+benchmarks = {}
+
+
+def benchmark(name: str, number: int = 100) -> Callable:
+    """
+    Register a benchmark. The decorated function does any setup and returns the callable to time.
+    """
+
+    def decorator(func: Callable) -> Callable:
+        benchmarks[name] = (func, number)
+        return func
+
+    return decorator
+
+
+def new_strategy() -> OptionSellerTradingStrategy:
+    pmb = PaperMoneyBroker(account_id=str(uuid.uuid4()), date=DATE, data=quotes, options_data=rh_options_1,
+                           exp_dates=exp_dates)
+    return OptionSellerTradingStrategy(pmb)
+
+
+for _strategy, (_direction, _iv_rank) in TRADES.items():
+    @benchmark('make_trade_' + _strategy)
+    def _make_trade(direction=_direction, iv_rank=_iv_rank):
+        strategy = new_strategy()
+        return lambda: strategy.make_trade('MU', direction, iv_rank)
+
+
+def _maintenance(positions: int):
+    strategy = new_strategy()
+    for _ in range(positions):
+        strategy.make_trade('MU', 'bearish', high_iv)
+    return strategy.maintenance
+
+
+benchmark('maintenance_10_positions', number=10)(lambda: _maintenance(10))
+benchmark('maintenance_100_positions', number=3)(lambda: _maintenance(100))
+
+
+@benchmark('evaluate_criteria', number=1000)
+def _evaluate_criteria():
+    return lambda: TradingStrategy.evaluate_criteria(CRITERIA, price=38.64, date=DATE.timestamp())
+
+
+@benchmark('find_option_with_probability', number=1000)
+def _find_option_with_probability():
+    calls = PaperMoneyBroker(account_id='benchmark').filter_options(rh_options_1, option_type='call')
+    return lambda: find_option_with_probability(calls, 70)
+
+
+@benchmark('get_quote_historic', number=10000)
+def _get_quote_historic():
+    pmb = PaperMoneyBroker(account_id='benchmark', date='2019-01-03', data=quotes)
+    return lambda: pmb.get_quote('SPY')
+
+
+@benchmark('get_quote_current', number=10000)
+def _get_quote_current():
+    pmb = PaperMoneyBroker(account_id='benchmark', data=quotes)
+    return lambda: pmb.get_quote('SPY')
+
+
+@benchmark('queue_send_pop_100', number=10)
+def _queue_throughput():
+    trade_queue = RedisTradeQueue('benchmark-' + str(uuid.uuid4()))
+
+    def send_and_pop():
+        for _ in range(100):
+            trade_queue.send_trade({'symbol': 'SPY', 'direction': 'neutral', 'allocation': 3,
+                                    'open_criteria': CRITERIA, 'close_criteria': CRITERIA})
+        while len(trade_queue):
+            trade_queue.pop()
+
+    return send_and_pop
+
+
+def run(selected: str = '', repeat: int = 5) -> Dict[str, Dict]:
+    results = {}
+    for name, (setup, number) in benchmarks.items():
+        if selected and selected not in name:
+            continue
+        times = [t / number for t in Timer(setup()).repeat(repeat=repeat, number=number)]
+        results[name] = {'min': min(times), 'median': statistics.median(times), 'number': number}
+        print("{:<32} median {:>12.1f}us  min {:>12.1f}us".format(name, results[name]['median'] * 1e6,
+                                                                 results[name]['min'] * 1e6))
+    return results
+
+
+def compare(results: Dict[str, Dict], baseline: Dict[str, Dict], threshold: float) -> bool:
+    ok = True
+    print()
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        ratio = result['median'] / baseline[name]['median']
+        regressed = ratio > 1 + threshold / 100
+        ok &= not regressed
+        print("{:<32} {:>7.2f}x baseline{}".format(name, ratio, "  REGRESSION" if regressed else ""))
+    return ok
+
+
+def main():
+    parser = ArgumentParser(description='Benchmark the trading hot paths.')
+    parser.add_argument('-k', '--select', default='', help='Only run benchmarks whose name contains this string.')
+    parser.add_argument('-r', '--repeat', type=int, default=5, help='Number of timing runs per benchmark.')
+    parser.add_argument('-s', '--save', metavar='FILE', help='Save the results as a JSON baseline.')
+    parser.add_argument('-c', '--compare', metavar='FILE', help='Compare the results against a JSON baseline.')
+    parser.add_argument('-t', '--threshold', type=float, default=25,
+                        help='Percentage slowdown of the median that counts as a regression.')
+    args = parser.parse_args()
+
+    results = run(args.select, args.repeat)
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump({'python': platform.python_version(), 'machine': platform.machine(),
+                       'date': datetime.now().isoformat(timespec='seconds'), 'results': results},
+                      f, indent=2, sort_keys=True)
+            f.write('\n')
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)['results']
+        if not compare(results, baseline, args.threshold):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,9 +1,11 @@
 import json
 import os
 import subprocess
+import threading
 import uuid
 from datetime import datetime
 from os.path import join, dirname
+from time import sleep
 from typing import Dict
 from unittest.mock import patch
 
@@ -11,25 +13,35 @@ import pytest
 from data import quotes, rh_options_1, exp_dates, td_account_json, bad_options_1, \
     bad_options_2, ULTA_20_close, TSN_20_close, SHOP_20_close, rh_options_close, ma_20_data, quote_data
 
-from magictrade import storage
-from magictrade.broker import InsufficientFundsError, NonexistentAssetError, Broker
+from magictrade import storage, metrics, pricing
+from magictrade.broker import InsufficientFundsError, NonexistentAssetError, Broker, load_brokers, brokers, \
+    BROKER_MODULES, get_broker
 from magictrade.broker.papermoney import PaperMoneyBroker
 from magictrade.broker.robinhood import RHOption
 from magictrade.broker.td_ameritrade import TDAmeritradeBroker, TDOption
 from magictrade.datasource import DummyDataSource
-from magictrade.runner import Runner
+from magictrade.datasource.chains import SyntheticOptionChains
+from magictrade.datasource.quotes import AlphaVantageDataSource, CachedDataSource, RecordedDataSource
+from magictrade.history import AccountHistory
+from magictrade.journal import Journal, read, replay
+from magictrade.broker.shared import MarketDataCache
+from magictrade.runner import Runner, MultiRunner, parse_account_args
+from magictrade.scripts import MultiTradeQueue
 from magictrade.scripts.run_bollinger import check_signals as bb_check_signals
 from magictrade.scripts.run_lin_slope import check_signals as ls_check_signals
 from magictrade.scripts.run_lin_slope import get_n_sma
 from magictrade.securities import InvalidOptionError, DummyOption
 from magictrade.strategy import TradeConfigException, TradeDateException, TradeCriteriaException, NoTradeException, \
-    TradingStrategy
+    TradingStrategy, load_strategies, STRATEGY_MODULES, get_strategy
+from magictrade.strategy.registry import strategies as registered_strategies
 from magictrade.strategy.buyandhold import BuyandHoldStrategy
 from magictrade.strategy.longoption import LongOptionTradingStrategy
 from magictrade.strategy.optionseller import OptionSellerTradingStrategy, strategies, TradeException, high_iv
-from magictrade.trade_queue import RedisTradeQueue
+from magictrade.trade_queue import RedisTradeQueue, TradeQueueException
 from magictrade.utils import get_account_history, get_percentage_change, get_allocation, calculate_percent_otm, \
-    get_risk, from_date_format, find_option_with_probability, get_price_from_change
+    get_risk, from_date_format, find_option_with_probability, get_price_from_change, encode_legs, decode_legs, \
+    get_all_trades, migrate_raw_legs, ExpirationIndex, get_events, migrate_queue, \
+    migrate_account_history
 
 date = datetime.strptime("2019-03-31", "%Y-%m-%d")
 
@@ -119,6 +131,45 @@ class TestPaperMoneyBroker:
         for option in pmb.filter_options(rh_options_1, option_type='put'):
             assert option.option_type == 'put'
 
+    def test_filter_option_record(self):
+        pmb = PaperMoneyBroker(account_id='test', )
+        raw = next(o for o in rh_options_1 if o['type'] == 'call')
+        record = pmb.filter_options(rh_options_1, option_type='call')[0]
+        option = RHOption(raw)
+        assert not hasattr(record, '__dict__')
+        assert record.raw is raw
+        for field in ('id', 'option_type', 'strike_price', 'mark_price', 'probability_otm', 'expiration_date'):
+            assert getattr(record, field) == getattr(option, field)
+        assert record['chain_symbol'] == 'MU'
+        assert record.chain_symbol == 'MU'
+        assert dict(record) == raw
+        with pytest.raises(KeyError):
+            RHOption.record({k: v for k, v in raw.items() if k != 'strike_price'})
+        with pytest.raises(TypeError):
+            RHOption.record({**raw, 'mark_price': None})
+
+    def test_options_positions_data_index(self):
+        pmb = PaperMoneyBroker(account_id='test', options_data=rh_options_1)
+        legs = [RHOption({'option': o['instrument']}) for o in rh_options_1[:2]]
+        assert [leg.mark_price for leg in pmb.options_positions_data(legs)] == \
+               [float(o['mark_price']) for o in rh_options_1[:2]]
+        pmb.options_data = [{**rh_options_1[0], 'mark_price': '1.00'}]
+        legs = [RHOption({'option': rh_options_1[0]['instrument']}), RHOption({'option': 'missing'})]
+        assert pmb.options_positions_data(legs)[0].mark_price == 1.0
+        assert legs[1].data == {'option': 'missing'}
+
+    def test_leg_in_options_index(self):
+        pmb = PaperMoneyBroker(account_id='test')
+        leg = {'option': 'SPY:2019-07-04:250c', 'id': 'leg', 'symbol': 'SPY:2019-07-04:250c'}
+        assert not pmb.leg_in_options(leg, {})
+        pmb.options_transact([({'url': leg['option'], 'symbol': leg['symbol']}, 'sell')], 'credit', 1.0, 1)
+        assert pmb.leg_in_options(leg, {})
+        del pmb.options[next(iter(pmb.options))]
+        assert not pmb.leg_in_options(leg, {})
+        pmb.options_transact([({'url': leg['option'], 'symbol': leg['symbol']}, 'sell')], 'credit', 1.0, 1)
+        pmb.options = {}
+        assert not pmb.leg_in_options(leg, {})
+
     """
     def test_buy_option(self):
         pmb = PaperMoneyBroker(account_id='test', data=quotes)
@@ -183,6 +234,40 @@ class TestPaperMoneyBroker:
         pmb.date = '2019-01-04'
         assert pmb.get_quote('SPY') == 256.01
 
+    def test_historic_quote_datetime(self):
+        pmb = PaperMoneyBroker(account_id='test', data=quotes)
+        pmb.date = from_date_format('2019-01-04')
+        assert pmb.get_quote('SPY') == 256.01
+        pmb.date = '1234'
+        assert pmb.get_quote('SPY') == 252.39
+
+    def test_advance(self):
+        pmb = PaperMoneyBroker(account_id='test', date='2019-01-02', data=quotes)
+        assert pmb.trading_days[:2] == ['2019-01-01', '2019-01-02']
+        assert pmb.day == 1
+        assert pmb.advance() == from_date_format('2019-01-03')
+        assert pmb.get_quote('SPY') == 253.26
+        pmb.advance(2)
+        assert pmb.date == from_date_format('2019-01-05')
+        assert pmb.get_quote('SPY') == 253.11
+        assert pmb.advance() == from_date_format('2019-03-31')
+        with pytest.raises(IndexError):
+            pmb.advance()
+
+    def test_advance_new_data(self):
+        pmb = PaperMoneyBroker(account_id='test', date='2019-01-03', data=quotes)
+        assert pmb.day == 2
+        pmb.data = {'SPY': {'history': {'2019-01-03': 1.0, '2019-01-04': 2.0}}}
+        assert pmb.day == 0
+        assert pmb.advance() == from_date_format('2019-01-04')
+        assert pmb.get_quote('SPY') == 2.0
+
+    def test_advance_from_non_trading_day(self):
+        pmb = PaperMoneyBroker(account_id='test', date='2018-12-25', data=quotes)
+        assert pmb.day == -1
+        pmb.advance()
+        assert pmb.get_quote('SPY') == 255.55
+
     def test_time_buy_sell(self):
         pmb = PaperMoneyBroker(account_id='test', date='2019-01-01', data=quotes)
         pmb.buy('SPY', 100)
@@ -195,19 +280,16 @@ class TestPaperMoneyBroker:
 
 class TestLogging:
     def test_account_history(self):
-        storage.delete('test:dates')
-        storage.delete('test:values')
+        AccountHistory('test').delete()
         pmb = PaperMoneyBroker(account_id='test')
         pmb.log_balance()
         _, h = get_account_history(pmb.account_id)
         assert len(h) == 1
         assert h[0] == 1_000_000
-        storage.delete('test:dates')
-        storage.delete('test:values')
+        AccountHistory('test').delete()
 
     def test_account_history_1(self):
-        storage.delete('test:dates')
-        storage.delete('test:values')
+        AccountHistory('test').delete()
         pmb = PaperMoneyBroker(account_id='test')
         pmb.log_balance()
         pmb._balance = 5_000_000
@@ -219,8 +301,78 @@ class TestLogging:
         assert h[0] == 1_000_000
         assert h[1] == 5_000_000
         assert h[2] == 1_234
-        storage.delete('test:dates')
-        storage.delete('test:values')
+        AccountHistory('test').delete()
+
+    def test_account_history_legacy(self):
+        history = AccountHistory('test-legacy')
+        history.delete()
+        storage.delete('test-legacy:dates', 'test-legacy:values')
+        storage.rpush('test-legacy:dates', '2020-01-02 10-00-00', '2020-01-02 10-30-00')
+        storage.rpush('test-legacy:values', 1_000, 1_500)
+        history.add(datetime(2020, 1, 2, 10, 45).timestamp(), 1_200)
+        assert migrate_account_history('test-legacy', dry_run=True) == 2
+        assert migrate_account_history('test-legacy') == 2
+        assert not storage.exists('test-legacy:dates', 'test-legacy:values')
+        assert get_account_history('test-legacy') == (['2020-01-02 10-00-00', '2020-01-02 10-30-00',
+                                                        '2020-01-02 10-45-00'], [1_000.0, 1_500.0, 1_200.0])
+        hour = datetime(2020, 1, 2, 10).timestamp()
+        assert history.range(resolution='1h') == [(hour, 1_000, 1_500, 1_000, 1_200)]
+        history.delete()
+
+    def test_account_history_rollups(self):
+        history = AccountHistory('test-rollups', retention={'raw': 2 * 3600, '1h': 2 * 86400})
+        history.delete()
+        start = datetime(2020, 1, 1).timestamp() // 86400 * 86400
+        # Every 15 minutes for three days, rising by one each time.
+        for i in range(3 * 96):
+            history.add(start + i * 900, 100 + i)
+        end = start + (3 * 96 - 1) * 900
+        assert len(history.range(resolution='raw')) == 9
+        assert len(history.range(resolution='1h')) == 2 * 24
+        assert history.range(resolution='1d') == [(start, 100, 195, 100, 195),
+                                                  (start + 86400, 196, 291, 196, 291),
+                                                  (start + 2 * 86400, 292, 387, 292, 387)]
+        points = history.range()
+        # Daily rollups until the first whole day of hourly data, hourly until the first whole hour of raw data, then
+        # raw points.
+        assert [p[0] for p in points] == sorted(p[0] for p in points)
+        assert points[0] == (start, 100, 195, 100, 195)
+        assert points[1] == (start + 86400, 196, 199, 196, 199)
+        assert points[-9] == (start + 69 * 3600, 376, 379, 376, 379)
+        assert points[-8] == (end - 6300, 380, 380, 380, 380)
+        assert points[-1] == (end, 387, 387, 387, 387)
+        assert len(points) == 1 + 46 + 8
+        assert len(history.range(max_points=20)) == 3
+        assert len(history.range(start=end - 3600, max_points=10)) == 5
+        assert history.range(start=end - 1800, end=end - 900) == [(end - 1800, 385, 385, 385, 385),
+                                                                  (end - 900, 386, 386, 386, 386)]
+        dates, values = get_account_history('test-rollups', start=end - 900)
+        assert values == [386, 387]
+        assert dates[-1] == datetime.fromtimestamp(end).strftime("%Y-%m-%d %H-%M-%S")
+        with pytest.raises(ValueError):
+            history.range(resolution='1m')
+        history.delete()
+
+    def test_events(self):
+        pmb = PaperMoneyBroker(account_id='test-events')
+        strategy = OptionSellerTradingStrategy(pmb)
+        key = strategy.get_name() + ':events'
+        storage.delete(key, key + ':position-1')
+        strategy.log("started")
+        strategy.log("[position-1]: opened", position='position-1', symbol='SPY', event='open')
+        strategy.log("[position-1]: closed", position='position-1', symbol='SPY', event='close')
+        events = strategy.get_events()
+        assert [e['msg'] for e in events] == ["started", "[position-1]: opened", "[position-1]: closed"]
+        assert events[1]['symbol'] == 'SPY'
+        assert events[1]['strategy'] == 'optionseller'
+        assert events[0]['position'] == ''
+        assert [e['event'] for e in strategy.get_events(position='position-1')] == ['open', 'close']
+        assert strategy.get_events(newest_first=True, count=1)[0]['event'] == 'close'
+        assert strategy.get_events(strategy='longoption') == []
+        assert strategy.get_events(start=events[0]['time'], end=events[-1]['time']) == events
+        assert get_events(strategy.get_name(), start=events[-1]['time'] + 1) == []
+        assert storage.ttl(key + ':position-1') > 0
+        storage.delete(key, key + ':position-1')
 
 
 class TestUtils:
@@ -259,6 +411,233 @@ class TestUtils:
     def test_get_risk_1(self):
         assert get_risk(5, 2.50) == 250
 
+    def test_encode_legs(self):
+        legs = ((RHOption(rh_options_1[0]), 'sell'), (RHOption(rh_options_1[1]), 'buy'))
+        decoded = decode_legs(encode_legs(legs))
+        assert decoded == [(rh_options_1[0], 'sell'), (rh_options_1[1], 'buy')]
+
+    def test_encode_legs_single(self):
+        assert decode_legs(encode_legs([RHOption(rh_options_1[0])])) == [rh_options_1[0]]
+
+    def test_decode_legs_legacy(self):
+        legs = ((RHOption(rh_options_1[0]), 'sell'),)
+        assert decode_legs(str(legs)) == ((rh_options_1[0], 'sell'),)
+        assert decode_legs("[Decimal('1.0')]") == []
+        assert decode_legs(None) == []
+
+    def test_migrate_raw_legs(self):
+        name = 'test-migrate-' + str(uuid.uuid4())
+        legs = ((RHOption(rh_options_1[0]), 'sell'),)
+        storage.set(name + ':raw:1', str(legs))
+        storage.set(name + ':raw:2', encode_legs(legs))
+        storage.set(name + ':raw:3', "[Decimal('1.0')]")
+        assert migrate_raw_legs(name, dry_run=True) == (1, [name + ':raw:3'])
+        assert storage.get(name + ':raw:1') == str(legs)
+        assert migrate_raw_legs(name) == (1, [name + ':raw:3'])
+        assert storage.get(name + ':raw:1') == storage.get(name + ':raw:2')
+        storage.delete(name + ':raw:1', name + ':raw:2', name + ':raw:3')
+
+    def test_migrate_queue(self):
+        old = 'test-migrate-' + str(uuid.uuid4())
+        new = 'test-migrated-' + str(uuid.uuid4())
+        trade_queue = RedisTradeQueue(old)
+        for i in range(7):
+            trade_queue.add('trade-{}'.format(i), {'symbol': 'SPY'})
+        trade_queue.set_status('trade-1', 'placed')
+        storage.lpush(new, 'existing')
+        storage.set(new + ':status:trade-1', 'other')
+        storage.set(old + 'other', 1)
+        totals = []
+        assert migrate_queue(old, new, batch_size=3, dry_run=True) == {'renamed': 7, 'merged': 1, 'dropped': 1}
+        assert len(RedisTradeQueue(old)) == 7
+        assert migrate_queue(old, new, batch_size=3, progress=lambda t: totals.append(sum(t.values()))) == \
+            {'renamed': 7, 'merged': 1, 'dropped': 1}
+        assert totals == [3, 6, 9]
+        assert storage.keys(old + '*') == [old + 'other']
+        moved = RedisTradeQueue(new)
+        assert len(moved) == 8
+        assert moved.all()[0] == 'existing'
+        assert moved.all()[-1] == 'trade-0'
+        assert moved.get_data('trade-3') == {'symbol': 'SPY'}
+        assert moved.get_status('trade-1') == 'other'
+        storage.delete(old + 'other', *storage.keys(new + '*'))
+
+    def test_migrate_queue_scheduled(self):
+        old = 'test-migrate-' + str(uuid.uuid4())
+        new = 'test-migrated-' + str(uuid.uuid4())
+        RedisTradeQueue(old).schedule('spy', 20, {'symbol': 'SPY'})
+        RedisTradeQueue(new).schedule('mu', 10, {'symbol': 'MU'})
+        storage.hset(old + ':claim_owners', 'spy', 'worker-1')
+        storage.hset(new + ':claim_owners', 'mu', 'worker-2')
+        expected = {'renamed': 1, 'merged': 2, 'dropped': 0}
+        assert migrate_queue(old, new, dry_run=True) == expected
+        assert migrate_queue(old, new) == expected
+        assert not storage.keys(old + '*')
+        assert storage.zrange(new + ':scheduled', 0, -1, withscores=True) == [('mu', 10), ('spy', 20)]
+        assert storage.hgetall(new + ':claim_owners') == {'spy': 'worker-1', 'mu': 'worker-2'}
+        moved = RedisTradeQueue(new)
+        assert moved.promote_due(now=30) == 2
+        assert moved.get_data('spy') == {'symbol': 'SPY'}
+        storage.delete(*storage.keys(new + '*'))
+
+
+class TestPricing:
+    def test_price(self):
+        prices = pricing.price(100, [100, 100], 365, 0.2, ['call', 'put'], rate=0.05)
+        assert [round(p, 4) for p in prices] == [10.4506, 5.5735]
+
+    def test_delta(self):
+        deltas = pricing.delta(100, 100, 365, 0.2, [True, False], rate=0.05)
+        assert [round(d, 4) for d in deltas] == [0.6368, -0.3632]
+
+    def test_probability(self):
+        itm = pricing.probability_itm(100, [90, 110], 30, 0.3, ['put', 'call'])
+        otm = pricing.probability_otm(100, [90, 110], 30, 0.3, ['put', 'call'])
+        assert all(0 < p < 0.5 for p in itm)
+        assert [round(p, 6) for p in itm + otm] == [1.0, 1.0]
+
+    def test_expired(self):
+        assert list(pricing.price(100, [90, 110], 0, 0.3, 'call')) == [10, 0]
+        assert list(pricing.probability_otm(100, [90, 110], 0, 0.3, 'call')) == [0, 1]
+
+    def test_fill_probability_otm(self):
+        pmb = PaperMoneyBroker(account_id='test')
+        puts = pmb.filter_options([{**o, 'chance_of_profit_short': None} for o in rh_options_1],
+                                  option_type='put')
+        assert not any(o.probability_otm for o in puts)
+        probabilities = pricing.fill_probability_otm(puts, 38.64, 0.5, date)
+        assert len(probabilities) == len(puts)
+        by_strike = sorted(puts, key=lambda o: (o.expiration_date, -o.strike_price))
+        assert all(0 < o.probability_otm < 1 for o in puts)
+        assert all(a.probability_otm <= b.probability_otm for a, b in zip(by_strike, by_strike[1:])
+                   if a.expiration_date == b.expiration_date)
+
+    def test_fill_probability_otm_keep(self):
+        pmb = PaperMoneyBroker(account_id='test')
+        puts = pmb.filter_options(rh_options_1, option_type='put')
+        before = [o.probability_otm for o in puts]
+        pricing.fill_probability_otm(puts, 38.64, 0.5, date)
+        assert [o.probability_otm for o in puts] == before
+
+    def test_fill_probability_otm_td(self):
+        expiration = 1575493200000
+        puts = [TDOption.record({'symbol': 'SPY_120419P{}'.format(strike), 'putCall': 'PUT', 'strikePrice': strike,
+                                 'mark': 1.0, 'delta': None, 'expirationDate': expiration})
+                for strike in (300, 310, 320)]
+        pricing.fill_probability_otm(puts, 310, 0.2, datetime(2019, 11, 4), overwrite=True)
+        assert all(0 < o.probability_otm < 1 for o in puts)
+        assert puts[0].probability_otm > puts[1].probability_otm > puts[2].probability_otm
+
+    def test_fill_probability_otm_no_expiration(self):
+        pmb = PaperMoneyBroker(account_id='test')
+        puts = pmb.filter_options([{**o, 'expiration_date': None} for o in rh_options_1], option_type='put')
+        with pytest.raises(ValueError):
+            pricing.fill_probability_otm(puts, 38.64, 0.5, date)
+
+
+class CountingDataSource(DummyDataSource):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.requests = []
+
+    def get_quotes(self, symbols):
+        self.requests.append(list(symbols))
+        return {symbol: self['quotes'][symbol] for symbol in symbols}
+
+
+class TestQuoteSources:
+    def test_dummy(self):
+        source = DummyDataSource(quotes={'SPY': 252.39, 'MU': 38.64}, history={'SPY': [250.0, 251.0]})
+        assert source.get_quotes(['SPY', 'MU']) == {'SPY': 252.39, 'MU': 38.64}
+        assert source.get_historic_close('SPY', 1) == [251.0]
+
+    def test_cached(self):
+        source = CountingDataSource(quotes={'SPY': 252.39, 'MU': 38.64})
+        cached = CachedDataSource(source)
+        assert cached.get_quote('SPY') == 252.39
+        assert cached.get_quotes(['SPY', 'MU']) == {'SPY': 252.39, 'MU': 38.64}
+        assert cached.get_quote('MU') == 38.64
+        assert source.requests == [['SPY'], ['MU']]
+        cached.ttl = 0
+        cached.clear()
+        cached.get_quotes(['SPY', 'MU'])
+        cached.get_quote('SPY')
+        assert source.requests[2:] == [['SPY', 'MU'], ['SPY']]
+
+    def test_recorded(self, tmp_path):
+        path = str(tmp_path / 'quotes.json')
+        source = CountingDataSource(quotes={'SPY': 252.39, 'MU': 38.64},
+                                    history={'SPY': [250.0, 251.0, 252.0]})
+        recorder = RecordedDataSource(path, source)
+        assert recorder.get_quotes(['SPY', 'MU']) == {'SPY': 252.39, 'MU': 38.64}
+        assert recorder.get_historic_close('SPY', 3) == [250.0, 251.0, 252.0]
+        replay = RecordedDataSource(path)
+        assert replay.get_quote('MU') == 38.64
+        assert replay.get_historic_close('SPY', 2) == [251.0, 252.0]
+        with pytest.raises(KeyError):
+            replay.get_quote('MSFT')
+        assert source.requests == [['SPY', 'MU']]
+
+    def test_paper_money(self, tmp_path):
+        path = str(tmp_path / 'quotes.json')
+        with open(path, 'w') as f:
+            json.dump({'quotes': {'SPY': 252.39}}, f)
+        pmb = PaperMoneyBroker(account_id='test', data_source=RecordedDataSource(path))
+        assert pmb.get_quote('SPY') == 252.39
+        pmb.buy('SPY', 10)
+        assert round(pmb.stocks['SPY'].value, 2) == 2523.9
+
+    def test_alphavantage_no_key(self):
+        with pytest.raises(ValueError):
+            AlphaVantageDataSource(api_key=None)
+        # The default source is only created when a quote is needed, so the broker works without a key.
+        assert PaperMoneyBroker(account_id='test', data=quotes).get_quote('SPY')
+
+
+class TestSyntheticOptionChains:
+    def test_chain(self):
+        chains = SyntheticOptionChains.from_quotes(quotes, volatility=0.2)
+        chain = chains.get_chain('SPY', '2019-01-03')
+        assert chain is chains.get_chain('SPY', from_date_format('2019-01-03'))
+        assert {o['expiration_date'] for o in chain} == set(chains.expiration_dates('2019-01-03'))
+        assert chains.expiration_dates('2019-01-03')[:2] == ['2019-01-04', '2019-01-11']
+        assert all(o['delta'] >= 0 if o['type'] == 'call' else o['delta'] <= 0 for o in chain)
+        assert all(o['mark_price'] >= 0.01 for o in chain)
+
+    def test_spot(self):
+        chains = SyntheticOptionChains.from_quotes(quotes)
+        assert chains.get_spot('SPY', '2019-01-04') == 256.01
+        assert chains.get_spot('SPY', '2019-01-07') == 253.11
+        with pytest.raises(KeyError):
+            chains.get_spot('SPY', '2018-12-31')
+
+    def test_cache_size(self):
+        chains = SyntheticOptionChains.from_quotes(quotes, cache_size=2)
+        chain = chains.get_chain('SPY', '2019-01-02')
+        chains.get_chain('SPY', '2019-01-03')
+        chains.get_chain('SPY', '2019-01-04')
+        assert chains.get_chain('SPY', '2019-01-02') is not chain
+
+    def test_quote_contract(self):
+        chains = SyntheticOptionChains.from_quotes(quotes, volatility=0.2)
+        assert chains.quote_contract('SPY:2019-01-04:255p', '2019-01-05') == {
+            'mark_price': 1.89, 'delta': -1.0, 'chance_of_profit_short': 0.0}
+        quote = chains.quote_contract('SPY:2019-01-18:255c', '2019-01-03')
+        assert quote['mark_price'] == next(o['mark_price'] for o in chains.get_chain('SPY', '2019-01-03')
+                                           if o['id'] == 'SPY:2019-01-18:255c')
+
+    def test_backtest_trade(self):
+        chains = SyntheticOptionChains.from_quotes(quotes, volatility=0.2)
+        pmb = PaperMoneyBroker(account_id=str(uuid.uuid4()), date='2019-01-03', data=quotes, option_chains=chains)
+        oa = OptionSellerTradingStrategy(pmb)
+        result = oa.make_trade('SPY', 'bullish', 60, days_out=30)
+        assert result['status'] == 'placed'
+        assert {leg.expiration_date for leg, _ in result['legs']} == {'2019-02-01'}
+        pmb.date = '2019-01-04'
+        legs = [RHOption(leg) for leg in pmb.options_positions()[result['order'].id]]
+        assert all(leg.mark_price for leg in pmb.options_positions_data(legs))
+        assert oa.maintenance() == []
+
 
 class TestBAHStrategy:
     def test_buy_and_hold(self):
@@ -366,6 +745,30 @@ class TestOAStrategy:
         assert osts._get_target_date({'timeline': [30, 60]}, options, days_out=45) == '2019-05-17'
         assert osts._get_target_date({'timeline': [30, 60]}, options, days_out=60) == '2019-05-17'
 
+    def test_get_target_date_blacklist(self):
+        pmb = PaperMoneyBroker(date=date, account_id='test')
+        osts = OptionSellerTradingStrategy(pmb)
+        options = {'expiration_dates': exp_dates}
+        blacklist = set()
+        found = []
+        for _ in range(len(exp_dates)):
+            found.append(osts._get_target_date({'timeline': [30, 60]}, options, days_out=30,
+                                                blacklist_dates=blacklist))
+            blacklist.add(found[-1])
+        assert found[:4] == ['2019-05-03', '2019-04-26', '2019-05-10', '2019-04-18']
+        assert sorted(found) == sorted(exp_dates)
+        with pytest.raises(TradeException):
+            osts._get_target_date({'timeline': [30, 60]}, options, days_out=30, blacklist_dates=blacklist)
+
+    def test_expiration_index(self):
+        index = ExpirationIndex(['2019-04-12', '2019-04-05', '2019-04-19'])
+        target = from_date_format('2019-04-15').toordinal()
+        assert index.nearest(target) == '2019-04-12'
+        assert index.nearest(target + 1) == '2019-04-19'
+        assert index.nearest(target, {'2019-04-12'}) == '2019-04-19'
+        assert index.nearest(target, {'2019-04-12', '2019-04-19'}) == '2019-04-05'
+        assert index.nearest(target, set(index.dates)) is None
+
     def test_get_target_date_monthly(self):
         pmb = PaperMoneyBroker(account_id='test', balance=1_000_000, date=datetime.strptime('2019-11-24', '%Y-%m-%d'))
         osts = OptionSellerTradingStrategy(pmb)
@@ -534,8 +937,25 @@ class TestOAStrategy:
         assert len(legs) == 2
         assert result['order'].legs[0]["id"] in legs
         assert result['order'].legs[1]["id"] in legs
+        trade = get_all_trades(name)[0]
+        assert trade['data']['strategy'] == 'credit_spread'
+        assert [side for _, side in trade['instrument']] == ['sell', 'buy']
         osts.delete_position(oid)
 
+    def test_load_positions(self):
+        name = str(uuid.uuid4())
+        pmb = PaperMoneyBroker(account_id=name, date=date, data=quotes, options_data=rh_options_1,
+                               exp_dates=exp_dates)
+        osts = OptionSellerTradingStrategy(pmb)
+        first = osts.make_trade('MU', 'bearish', high_iv)['order']
+        second = osts.make_trade('MU', 'neutral', 52)['order']
+        positions = osts.load_positions([first.id, second.id])
+        assert [p[0] for p in positions] == [first.id, second.id]
+        assert positions[0][1]['strategy'] == 'credit_spread'
+        assert positions[1][1]['strategy'] == 'iron_condor'
+        assert {leg['id'] for leg in positions[0][2]} == {leg['id'] for leg in first.legs}
+        assert len(positions[1][2]) == 4
+
     def test_maintenance_no_action(self):
         name = str(uuid.uuid4())
         pmb = PaperMoneyBroker(account_id=name, date=date, data=quotes, options_data=rh_options_1,
@@ -1027,6 +1447,18 @@ class TestBroker:
         assert Broker.parse_leg(leg) == (leg[0], 'buy')
 
 
+class TestRegistry:
+    def test_broker_manifest(self):
+        load_brokers()
+        assert set(brokers) == set(BROKER_MODULES)
+        assert get_broker('papermoney') is PaperMoneyBroker
+
+    def test_strategy_manifest(self):
+        load_strategies()
+        assert set(registered_strategies) == set(STRATEGY_MODULES)
+        assert get_strategy('optionseller') is OptionSellerTradingStrategy
+
+
 class TestRobinhoodBroker:
     pass
 
@@ -1074,6 +1506,11 @@ class TestTDAmeritradeBroker:
     def test_mark_price(self):
         assert TDOption({'mark': 150}).mark_price == 150
 
+    def test_expiration_date(self):
+        assert TDOption({'expirationDate': 1575493200000}).expiration_date == '2019-12-04'
+        assert TDOption.record({'symbol': 'SPY_120419P310', 'putCall': 'PUT', 'strikePrice': 310, 'mark': 1.0,
+                                'expirationDate': 1575493200000}).expiration_date == '2019-12-04'
+
     def test_filter_options_type_puts(self, broker: TDAmeritradeBroker, options: Dict):
         filtered = broker.filter_options(options, ['2019-12-23'])
         filtered = broker.filter_options(filtered, option_type='put')
@@ -1171,7 +1608,7 @@ class TestRunner:
 
     @pytest.fixture
     def trade_queue(self):
-        storage.delete('test-runner-queue')
+        storage.delete('test-runner-queue', 'test-runner-queue:scheduled')
         return RedisTradeQueue('test-runner-queue')
 
     @pytest.fixture
@@ -1216,6 +1653,10 @@ class TestRunner:
         trade_queue.add(identifier, trade)
         assert runner.get_next_trade() == (None, None)
         trade_queue.staged_to_queue()
+        assert len(trade_queue) == 0
+        assert storage.zscore(trade_queue.queue_name + ':scheduled', identifier) == trade['start']
+        assert trade_queue.promote_due(runner.broker.date.timestamp()) == 0
+        assert trade_queue.promote_due(trade['start']) == 1
         assert len(trade_queue) == 1
 
     def test_get_next_trade_after_start(self, trade_queue, identifier):
@@ -1371,6 +1812,392 @@ class TestRunner:
         trade_queue.add(identifier, trade)
         assert runner.get_next_trade()[0] == identifier
 
+    def test_parse_account_args(self):
+        os.environ['TEST_RUNNER_PASSWORD'] = 'hunter2'
+        args, credentials = parse_account_args({'broker': 'robinhood', 'strategies': ['optionseller', 'wheel'],
+                                                'queue_name': 'rh', 'username': 'user', 'allocation': 20,
+                                                'password_env': 'TEST_RUNNER_PASSWORD'})
+        assert (args.broker, args.strategies, args.queue_name, args.allocation) == \
+               ('robinhood', ['optionseller', 'wheel'], 'rh', 20)
+        assert credentials == {'username': 'user', 'password': 'hunter2', 'mfa_code': None}
+        assert not args.debug
+        with pytest.raises(SystemExit):
+            parse_account_args({'broker': 'robinhood', 'strategies': ['wheel'], 'bogus': 1})
+
+    def test_multi_runner(self):
+        runners = []
+        for name in ('test-multi-runner-1', 'test-multi-runner-2'):
+            args, _ = parse_account_args({'broker': 'papermoney', 'strategies': ['optionseller'],
+                                          'queue_name': name}, debug=True)
+            broker = PaperMoneyBroker(account_id=name, data=quotes)
+            runners.append(Runner(args, RedisTradeQueue(name), broker, [OptionSellerTradingStrategy(broker)]))
+            storage.delete(name + ':last_maintenance')
+        multi_runner = MultiRunner(runners)
+        multi_runner.start()
+        assert all(thread.is_alive() for thread in multi_runner.threads)
+        for _ in range(50):
+            if all(storage.get(runner.trade_queue.queue_name + ':last_maintenance') for runner in runners):
+                break
+            sleep(0.1)
+        else:
+            pytest.fail("Maintenance did not run for every account.")
+        multi_runner.stop(timeout=5)
+        assert not any(thread.is_alive() for thread in multi_runner.threads)
+
+    def test_market_data_cache(self):
+        calls = []
+        live = PaperMoneyBroker(account_id='test-live', data=quotes)
+        live.name = 'live'
+        get_quote = live.get_quote
+        live.get_quote = lambda symbol: calls.append(symbol) or get_quote(symbol)
+        paper = PaperMoneyBroker(account_id='test', data=quotes)
+        mirror = PaperMoneyBroker(broker=live)
+        cache = MarketDataCache(ttl=60)
+        assert cache.share(paper) is paper and cache.share(mirror) is mirror
+        assert 'get_quote' not in vars(paper)
+        assert mirror.get_quote('SPY') == live.get_quote('SPY') == 252.39
+        assert calls == ['SPY']
+        cache.clear()
+        live.get_quote('SPY')
+        assert calls == ['SPY', 'SPY']
+
+
+class TestTradeQueue:
+    @pytest.fixture
+    def queue_name(self):
+        name = 'test-queue-' + str(uuid.uuid4())
+        yield name
+        storage.delete(name, name + ':processing', name + ':claims', name + ':claim_owners', name + ':scheduled',
+                       name + ':expiring', name + ':lane:high', name + ':lane:low')
+
+    def test_reliable_claim_ack(self, queue_name):
+        worker_1 = RedisTradeQueue(queue_name, reliable=True)
+        worker_2 = RedisTradeQueue(queue_name, reliable=True)
+        worker_1.add('trade-1', {'symbol': 'SPY'})
+        worker_1.add('trade-2', {'symbol': 'MU'})
+        assert worker_1.pop() == ('trade-1', {'symbol': 'SPY'})
+        assert worker_2.pop() == ('trade-2', {'symbol': 'MU'})
+        assert worker_1.pop()[0] is None
+        assert [(i, c) for i, c, _ in worker_1.processing()] == [('trade-1', worker_1.consumer),
+                                                                  ('trade-2', worker_2.consumer)]
+        assert not worker_2.ack('trade-1')
+        assert worker_1.ack('trade-1')
+        assert worker_2.ack('trade-2')
+        assert not worker_1.processing()
+        assert not storage.llen(queue_name + ':processing')
+
+    def test_reliable_redelivery(self, queue_name):
+        crashed = RedisTradeQueue(queue_name, reliable=True, visibility_timeout=-1)
+        worker = RedisTradeQueue(queue_name, reliable=True)
+        crashed.add('trade-1', {'symbol': 'SPY'})
+        crashed.add('trade-2', {'symbol': 'MU'})
+        assert crashed.pop()[0] == 'trade-1'
+        assert worker.pop()[0] == 'trade-1'
+        assert not crashed.ack('trade-1')
+        assert not crashed.extend('trade-1')
+        assert worker.extend('trade-1', 60)
+        assert worker.ack('trade-1')
+        assert worker.pop()[0] == 'trade-2'
+        assert len(worker) == 0
+
+    def test_reliable_release(self, queue_name):
+        worker = RedisTradeQueue(queue_name, reliable=True)
+        worker.add('trade-1', {'symbol': 'SPY'})
+        worker.pop()
+        worker.stage_trade('trade-1')
+        worker.staged_to_queue()
+        assert worker.all() == ['trade-1']
+        assert not worker.processing()
+        assert not worker.release('trade-1')
+
+    def test_schedule(self, queue_name):
+        trade_queue = RedisTradeQueue(queue_name)
+        now = datetime.now().timestamp()
+        later = trade_queue.send_trade({'symbol': 'SPY', 'start': now + 3600})
+        soon = trade_queue.send_trade({'symbol': 'MU', 'start': now + 60})
+        ready = trade_queue.send_trade({'symbol': 'MSFT', 'start': now - 60})
+        assert trade_queue.all() == [ready]
+        assert storage.zrange(queue_name + ':scheduled', 0, -1, withscores=True) == [(soon, now + 60),
+                                                                                     (later, now + 3600)]
+        assert trade_queue.promote_due() == 0
+        assert trade_queue.promote_due(now + 3600) == 2
+        assert trade_queue.all() == [later, soon, ready]
+        assert not storage.zcard(queue_name + ':scheduled')
+        assert trade_queue.get_data(later)['symbol'] == 'SPY'
+
+    def test_promote_batches(self, queue_name):
+        trade_queue = RedisTradeQueue(queue_name)
+        for i in range(2500):
+            trade_queue.schedule(str(i), i)
+        assert trade_queue.promote_due(1999) == 2000
+        assert trade_queue.all()[-3:] == ['2', '1', '0']
+        assert storage.zcard(queue_name + ':scheduled') == 500
+
+    def test_sweep_expired(self, queue_name):
+        trade_queue = RedisTradeQueue(queue_name)
+        now = datetime.now().timestamp()
+        criteria = [{'expr': 'price > 1'}]
+        expired = trade_queue.send_trade({'symbol': 'SPY', 'end': now - 7200, 'open_criteria': criteria,
+                                          'close_criteria': criteria})
+        trade_queue.set_status(expired, 'deferred')
+        recent = trade_queue.send_trade({'symbol': 'MU', 'end': now - 60})
+        scheduled = trade_queue.send_trade({'symbol': 'MSFT', 'start': now + 60, 'end': now + 120})
+        forever = trade_queue.send_trade({'symbol': 'AAPL'})
+        assert trade_queue.sweep_expired(now, retention=3600) == 1
+        assert not storage.exists(queue_name + ':' + expired, queue_name + ':' + expired + ':open_criteria',
+                                  queue_name + ':' + expired + ':close_criteria', queue_name + ':status:' + expired)
+        assert trade_queue.get_data(recent)
+        assert trade_queue.sweep_expired(now + 180, retention=0) == 2
+        assert not storage.zcard(queue_name + ':scheduled')
+        assert trade_queue.get_data(forever)
+        assert not storage.zcard(queue_name + ':expiring')
+
+    def test_runner_skips_swept(self, queue_name):
+        trade_queue = RedisTradeQueue(queue_name)
+        runner = Runner(None, trade_queue, PaperMoneyBroker(account_id='test-runner', date=datetime(2020, 1, 23)),
+                        None)
+        trade_queue.add('swept', {'symbol': 'SPY', 'end': datetime(2020, 1, 22).timestamp()})
+        trade_queue.add('live', {'symbol': 'MU'})
+        trade_queue.sweep_expired(datetime(2020, 1, 23).timestamp(), retention=0)
+        assert runner.get_next_trade()[0] == 'live'
+        assert not len(trade_queue)
+
+    def test_priority(self, queue_name):
+        trade_queue = RedisTradeQueue(queue_name)
+        for identifier, priority in (('low', 'low'), ('normal-1', None), ('high-1', 'high'), ('normal-2', 'normal'),
+                                     ('high-2', 'high')):
+            trade_queue.add(identifier, {'symbol': 'SPY', **({'priority': priority} if priority else {})})
+        assert len(trade_queue) == 5
+        assert set(trade_queue.all()) == {'low', 'normal-1', 'normal-2', 'high-1', 'high-2'}
+        assert [next(trade_queue) for _ in range(5)] == trade_queue.all()
+        with pytest.raises(StopIteration):
+            next(trade_queue)
+        assert [trade_queue.pop()[0] for _ in range(6)] == ['high-1', 'high-2', 'normal-1', 'normal-2', 'low', None]
+        with pytest.raises(TradeQueueException):
+            trade_queue.send_trade({'symbol': 'SPY', 'priority': 'urgent'})
+        assert not len(trade_queue)
+
+    def test_priority_reliable(self, queue_name):
+        trade_queue = RedisTradeQueue(queue_name, reliable=True, visibility_timeout=-1)
+        trade_queue.add('normal', {'symbol': 'SPY'})
+        trade_queue.add('high', {'symbol': 'SPY', 'priority': 'high'})
+        assert trade_queue.pop()[0] == 'high'
+        # The expired claim goes back to the high lane and is delivered ahead of the normal trade.
+        assert trade_queue.pop()[0] == 'high'
+        trade_queue.stage_trade('high')
+        trade_queue.staged_to_queue()
+        assert storage.lrange(queue_name + ':lane:high', 0, -1) == ['high']
+
+    def test_priority_scheduled(self, queue_name):
+        trade_queue = RedisTradeQueue(queue_name)
+        now = datetime.now().timestamp()
+        trade_queue.send_trade({'symbol': 'SPY'})
+        urgent = trade_queue.send_trade({'symbol': 'MU', 'start': now + 60, 'priority': 'high'})
+        trade_queue.promote_due(now + 60)
+        assert trade_queue.pop()[0] == urgent
+        trade_queue.stage_trade(urgent)
+        trade_queue.staged_to_queue()
+        assert trade_queue.pop()[0] == urgent
+
+    def test_runner_defers(self, queue_name):
+        trade_queue = RedisTradeQueue(queue_name)
+        runner = Runner(None, trade_queue, PaperMoneyBroker(account_id='test-runner', date=datetime(2020, 1, 23)),
+                        None)
+        runner.handle_results({'status': 'deferred', 'timeout': 60}, 'deferred', {'symbol': 'SPY'})
+        assert not len(trade_queue)
+        assert storage.zscore(queue_name + ':scheduled', 'deferred') == datetime(2020, 1, 23).timestamp() + 60
+        assert trade_queue.get_status('deferred') == 'deferred'
+
+    def test_runner_acks(self, queue_name):
+        trade_queue = RedisTradeQueue(queue_name, reliable=True)
+        runner = Runner(None, trade_queue, PaperMoneyBroker(account_id='test-runner', date=datetime(2020, 1, 23)),
+                        None)
+        trade_queue.add('expired', {'symbol': 'SPY', 'end': datetime(2020, 1, 22).timestamp()})
+        trade_queue.add('placed', {'symbol': 'SPY'})
+        trade_queue.set_status('placed', 'placed')
+        trade_queue.add('future', {'symbol': 'SPY', 'start': datetime(2020, 1, 24).timestamp()})
+        assert runner.get_next_trade() == (None, None)
+        assert not trade_queue.processing()
+        assert storage.zrange(queue_name + ':scheduled', 0, -1) == ['future']
+        storage.delete(queue_name + ':status:placed', queue_name + ':scheduled')
+
+    def test_runner_timeout_while_placing(self, queue_name):
+        broker = PaperMoneyBroker(account_id='test-runner', date=datetime(2020, 1, 23))
+        runner_1 = Runner(None, RedisTradeQueue(queue_name, reliable=True, visibility_timeout=0.1), broker, None)
+        runner_2 = Runner(None, RedisTradeQueue(queue_name, reliable=True, visibility_timeout=0.1), broker, None)
+        runner_1.trade_queue.add('trade-1', {'symbol': 'SPY'})
+        placed = []
+
+        def slow_trade(trade, identifier):
+            # The claim expires while the order is being placed, and another worker gets the trade.
+            sleep(0.2)
+            assert runner_2.trade_queue.redeliver_expired() == 1
+            identifier_2, trade_2 = runner_2.get_next_trade()
+            assert identifier_2 == 'trade-1'
+            runner_2.process_trade(identifier_2, trade_2)
+            assert runner_2.trade_queue.ack(identifier_2)
+            placed.append(identifier)
+            return {'status': 'placed'}
+
+        with patch.object(runner_1, 'make_trade', side_effect=slow_trade), \
+                patch.object(runner_2, 'make_trade', side_effect=AssertionError("Trade placed twice")):
+            identifier, trade = runner_1.get_next_trade()
+            runner_1.process_trade(identifier, trade)
+        assert placed == ['trade-1']
+        assert runner_1.trade_queue.get_status('trade-1') == 'placed'
+        assert not storage.exists(queue_name + ':placing:trade-1')
+        assert not runner_1.trade_queue.processing()
+        assert not len(runner_1.trade_queue)
+        storage.delete(*storage.keys(queue_name + '*'))
+
+    def test_runner_interrupted_while_placing(self, queue_name):
+        broker = PaperMoneyBroker(account_id='test-runner', date=datetime(2020, 1, 23))
+        runner = Runner(None, RedisTradeQueue(queue_name, reliable=True, visibility_timeout=-1), broker, [])
+        runner.trade_queue.add('trade-1', {'symbol': 'SPY', 'strategy': 'missing'})
+        identifier, trade = runner.get_next_trade()
+        with pytest.raises(Exception, match='Invalid strategy'):
+            runner.process_trade(identifier, trade)
+        # An error escaping make_trade still clears the marker.
+        assert not storage.exists(queue_name + ':placing:trade-1')
+        # A worker that stopped while placing leaves the marker behind. The redelivered trade is recorded as failed
+        # rather than dropped or placed again.
+        assert runner.trade_queue.start_placing('trade-1')
+        assert runner.trade_queue.redeliver_expired() == 1
+        identifier, trade = runner.get_next_trade()
+        with patch.object(runner, 'make_trade', side_effect=AssertionError("Trade placed twice")):
+            runner.process_trade(identifier, trade)
+        assert runner.trade_queue.get_status('trade-1').startswith('Interrupted while placing')
+        assert storage.lrange(queue_name + '-failed', 0, -1) == ['trade-1']
+        storage.delete(*storage.keys(queue_name + '*'), queue_name + '-failed')
+
+    def test_multi_trade_queue(self, queue_name):
+        # A separate client stands in for a queue on another Redis host.
+        other_host = storage.__class__(connection_pool=storage.connection_pool)
+        queues = [RedisTradeQueue(queue_name), RedisTradeQueue(queue_name + '-2'),
+                  RedisTradeQueue(queue_name + '-3', storage=other_host)]
+        multi = MultiTradeQueue(queues)
+        identifiers = multi.send_trade({'symbol': 'SPY', 'open_criteria': [{'expr': 'price > 1'}],
+                                        'priority': 'high'})
+        assert len(identifiers) == 3
+        for queue, identifier in zip(queues, identifiers):
+            assert queue.all() == [identifier]
+            assert queue.get_criteria(identifier)[0] == [{'expr': 'price > 1'}]
+        multi.add('trade-1', {'symbol': 'MU'})
+        multi.set_status('trade-1', 'placed')
+        assert multi.get_status('trade-1') == ['placed'] * 3
+        assert multi.get_data('trade-1') == [{'symbol': 'MU'}] * 3
+        assert [len(identifiers) for identifiers in multi.all()] == [2] * 3
+        assert MultiTradeQueue(queues, single_return=True).get_status('trade-1') == 'placed'
+        assert multi.queue_name == queue_name
+        storage.delete(*storage.keys(queue_name + '*'))
+
+    def test_iter_with_data(self, queue_name):
+        trade_queue = RedisTradeQueue(queue_name)
+        for i in range(5):
+            trade_queue.add('spy-{}'.format(i), {'symbol': 'SPY', 'strategy': 'iron_condor'})
+        trade_queue.add('mu', {'symbol': 'MU', 'strategy': 'credit_spread', 'priority': 'high'})
+        trade_queue.schedule('aapl', 10, {'symbol': 'AAPL'})
+        trade_queue.set_status('spy-3', 'deferred')
+        trades = list(trade_queue.iter_with_data(batch_size=2))
+        assert [i for i, _, _ in trades] == ['mu', 'spy-4', 'spy-3', 'spy-2', 'spy-1', 'spy-0', 'aapl']
+        assert trades[0] == ('mu', {'symbol': 'MU', 'strategy': 'credit_spread', 'priority': 'high'}, None)
+        assert trades[2][2] == 'deferred'
+        assert [i for i, _, _ in trade_queue.iter_with_data(symbol='spy', status='deferred')] == ['spy-3']
+        assert [i for i, _, _ in trade_queue.iter_with_data(strategy='credit_spread')] == ['mu']
+        assert len(list(trade_queue.iter_with_data(scheduled=False))) == 6
+        storage.delete(*storage.keys(queue_name + '*'))
+
+    def test_wait_for_status(self, queue_name):
+        trade_queue = RedisTradeQueue(queue_name)
+        assert trade_queue.wait_for_status('trade-1', timeout=0.1) is None
+
+        def handle():
+            sleep(0.1)
+            trade_queue.set_status('trade-1', 'deferred')
+            sleep(0.1)
+            trade_queue.add_failed('trade-1', 'error')
+
+        thread = threading.Thread(target=handle)
+        thread.start()
+        assert trade_queue.wait_for_status('trade-1', timeout=5) == 'error'
+        thread.join()
+        assert trade_queue.wait_for_status('trade-1', timeout=0) == 'error'
+        trade_queue.set_status('trade-2', 'deferred')
+        assert trade_queue.wait_for_status('trade-2', timeout=0.1) is None
+        assert trade_queue.wait_for_status('trade-2', ignore=()) == 'deferred'
+        storage.delete(*storage.keys(queue_name + '*'))
+
+
+class TestJournal:
+    @pytest.fixture
+    def queue_name(self):
+        name = 'test-journal-' + str(uuid.uuid4())
+        yield name
+        storage.delete(name, name + '-failed', name + ':scheduled', name + ':expiring', name + ':lane:high',
+                       *storage.keys(name + ':*'))
+
+    def test_replay(self, queue_name, tmp_path):
+        path = str(tmp_path / 'journal.jsonl')
+        journal = Journal(path)
+        trade_queue = RedisTradeQueue(queue_name, journal=journal)
+        trade_queue.add('trade-1', {'symbol': 'SPY', 'priority': 'high'})
+        trade_queue.send_trade({'symbol': 'MU', 'open_criteria': [{'expr': 'price > 10'}]})
+        trade_queue.add_failed('trade-1', 'error')
+        trade_queue.schedule('trade-3', 10, {'symbol': 'AAPL'})
+        assert trade_queue.promote_due(now=20) == 1
+        assert trade_queue.pop()[0] == 'trade-1'
+        reliable = RedisTradeQueue(queue_name, reliable=True, journal=journal)
+        reliable.add('trade-4', {'symbol': 'QQQ'})
+        identifier, _ = reliable.pop()
+        reliable.set_status(identifier, 'placed')
+        assert reliable.ack(identifier)
+        journal.close()
+
+        keys = storage.keys(queue_name + '*')
+        before = {key: storage.dump(key) for key in keys}
+        storage.delete(*keys)
+        assert replay(path) == len(list(read(path)))
+        assert {key: storage.dump(key) for key in storage.keys(queue_name + '*')} == before
+        # Popped and acknowledged trades must not come back on the queue.
+        assert 'trade-1' not in trade_queue.all()
+        assert identifier not in trade_queue.all()
+        assert not reliable.processing()
+
+    def test_pipeline_and_torn_record(self, tmp_path):
+        path = str(tmp_path / 'journal.jsonl')
+        journal = Journal(path, flush_interval=0)
+        pipe = journal.wrap(storage).pipeline()
+        pipe.set('test-journal', 1)
+        pipe.get('test-journal')
+        assert journal.flush(timeout=5)
+        assert not list(read(path))
+        assert pipe.execute() == [True, '1']
+        journal.close()
+        with pytest.raises(ValueError):
+            journal.append('set', 'test-journal', 2)
+        with open(path, 'a') as f:
+            f.write('{"ts": 1, "op": "set", "args": ["test-jour')
+        assert [r['op'] for r in read(path)] == ['set']
+        storage.delete('test-journal')
+        assert replay(path) == 1
+        assert storage.get('test-journal') == '1'
+        storage.delete('test-journal')
+
+    def test_reopen_torn(self, tmp_path):
+        path = str(tmp_path / 'journal.jsonl')
+        journal = Journal(path, flush_interval=0)
+        journal.append('set', 'test-journal-a', 1)
+        journal.close()
+        with open(path, 'a') as f:
+            f.write('{"ts": 1, "op": "set", "args": ["test-jour')
+        journal = Journal(path, flush_interval=0)
+        journal.append('set', 'test-journal-c', 3)
+        journal.close()
+        assert [r['args'][0] for r in read(path)] == ['test-journal-a', 'test-journal-c']
+        assert replay(path) == 2
+        assert storage.get('test-journal-c') == '3'
+        storage.delete('test-journal-a', 'test-journal-c')
+
 
 class TestBB:
     @pytest.fixture
@@ -1428,6 +2255,43 @@ class TestNewCore:
         assert len(m)
 
 
+class TestMetrics:
+    @pytest.fixture(autouse=True)
+    def reset(self):
+        metrics.reset()
+        yield
+        metrics.disable()
+        metrics.reset()
+
+    def test_disabled(self):
+        pmb = PaperMoneyBroker(account_id='test', data=quotes)
+        pmb.get_quote('SPY')
+        assert metrics.render() == '\n'
+
+    def test_broker_timing(self):
+        metrics.enable()
+        pmb = PaperMoneyBroker(account_id='test', data=quotes)
+        for _ in range(3):
+            pmb.get_quote('SPY')
+        text = metrics.render()
+        assert '# TYPE magictrade_broker_call_seconds summary' in text
+        assert 'magictrade_broker_call_seconds_count{broker="papermoney",method="get_quote"} 3' in text
+        assert 'magictrade_broker_call_seconds{broker="papermoney",method="get_quote",quantile="0.99"}' in text
+
+    def test_counter(self):
+        metrics.enable()
+        metrics.increment('runner_trades', status='placed')
+        metrics.increment('runner_trades', status='placed')
+        assert 'magictrade_runner_trades_total{status="placed"} 2' in metrics.render()
+
+    def test_write(self, tmp_path):
+        metrics.enable()
+        with metrics.timer('test_block'):
+            pass
+        metrics.write(str(tmp_path / 'metrics.prom'))
+        assert 'magictrade_test_block_seconds_count 1' in (tmp_path / 'metrics.prom').read_text()
+
+
 class TestLinReg:
     def test_get_n_sma(self):
         assert [round(n, 2) for n in get_n_sma(quote_data, len(ma_20_data), 20)] == ma_20_data